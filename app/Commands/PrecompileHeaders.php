@@ -0,0 +1,56 @@
+<?php
+/**
+ * Copyright (C) 2026 Richard Lobb
+
+ * The jobe:pch spark command, which builds the C++ precompiled headers
+ * (see app/Libraries/PrecompiledHeaders.php), so that they're never
+ * built on the request path. Run it with
+ *     php spark jobe:pch
+ * as the web server user, from the Jobe install directory. The installer
+ * runs it if precompiled headers are enabled, but it must be rerun after
+ * the C++ compiler is upgraded, as until then programs are compiled
+ * without precompiled headers.
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+namespace App\Commands;
+
+use CodeIgniter\CLI\BaseCommand;
+use CodeIgniter\CLI\CLI;
+use Jobe\CppTask;
+use Jobe\PrecompiledHeaders;
+
+class PrecompileHeaders extends BaseCommand
+{
+    protected $group = 'Jobe';
+    protected $name = 'jobe:pch';
+    protected $description = 'Builds the precompiled headers used to compile C++ programs.';
+    protected $usage = 'jobe:pch';
+
+    public function run(array $params)
+    {
+        if (!PrecompiledHeaders::isEnabled()) {
+            CLI::error('Precompiled headers are not enabled');
+            return EXIT_ERROR;
+        }
+        $dir = CppTask::buildPrecompiledHeaders();
+        if ($dir === null) {
+            CLI::error("Couldn't build the C++ precompiled headers");
+            return EXIT_ERROR;
+        }
+        CLI::write("C++ precompiled headers are in $dir");
+        return EXIT_SUCCESS;
+    }
+}
@@ -0,0 +1,61 @@
+<?php
+/**
+ * Copyright (C) 2026 Richard Lobb
+
+ * The jobe:reaper spark command, which maintains the workspace pools
+ * (see app/Libraries/WorkspacePool.php), deleting used workspaces and
+ * making new ones, and drains the cleanup queue (see
+ * app/Libraries/CleanupQueue.php), all off the request path. Run it with
+ *     php spark jobe:reaper
+ * as the web server user, from the Jobe install directory. Just one
+ * reaper should be kept running, e.g. by systemd.
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+namespace App\Commands;
+
+use CodeIgniter\CLI\BaseCommand;
+use CodeIgniter\CLI\CLI;
+use Jobe\CleanupQueue;
+use Jobe\WorkspacePool;
+
+define('REAPER_IDLE_SLEEP_USECS', 100000);  // Polling interval when there's nothing to do
+
+class Reaper extends BaseCommand
+{
+    protected $group = 'Jobe';
+    protected $name = 'jobe:reaper';
+    protected $description = 'Maintains the pools of ready-made run workspaces and drains the cleanup queue.';
+    protected $usage = 'jobe:reaper';
+
+    public function run(array $params)
+    {
+        $usePool = WorkspacePool::isEnabled();
+        $useQueue = CleanupQueue::isEnabled();
+        if (!$usePool && !$useQueue) {
+            CLI::error('Neither workspace pools nor the cleanup queue are enabled');
+            return EXIT_ERROR;
+        }
+        while (true) {
+            $numDone = $useQueue ? CleanupQueue::drain() : 0;
+            if ($usePool) {
+                $numDone += WorkspacePool::reap();
+            }
+            if ($numDone == 0) {
+                usleep(REAPER_IDLE_SLEEP_USECS);
+            }
+        }
+    }
+}
@@ -0,0 +1,125 @@
+<?php
+/**
+ * Copyright (C) 2026 Richard Lobb
+
+ * The jobe:worker spark command, which executes queued asynchronous runs
+ * (see app/Libraries/RunQueue.php). Run it with
+ *     php spark jobe:worker
+ * as the web server user, from the Jobe install directory. A few such
+ * workers (typically fewer than jobe_max_users, leaving some Jobe users
+ * for synchronous runs) should be kept running, e.g. by systemd.
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+namespace App\Commands;
+
+use CodeIgniter\CLI\BaseCommand;
+use CodeIgniter\CLI\CLI;
+use Jobe\JobException;
+use Jobe\LanguageTask;
+use Jobe\OverloadException;
+use Jobe\ResultObject;
+use Jobe\RunExecutor;
+use Jobe\RunQueue;
+use Jobe\RunSpecifier;
+use Jobe\TraceCapture;
+
+define('WORKER_IDLE_SLEEP_USECS', 50000);  // Queue polling interval when idle
+define('WORKER_REQUEUE_SLEEP_USECS', 500000);  // Pause after requeueing a run
+define('WORKER_TIDY_INTERVAL', 60);        // Secs between tidies of the queue
+
+class Worker extends BaseCommand
+{
+    protected $group = 'Jobe';
+    protected $name = 'jobe:worker';
+    protected $description = 'Executes queued asynchronous runs.';
+    protected $usage = 'jobe:worker [--max-runs N]';
+    protected $options = [
+        '--max-runs' => 'Exit after executing this many runs (default: never), e.g. to be restarted by systemd',
+    ];
+
+    public function run(array $params)
+    {
+        if (!RunQueue::isEnabled()) {
+            CLI::error('Asynchronous runs are disabled (async_queue_size is 0)');
+            return EXIT_ERROR;
+        }
+        $maxRuns = intval(CLI::getOption('max-runs') ?? 0);
+        $numRuns = 0;
+        $lastTidyTime = 0;
+        while ($maxRuns == 0 || $numRuns < $maxRuns) {
+            if (time() - $lastTidyTime >= WORKER_TIDY_INTERVAL) {
+                RunQueue::tidy();
+                $lastTidyTime = time();
+            }
+            $job = RunQueue::claim();
+            if ($job === null) {
+                usleep(WORKER_IDLE_SLEEP_USECS);
+                continue;
+            }
+            [$runId, $submitTime, $postData] = $job;
+            if ($this->execute($runId, $submitTime, $postData)) {
+                $numRuns++;
+            } else {
+                // Give a Jobe user time to become free before reclaiming.
+                usleep(WORKER_REQUEUE_SLEEP_USECS);
+            }
+        }
+        return EXIT_SUCCESS;
+    }
+
+
+    // Execute the given run and record its result. Return false if it has
+    // been requeued instead because no Jobe user was free. A run still
+    // without a free user async_max_wait secs after submission is completed
+    // with a server overload result, as a synchronous run would be.
+    private function execute($runId, $submitTime, $postData)
+    {
+        $run = null;
+        $executor = new RunExecutor();
+        try {
+            $run = new RunSpecifier($postData);
+            $resultobject = $executor->run($run);
+            RunQueue::complete($runId, 200, $resultobject);
+            TraceCapture::record($submitTime, $run, $resultobject->outcome, 200,
+                $executor->compileTime, $executor->runTime);
+        } catch (OverloadException $e) {
+            if (microtime(true) - $submitTime < config('Jobe')->async_max_wait) {
+                // All Jobe users are busy. Wait for one rather than failing the run.
+                RunQueue::requeue($runId);
+                return false;
+            }
+            log_message('error', "jobe:worker: run $runId: overload exception occurred");
+            $resultobject = new ResultObject(0, LanguageTask::RESULT_SERVER_OVERLOAD);
+            RunQueue::complete($runId, 200, $resultobject);
+            if ($run !== null) {
+                TraceCapture::record($submitTime, $run, $resultobject->outcome, 200, 0.0, 0.0);
+            }
+        } catch (JobException $e) {
+            $message = $e->getMessage();
+            log_message('error', "jobe:worker: run $runId: $message");
+            RunQueue::complete($runId, $e->getHttpStatusCode(), $message);
+            if ($run !== null) {
+                TraceCapture::record($submitTime, $run, null, $e->getHttpStatusCode(),
+                    $executor->compileTime, $executor->runTime);
+            }
+        } catch (\Throwable $e) {
+            $message = 'Server exception (' . $e->getMessage() . ')';
+            log_message('error', "jobe:worker: run $runId: $message");
+            RunQueue::complete($runId, 500, $message);
+        }
+        return true;
+    }
+}
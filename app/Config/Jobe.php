@@ -40,8 +40,116 @@ class Jobe extends BaseConfig
     |
     */
     public string $clean_up_path = '/tmp;/var/tmp;/var/crash;/run/lock;/var/lock';
+
+    /*
+    | If private_tmp is true, each job sees its jobe user's own directory
+    | /home/jobe/tmp/jobeNN mounted over /tmp, /var/tmp, /var/crash and
+    | /run/lock (see PRIVATE_TMP_MOUNTS in runguard/runguard-config.h), so
+    | cleaning up just means emptying that directory, rather than searching
+    | all of clean_up_path (which is then ignored) for the user's files.
+    */
+    public bool $private_tmp = false;
     public bool $debugging = false;  // If True, the workspace folder for a run is not deleted.
 
+    /*
+    | The size budget, in megabytes, of the cache of files PUT to the server in
+    | /home/jobe/files. When a PUT takes the cache over budget, the least-
+    | recently-used files are deleted until it's below 80% of the budget. A
+    | value of 0 gives the old behaviour of deleting all files unused for two
+    | days when the disk is over 95% full.
+    */
+    public int $file_cache_mb = 2000;
+
+    /*
+    | The maximum size, in megabytes, of a file uploaded by an octet-stream
+    | PUT or a multipart POST. Larger uploads get status 413. Any upload size
+    | limit of the web server applies as well.
+    */
+    public int $file_put_max_mb = 100;
+
+    /*
+    | Successful compilations of C, C++, Java and Pascal programs are
+    | cached in /home/jobe/compilecache (made by the installer), keyed by the
+    | compiler version, compile parameters and the contents of the source and
+    | support files, so that an identical compilation just restores the
+    | compiled files. When the cache exceeds $compile_cache_mb megabytes, the
+    | least-recently-used entries are deleted. A value of 0 disables the cache.
+    */
+    public int $compile_cache_mb = 500;
+
+    /*
+    | If precompiled_headers is true, C++ programs compiled with the default
+    | compileargs use GCC precompiled headers for <bits/stdc++.h> and
+    | <iostream> (see app/Libraries/PrecompiledHeaders.php). The headers are
+    | built in /home/jobe/pch by the command 'php spark jobe:pch', which the
+    | installer runs if this option is true. Rerun it, as the web server
+    | user, after enabling this option or upgrading g++. Until then, C++
+    | programs are compiled without precompiled headers.
+    */
+    public bool $precompiled_headers = false;
+
+    /*
+    | Asynchronous runs. A run_spec with a true 'async' attribute is added to a
+    | queue in /home/jobe/queue and the POST returns at once with a run_id. The
+    | queued runs are executed by one or more 'php spark jobe:worker' processes,
+    | which must be started separately (see README.md), and the result is
+    | retrieved by a GET of /restapi/runs/<run_id>. If the
+    | queue already holds $async_queue_size runs, the POST gets a server
+    | overload response. A value of 0 (the default) disables asynchronous
+    | runs; set it to e.g. 1000 once workers are running. Results are
+    | kept for $async_result_ttl seconds. A queued run that still can't get a
+    | free Jobe user $async_max_wait seconds after it was submitted is
+    | completed with a server overload result.
+    */
+    public int $async_queue_size = 0;
+    public int $async_result_ttl = 3600;
+    public int $async_max_wait = 300;
+
+    /*
+    | Workspace pools. If $workspace_pool_size is greater than 0, the
+    | 'php spark jobe:reaper' command keeps that many ready-made run
+    | directories for each jobe user, and deletes used ones, so that runs
+    | don't have to make and delete their own. If the reaper isn't running,
+    | runs make their own directories as usual.
+    */
+    public int $workspace_pool_size = 0;
+
+    /*
+    | Cleanup queue. If $cleanup_queue is true and the 'php spark jobe:reaper'
+    | command is running, a finished run's Jobe user and directories are
+    | queued for cleanup by the reaper, which frees the user only when all its
+    | processes and files are gone, rather than the run cleaning up before
+    | the response is sent.
+    */
+    public bool $cleanup_queue = false;
+
+    /*
+    |--------------------------------------------------------------------------
+    | Workload capture
+    |--------------------------------------------------------------------------
+    |
+    | If $trace_capture_file is non-empty, every run submitted to the server is
+    | appended to that gzipped JSONL file, which must be writable by the web
+    | server (e.g. '/var/log/jobe/trace.jsonl.gz'). The file is in the format
+    | read by loadtester.py --replay. When it exceeds $trace_capture_max_mb
+    | megabytes it is renamed with a timestamp suffix and a new file is begun.
+    | The source code and standard input of each run are recorded only if
+    | $trace_capture_sourcecode is true; otherwise just their sizes are
+    | recorded. Bear in mind that student code may be considered personal data.
+    */
+    public string $trace_capture_file = '';
+    public int $trace_capture_max_mb = 100;
+    public bool $trace_capture_sourcecode = false;
+
+    /*
+    | If $metrics_enabled is true, counters and histograms of runs, waits for
+    | Jobe users, overloads, compile/execute/cleanup times and file cache use
+    | are kept in shared memory and reported, along with the number of active
+    | Jobe users, by a GET of /restapi/metrics (see README.md). Collection
+    | takes a System V semaphore on every update, so it is off by default.
+    */
+    public bool $metrics_enabled = false;
+
     /*
      | $python3_version is either a full path to the required python interpreter
      | or a single token. In the latter case the token is prefixed by /usr/bin/ when
@@ -92,4 +200,26 @@ class Jobe extends BaseConfig
     */
     public string $javac_extraflags = ''; //'-J-XX:ActiveProcessorCount=1';
     public string $java_extraflags = ''; //'-XX:ActiveProcessorCount=1';
+
+    /*
+    | If java_fast_startup is true, java and javac are run with JVM options
+    | intended to reduce startup overhead: JIT compilation stops at the C1
+    | compiler (-XX:TieredStopAtLevel=1) and the serial garbage collector is
+    | used (-XX:+UseSerialGC), which also reduces the number of JVM threads.
+    | The saving hasn't been measured on Jobe, so benchmark it on your own
+    | workload before enabling this. Without the C2 compiler, long CPU-bound
+    | programs can run several times slower, so runs that pass within their
+    | cputime limit by default may then fail with a time-limit result.
+    */
+    public bool $java_fast_startup = false;
+
+    /*
+    | If javac_server_socket is not empty, Java programs are compiled by the
+    | compile server (javacserver/JobeJavacServer.java) listening on that Unix
+    | domain socket, which must be started separately (see README.md).
+    | Jobe falls back to running javac itself if the server isn't running
+    | or is too busy, or if the run specifies compileargs or javac_extraflags
+    | has -J options.
+    */
+    public string $javac_server_socket = '';  // e.g. '/home/jobe/javac/javac.sock'
 }
@@ -18,6 +18,11 @@ $routes->head('jobe/files/(:alphanum)', 'Files::head/$1');
 $routes->get('/restapi/languages/', 'Languages::get');
 $routes->get('/restapi/languages', 'Languages::get');
 $routes->post('/restapi/runs', 'Runs::post');
+$routes->get('/restapi/runs/(:alphanum)', 'Runs::get/$1');
+$routes->post('/restapi/batches', 'Batches::post');
+$routes->post('/restapi/files', 'Files::post');
+$routes->post('/restapi/files/missing', 'Files::missing');
 $routes->put('/restapi/files/(:alphanum)', 'Files::put/$1');
 $routes->head('/restapi/files/(:alphanum)', 'Files::head/$1');
+$routes->get('/restapi/metrics', 'Metrics::get');
 $routes->options('(:any)', '', ['filter' => 'cors']);
@@ -3,6 +3,8 @@
 namespace Config;
 
 use CodeIgniter\Config\BaseService;
+use CodeIgniter\HTTP\IncomingRequest;
+use CodeIgniter\HTTP\UserAgent;
 
 /**
  * Services Configuration file.
@@ -29,4 +31,28 @@ class Services extends BaseService
      *     return new \CodeIgniter\Example();
      * }
      */
+
+    /**
+     * As for the core incomingrequest service, except that the body of a PUT
+     * with Content-Type application/octet-stream isn't read, so that
+     * Files::put can stream it from php://input into the file cache
+     * rather than holding it in memory.
+     *
+     * @return IncomingRequest
+     */
+    public static function incomingrequest(?App $config = null, bool $getShared = true)
+    {
+        if ($getShared) {
+            return static::getSharedInstance('request', $config);
+        }
+
+        $config ??= config(App::class);
+        $body = 'php://input';
+        if (($_SERVER['REQUEST_METHOD'] ?? '') === 'PUT' &&
+                stripos($_SERVER['CONTENT_TYPE'] ?? '', 'application/octet-stream') === 0) {
+            $body = null;
+        }
+
+        return new IncomingRequest($config, static::get('uri'), $body, new UserAgent());
+    }
 }
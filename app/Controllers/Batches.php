@@ -0,0 +1,138 @@
+<?php
+/**
+ * Copyright (C) 2026 Richard Lobb
+
+ * The controller for managing posts to the 'batches' resource, which
+ * compiles a single program and runs it with each of a list of cases
+ * (standard input and parameters), in the same workspace.
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+namespace App\Controllers;
+
+use CodeIgniter\RESTful\ResourceController;
+use Jobe\ResultObject;
+use Jobe\JobException;
+use Jobe\OverloadException;
+use Jobe\BatchSpecifier;
+use Jobe\LanguageTask;
+use Jobe\Metrics;
+use Jobe\TraceCapture;
+
+class Batches extends ResourceController
+{
+    // Returns an array of result objects, one per case. If the compilation
+    // fails, every case gets the compilation-error result. Each case is
+    // recorded in the metrics and trace as if it were an individual run.
+    public function post()
+    {
+        $arrivalTime = microtime(true);
+        $batch = null;
+        $compileTime = 0.0;
+        $runTimes = [];
+
+        try {
+            // Extract info from the POST data, raising JobException if bad.
+            $json = $this->request->getJSON();
+            $batch = new BatchSpecifier($json);
+            $numCases = count($batch->cases);
+
+            $reqdTaskClass = "\\Jobe\\" . ucwords($batch->language_id) . 'Task';
+            $task = new $reqdTaskClass($batch->sourcefilename, $batch->input, $batch->parameters);
+
+            $results = [];
+            try {
+                $startTime = microtime(true);
+                $task->prepareExecutionEnvironment($batch->sourcecode, $batch->files);
+                $setupTime = microtime(true) - $startTime;
+                log_message('debug', "batches_post: compiling job {$task->id}");
+                $startTime = microtime(true);
+                $task->compileWithCache();
+                $compileTime = microtime(true) - $startTime;
+                if (!empty($task->cmpinfo)) {
+                    $results = array_fill(0, $numCases, $task->resultObject());
+                    $runTimes = array_fill(0, $numCases, 0.0);
+                } else {
+                    $task->freezeWorkspace();
+                    foreach ($batch->cases as $i => $case) {
+                        log_message('debug', "batches_post: executing case $i of job {$task->id}");
+                        $startTime = microtime(true);
+                        if ($i > 0) {
+                            $task->resetWorkspace();
+                        }
+                        $task->setRunParameters($case['input'], $case['parameters']);
+                        $task->execute();
+                        $runTimes[] = microtime(true) - $startTime;
+                        $results[] = $task->resultObject();
+                    }
+                }
+            } finally {
+                // Free user and delete task run directory unless it's a debug run.
+                $startTime = microtime(true);
+                $task->close(!$batch->debug);
+                $cleanupTime = microtime(true) - $startTime;
+            }
+
+            $this->recordMetrics($batch, $results, $runTimes, $setupTime, $compileTime, $cleanupTime);
+            foreach ($results as $i => $resultobject) {
+                TraceCapture::record($arrivalTime, $batch->caseRun($i), $resultobject->outcome, 200,
+                    $compileTime, $runTimes[$i]);
+            }
+            log_message('debug', "batches_post: returning 200 OK for task {$task->id}");
+            return $this->respond($results, 200);
+
+        // Report any errors.
+        } catch (JobException $e) {
+            $message = $e->getMessage();
+            log_message('error', "batches_post: $message");
+            if ($batch !== null) {
+                foreach (array_keys($batch->cases) as $i) {
+                    TraceCapture::record($arrivalTime, $batch->caseRun($i), null, $e->getHttpStatusCode(),
+                        $compileTime, $runTimes[$i] ?? 0.0);
+                }
+            }
+            return $this->respond($message, $e->getHttpStatusCode());
+        } catch (OverloadException $e) {
+            log_message('error', 'batches_post: overload exception occurred');
+            $resultobject = new ResultObject(0, LanguageTask::RESULT_SERVER_OVERLOAD);
+            foreach (array_keys($batch->cases) as $i) {
+                TraceCapture::record($arrivalTime, $batch->caseRun($i), $resultobject->outcome, 200, 0.0, 0.0);
+            }
+            return $this->respond(array_fill(0, $numCases, $resultobject), 200);
+        } catch (\Throwable $e) {
+            $message = 'Server exception (' . $e->getMessage() . ')';
+            log_message('error', "batches_post: $message");
+            return $this->respond($message, 500);
+        }
+    }
+
+
+    // Record the outcome and timings of each case of the completed batch in
+    // the server's metrics, as RunExecutor does for an individual run. The
+    // setup, compile and cleanup are done once, so are observed only once.
+    private function recordMetrics($batch, $results, $runTimes, $setupTime, $compileTime, $cleanupTime)
+    {
+        $labels = ['language' => $batch->language_id];
+        foreach ($results as $i => $resultobject) {
+            Metrics::increment('jobe_runs_total', $labels + ['outcome' => $resultobject->outcome]);
+            if ($resultobject->outcome != LanguageTask::RESULT_COMPILATION_ERROR) {
+                Metrics::observe('jobe_execute_seconds', $labels, $runTimes[$i]);
+            }
+        }
+        Metrics::observe('jobe_setup_seconds', $labels, $setupTime);
+        Metrics::observe('jobe_compile_seconds', $labels, $compileTime);
+        Metrics::observe('jobe_cleanup_seconds', $labels, $cleanupTime);
+    }
+}
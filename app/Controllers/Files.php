@@ -26,16 +26,23 @@ use Jobe\ResultObject;
 use Jobe\JobException;
 use Jobe\FileCache;
 
+define('MAX_BULK_FILE_IDS', 1000);  // Upper limit on the number of ids in a bulk request
+
 class Files extends ResourceController
 {
 
-    // Put (i.e. create or update) a file
+    // Put (i.e. create or update) a file. The body is either JSON, with the
+    // base-64 encoded contents in the file_contents attribute, or (with
+    // Content-Type application/octet-stream) the raw contents.
     public function put($fileId = false)
     {
         log_message('debug', "Put file called with fileId $fileId");
         if ($fileId === false) {
             return $this->respond('No file id in URL', 400);
         }
+        if (stripos($this->request->getHeaderLine('Content-Type'), 'application/octet-stream') === 0) {
+            return $this->putStream($fileId);
+        }
         $json = $this->request->getJSON();
         if (!$json || !isset($json->file_contents)) {
             return $this->respond('put: missing file_contents parameter', 400);
@@ -55,6 +62,86 @@ class Files extends ResourceController
     }
 
 
+    // Put a file whose raw contents are the body of the request, which is
+    // streamed from php://input into the cache (see Config\Services).
+    private function putStream($fileId)
+    {
+        $input = fopen('php://input', 'rb');
+        try {
+            $len = FileCache::streamPutContents($fileId, $input);
+        } catch (JobException $e) {
+            return $this->respond($e->getMessage(), $e->getHttpStatusCode());
+        } finally {
+            fclose($input);
+        }
+        if ($len === false) {
+            return $this->respond("put: failed to write file $fileId to cache", 500);
+        }
+        log_message('debug', "Put file $fileId, size $len (streamed)");
+        return $this->respond(null, 204);
+    }
+
+
+    // Put several files at once. The body is multipart/form-data with one
+    // file part per file, named by its file id. Each is streamed from PHP's
+    // upload temporary file into the cache.
+    public function post()
+    {
+        $files = $this->request->getFiles();
+        if (empty($files)) {
+            return $this->respond('post: no files in request', 400);
+        }
+        foreach ($files as $fileId => $file) {
+            if (is_array($file) || !ctype_alnum(strval($fileId))) {
+                return $this->respond("post: invalid file id '$fileId'", 400);
+            }
+            if (!$file->isValid()) {
+                return $this->respond("post: upload of file $fileId failed ({$file->getErrorString()})", 400);
+            }
+        }
+        foreach ($files as $fileId => $file) {
+            $input = fopen($file->getTempName(), 'rb');
+            try {
+                $len = FileCache::streamPutContents($fileId, $input);
+            } catch (JobException $e) {
+                return $this->respond($e->getMessage(), $e->getHttpStatusCode());
+            } finally {
+                fclose($input);
+            }
+            if ($len === false) {
+                return $this->respond("post: failed to write file $fileId to cache", 500);
+            }
+            log_message('debug', "Put file $fileId, size $len (bulk)");
+        }
+        return $this->respond(null, 204);
+    }
+
+
+    // Check which of a list of files exist. The body is JSON with the list
+    // of file ids in the file_ids attribute. Responds with an object whose
+    // 'missing' attribute lists the ids of those not in the cache.
+    public function missing()
+    {
+        $json = $this->request->getJSON();
+        if (!$json || !isset($json->file_ids) || !is_array($json->file_ids)) {
+            return $this->respond('missing: missing file_ids parameter', 400);
+        }
+        if (count($json->file_ids) > MAX_BULK_FILE_IDS) {
+            return $this->respond('missing: too many file ids (max ' . MAX_BULK_FILE_IDS . ')', 400);
+        }
+        $missing = [];
+        foreach ($json->file_ids as $fileId) {
+            if (!is_string($fileId) || !ctype_alnum($fileId)) {
+                return $this->respond('missing: invalid file id', 400);
+            }
+            if (!FileCache::fileExists($fileId)) {
+                $missing[] = $fileId;
+            }
+        }
+        return $this->respond(['missing' => $missing], 200);
+    }
+
+
     // Check file
     public function head($fileId)
     {
@@ -0,0 +1,42 @@
+<?php
+/**
+ * Copyright (C) 2026 Richard Lobb
+
+ * The controller for GETs of the 'metrics' resource, which returns the
+ * server's metrics in the Prometheus text exposition format.
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+namespace App\Controllers;
+
+use CodeIgniter\RESTful\ResourceController;
+use Jobe\JobException;
+
+class Metrics extends ResourceController
+{
+    public function get()
+    {
+        try {
+            $text = \Jobe\Metrics::render();
+        } catch (JobException $e) {
+            log_message('error', 'metrics_get: ' . $e->getMessage());
+            return $this->respond($e->getMessage(), $e->getHttpStatusCode());
+        }
+        return $this->response
+            ->setStatusCode(200)
+            ->setContentType('text/plain; version=0.0.4')
+            ->setBody($text);
+    }
+}
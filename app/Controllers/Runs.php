@@ -26,50 +26,62 @@ use Jobe\ResultObject;
 use Jobe\JobException;
 use Jobe\OverloadException;
 use Jobe\RunSpecifier;
+use Jobe\RunExecutor;
+use Jobe\RunQueue;
+use Jobe\StreamedResultResponse;
 use Jobe\LanguageTask;
+use Jobe\TraceCapture;
+
+define('MAX_RESULT_WAIT_SECS', 2);  // Upper limit on the 'wait' parameter of get
+define('RESULT_POLL_USECS', 20000);  // Interval between checks for a result in get
 
 class Runs extends ResourceController
 {
     public function post()
     {
+        $arrivalTime = microtime(true);
+        $run = null;
+        $executor = new RunExecutor();
+
         // Extract the run object from the post data and validate.
         try {
             // Extract info from the POST data, raising JobException if bad.
             $json = $this->request->getJSON();
             $run = new RunSpecifier($json);
 
-            // Create the task.
-
-            $reqdTaskClass = "\\Jobe\\" . ucwords($run->language_id) . 'Task';
-            $this->task = new $reqdTaskClass($run->sourcefilename, $run->input, $run->parameters);
-
-            // The nested tries here are a bit ugly, but the point is that we want to
-            // to clean up the task with close() before handling the exception.
-            try {
-                $this->task->prepareExecutionEnvironment($run->sourcecode, $run->files);
-                log_message('debug', "runs_post: compiling job {$this->task->id}");
-                $this->task->compile();
-                if (empty($this->task->cmpinfo)) {
-                    log_message('debug', "runs_post: executing job {$this->task->id}");
-                    $this->task->execute();
-                }
-            } finally {
-                // Free user and delete task run directory unless it's a debug run.
-                $this->task->close(!$run->debug);
+            if ($run->async) {
+                $runId = RunQueue::enqueue($json);
+                log_message('debug', "runs_post: queued run $runId, returning 202 Accepted");
+                return $this->respond(['run_id' => $runId], 202);
             }
 
+            $resultobject = $executor->run($run);
+
             // Success!
-            log_message('debug', "runs_post: returning 200 OK for task {$this->task->id}");
-            return $this->respond($this->task->resultObject(), 200);
+            log_message('debug', "runs_post: returning 200 OK for task {$executor->task->id}");
+            TraceCapture::record($arrivalTime, $run, $resultobject->outcome, 200,
+                $executor->compileTime, $executor->runTime);
+            $stdoutFile = $executor->task->stdoutFile;
+            if ($stdoutFile !== null && file_exists($stdoutFile)) {
+                return $this->streamedResponse($resultobject, $stdoutFile);
+            }
+            return $this->respond($resultobject, 200);
 
         // Report any errors.
         } catch (JobException $e) {
             $message = $e->getMessage();
             log_message('error', "runs_post: $message");
+            if ($run !== null) {
+                TraceCapture::record($arrivalTime, $run, null, $e->getHttpStatusCode(),
+                    $executor->compileTime, $executor->runTime);
+            }
             return $this->respond($message, $e->getHttpStatusCode());
         } catch (OverloadException $e) {
             log_message('error', 'runs_post: overload exception occurred');
             $resultobject = new ResultObject(0, LanguageTask::RESULT_SERVER_OVERLOAD);
+            if ($run !== null) {
+                TraceCapture::record($arrivalTime, $run, $resultobject->outcome, 200, 0.0, 0.0);
+            }
             return $this->respond($resultobject, 200);
         } catch (\Throwable $e) {
             $message = 'Server exception (' . $e->getMessage() . ')';
@@ -77,4 +89,46 @@ class Runs extends ResourceController
             return $this->respond($message, 500);
         }
     }
+
+
+    // Return a response that streams the given result, with its stdout
+    // read from the given file, keeping any headers already set (e.g. by filters).
+    private function streamedResponse($resultobject, $stdoutFile)
+    {
+        $response = new StreamedResultResponse($resultobject, $stdoutFile);
+        foreach ($this->response->headers() as $name => $header) {
+            if (strcasecmp($name, 'Content-Type') != 0) {
+                $response->setHeader($name, $this->response->getHeaderLine($name));
+            }
+        }
+        return $response;
+    }
+
+
+    // Get the result of an asynchronous run. If the run hasn't finished,
+    // wait up to the number of seconds given by the optional 'wait' query
+    // parameter (at most MAX_RESULT_WAIT_SECS, as a web server worker is
+    // held meanwhile; clients should poll instead) for it to do so. Responds with the result object if the
+    // run has finished (or the error message and HTTP status if it failed),
+    // otherwise with 202 Accepted and an object with attributes run_id and
+    // status ('queued' or 'running').
+    public function get($runId = null)
+    {
+        if (!RunQueue::isValidId($runId)) {
+            return $this->respond('get: invalid run id', 400);
+        }
+        $wait = min(max(floatval($this->request->getGet('wait') ?? 0), 0), MAX_RESULT_WAIT_SECS);
+        $deadline = microtime(true) + $wait;
+        while (($result = RunQueue::result($runId)) === null && microtime(true) < $deadline) {
+            usleep(RESULT_POLL_USECS);
+        }
+        if ($result !== null) {
+            return $this->respond($result['result'], $result['http_status']);
+        }
+        $status = RunQueue::status($runId);
+        if ($status === null) {
+            return $this->respond("get: no such run ($runId)", 404);
+        }
+        return $this->respond(['run_id' => $runId, 'status' => $status], 202);
+    }
 }
@@ -0,0 +1,78 @@
+<?php
+
+/* ==============================================================
+ *
+ * This file defines the BatchSpecifier class, which captures all
+ * the data from the POST batch-specifier. This is a run_spec plus
+ * an array of cases, each of which may specify its own standard input
+ * and parameters. The program is compiled only once for all cases,
+ * so per-case compile and link arguments are not allowed. Batches
+ * are always synchronous, buffered and without metrics.
+ *
+ * ==============================================================
+ *
+ * @copyright  2026 Richard Lobb, University of Canterbury
+ * @license    http://www.gnu.org/copyleft/gpl.html GNU GPL v3 or later
+ */
+
+namespace Jobe;
+
+define('MAX_BATCH_CASES', 100);
+
+class BatchSpecifier extends RunSpecifier
+{
+    // Each case is an associative array with keys 'input' and 'parameters'.
+    // The parameters are those of the run_spec overridden by those of the case.
+    public array $cases = [];
+
+    public function __construct($postDataJson)
+    {
+        $run = $postDataJson->run_spec ?? null;
+        foreach (['async', 'stream', 'metrics'] as $flag) {
+            if (is_object($run) && !empty($run->$flag)) {
+                throw new JobException("run_spec attribute '$flag' is not allowed in a batch", 400);
+            }
+        }
+        parent::__construct($postDataJson);
+        $cases = $postDataJson->cases ?? null;
+        if (!is_array($cases) || count($cases) == 0) {
+            throw new JobException('No cases array found in post data', 400);
+        }
+        if (count($cases) > MAX_BATCH_CASES) {
+            throw new JobException('A batch may have at most ' . MAX_BATCH_CASES . ' cases', 400);
+        }
+
+        foreach ($cases as $case) {
+            if (!is_object($case)) {
+                throw new JobException('Each case in a batch must be an object', 400);
+            }
+            $input = $case->input ?? $this->input;
+            if (!is_string($input)) {
+                throw new JobException('The input for a case must be a string', 400);
+            }
+            $parameters = (array) ($case->parameters ?? []);
+            foreach (['compileargs', 'linkargs'] as $param) {
+                if (array_key_exists($param, $parameters)) {
+                    throw new JobException("Parameter '$param' cannot be set for individual cases", 400);
+                }
+            }
+            $parameters = array_merge($this->parameters, $parameters);
+            self::validateParameters($parameters);
+            $this->cases[] = ['input' => $input, 'parameters' => $parameters];
+        }
+    }
+
+
+    /**
+     * @param int $i the index of a case.
+     * @return RunSpecifier the equivalent individual run of the given case.
+     */
+    public function caseRun($i)
+    {
+        $run = clone $this;
+        $run->input = $this->cases[$i]['input'];
+        $run->parameters = $this->cases[$i]['parameters'];
+        $run->cases = [];
+        return $run;
+    }
+}
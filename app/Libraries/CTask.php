@@ -59,4 +59,10 @@ class CTask extends LanguageTask
     {
         return '';
     }
+
+    // Compilation is slow enough to be worth caching.
+    protected function isCompileCacheable()
+    {
+        return true;
+    }
 }
@@ -0,0 +1,100 @@
+<?php
+
+/* ==============================================================
+ *
+ * This file defines the CleanupQueue class, which manages the queue of
+ * finished runs awaiting cleanup by the jobe:reaper command (see
+ * app/Commands/Reaper.php). With the queue enabled, LanguageTask::close
+ * just queues the run's jobe user and directories, so the response can be
+ * sent at once. The reaper then kills the user's remaining processes,
+ * deletes its temporary files and the run's directories and only then
+ * frees the user, so no later run can see anything left behind.
+ *
+ * Each queued run is a file CLEANUP_QUEUE_BASE/<seq>_<user number>.json
+ * containing a JSON list of the directories to delete, where <seq> is the
+ * time of queueing, so that sorting the file names gives FIFO order.
+ * The reaper touches the file CLEANUP_QUEUE_BASE/.heartbeat on every
+ * cycle. If that hasn't happened within the last CLEANUP_HEARTBEAT_SECS
+ * seconds, the reaper is taken to be not running and runs clean up after
+ * themselves as usual.
+ *
+ * ==============================================================
+ *
+ * @copyright  2026 Richard Lobb, University of Canterbury
+ * @license    http://www.gnu.org/copyleft/gpl.html GNU GPL v3 or later
+ */
+
+namespace Jobe;
+
+define('CLEANUP_QUEUE_BASE', '/home/jobe/cleanup');
+define('CLEANUP_HEARTBEAT_SECS', 5);
+
+class CleanupQueue
+{
+    /**
+     * @return true iff the cleanup queue is enabled in the config file.
+     */
+    public static function isEnabled()
+    {
+        return config('Jobe')->cleanup_queue;
+    }
+
+
+    /**
+     * @return true iff the cleanup queue is enabled and a reaper is draining it.
+     */
+    public static function isActive()
+    {
+        if (!self::isEnabled()) {
+            return false;
+        }
+        clearstatcache(true, CLEANUP_QUEUE_BASE . '/.heartbeat');
+        return @filemtime(CLEANUP_QUEUE_BASE . '/.heartbeat') >= time() - CLEANUP_HEARTBEAT_SECS;
+    }
+
+
+    /**
+     * Queue the given jobe user and directories for cleanup.
+     * @param int $userNum the jobe user number.
+     * @param array $dirs the directories to be deleted.
+     * @return true on success, false if the caller must clean up instead.
+     */
+    public static function enqueue($userNum, $dirs)
+    {
+        $seq = sprintf('%017.6f', microtime(true));
+        $path = CLEANUP_QUEUE_BASE . "/{$seq}_$userNum.json";
+        $tempPath = CLEANUP_QUEUE_BASE . "/.{$seq}_$userNum.json";
+        if (@file_put_contents($tempPath, json_encode(array_values($dirs))) === false) {
+            return false;
+        }
+        return rename($tempPath, $path);
+    }
+
+
+    /**
+     * Clean up after all queued runs, in order of queueing. Called by the reaper.
+     * @return int the number of runs cleaned up.
+     */
+    public static function drain()
+    {
+        touch(CLEANUP_QUEUE_BASE . '/.heartbeat');
+        $numDone = 0;
+        foreach (scandir(CLEANUP_QUEUE_BASE) as $filename) {
+            if ($filename[0] === '.') {
+                continue;
+            }
+            $path = CLEANUP_QUEUE_BASE . "/$filename";
+            $dirs = json_decode(file_get_contents($path), true) ?: [];
+            $userNum = intval(explode('_', basename($filename, '.json'))[1]);
+            LanguageTask::cleanUpUser($userNum);
+            if ($dirs) {
+                exec('sudo rm -R ' . implode(' ', array_map('escapeshellarg', $dirs)));
+            }
+            // Dequeue before freeing, so that a crash can't lead to a user being freed twice.
+            unlink($path);
+            LanguageTask::freeUser($userNum);
+            $numDone++;
+        }
+        return $numDone;
+    }
+}
@@ -0,0 +1,209 @@
+<?php
+
+/* ==============================================================
+ *
+ * This file defines the CompileCache class, which manages a cache of the
+ * artefacts of successful compilations, so that compiling exactly the same
+ * program again (as happens whenever CodeRunner runs each test case of a
+ * question as a separate job, or a student resubmits the same code) just
+ * copies the artefacts into the new run's workspace.
+ *
+ * Entries are keyed by a SHA-256 hash of the language, compiler version,
+ * compile parameters and the contents of all files in the workspace at the
+ * start of compilation (see LanguageTask::compileWithCache). Each entry is a
+ * directory COMPILE_CACHE_BASE/<first two chars of key>/<key> containing
+ * the artefacts plus a .manifest file recording their modes and the name
+ * of the executable. Entries are written to a temporary directory and renamed
+ * into place, so are never seen partially written.
+ *
+ * The total size of the cache is kept in the file COMPILE_CACHE_BASE/.size,
+ * updated under an exclusive lock. When it exceeds the configured budget,
+ * the least-recently-used entries (by directory mtime, which is updated on
+ * each hit) are deleted until the size is below COMPILE_CACHE_LOW_WATER
+ * times the budget.
+ *
+ * ==============================================================
+ *
+ * @copyright  2026 Richard Lobb, University of Canterbury
+ * @license    http://www.gnu.org/copyleft/gpl.html GNU GPL v3 or later
+ */
+
+namespace Jobe;
+
+define('COMPILE_CACHE_BASE', '/home/jobe/compilecache');
+define('COMPILE_CACHE_LOW_WATER', 0.8);
+
+class CompileCache
+{
+    /**
+     * @return true iff the compile cache is enabled in the config file and
+     * the cache directory (made by the installer) exists.
+     */
+    public static function isEnabled()
+    {
+        return config('Jobe')->compile_cache_mb > 0 && is_dir(COMPILE_CACHE_BASE);
+    }
+
+
+    /**
+     * @param array $keyData all the data that determines the compilation output.
+     * @return string the cache key for the given data.
+     */
+    public static function key($keyData)
+    {
+        return hash('sha256', json_encode($keyData));
+    }
+
+
+    /**
+     * Copy the artefacts of the cache entry with the given key, if any, into
+     * the given workspace, and mark the entry as recently used.
+     * @param string $key the cache key.
+     * @param string $workdir the workspace directory.
+     * @return ?string the name of the executable file, or null if there's no
+     * such entry or the copy failed (e.g. because the entry is being evicted).
+     */
+    public static function restore($key, $workdir)
+    {
+        $entry = self::entryPath($key);
+        $manifest = json_decode(@file_get_contents("$entry/.manifest") ?: 'null', true);
+        if (!is_array($manifest)) {
+            return null;
+        }
+        $restored = [];
+        foreach ($manifest['files'] as $filename => $mode) {
+            $destpath = "$workdir/$filename";
+            if (!@copy("$entry/$filename", $destpath) || !@chmod($destpath, $mode)) {
+                foreach ($restored as $path) {
+                    @unlink($path);  // So the jobe user can write them when compiling
+                }
+                return null;
+            }
+            $restored[] = $destpath;
+        }
+        @touch($entry);
+        return $manifest['executable'];
+    }
+
+
+    /**
+     * Add the given artefacts of a successful compilation to the cache,
+     * unless there's already an entry with the given key. Nothing is cached if
+     * any artefact isn't a plain file. Evicts old entries if necessary.
+     * @param string $key the cache key.
+     * @param string $workdir the workspace directory.
+     * @param array $artefacts the names of the files created by the compile.
+     * @param ?string $executable the name of the executable file.
+     */
+    public static function save($key, $workdir, $artefacts, $executable)
+    {
+        $entry = self::entryPath($key);
+        if (is_dir($entry)) {
+            return;
+        }
+        $files = [];
+        $size = 0;
+        foreach ($artefacts as $filename) {
+            $path = "$workdir/$filename";
+            if (!is_file($path) || is_link($path)) {
+                return;
+            }
+            $files[$filename] = fileperms($path) & 0777;
+            $size += filesize($path);
+        }
+
+        $topdir = dirname($entry);
+        if (!is_dir($topdir)) {
+            @mkdir($topdir, 0750);
+        }
+        $tempdir = "$topdir/.tmp-" . getmypid() . '-' . $key;
+        if (!@mkdir($tempdir, 0750)) {
+            return;
+        }
+        foreach (array_keys($files) as $filename) {
+            if (!@copy("$workdir/$filename", "$tempdir/$filename")) {
+                self::removeEntry($tempdir);
+                return;
+            }
+        }
+        $manifest = json_encode(['executable' => $executable, 'files' => (object) $files]);
+        if (@file_put_contents("$tempdir/.manifest", $manifest) === false ||
+                !@rename($tempdir, $entry)) {
+            self::removeEntry($tempdir);  // Probably lost a race with an identical job.
+            return;
+        }
+        self::updateSize($size);
+    }
+
+
+    // Add $delta bytes to the recorded cache size. If the result exceeds the
+    // configured budget, evict least-recently-used entries.
+    private static function updateSize($delta)
+    {
+        $handle = @fopen(COMPILE_CACHE_BASE . '/.size', 'c+');
+        if ($handle === false) {
+            log_message('error', 'CompileCache: cannot open size file');
+            return;
+        }
+        flock($handle, LOCK_EX);
+        $size = intval(stream_get_contents($handle)) + $delta;
+        $budget = config('Jobe')->compile_cache_mb * 1024 * 1024;
+        if ($size > $budget) {
+            log_message('info', '*jobe*: evicting old entries from compile cache');
+            $size = self::evict(intval($budget * COMPILE_CACHE_LOW_WATER));
+        }
+        ftruncate($handle, 0);
+        rewind($handle);
+        fwrite($handle, strval($size));
+        fflush($handle);
+        flock($handle, LOCK_UN);
+        fclose($handle);
+    }
+
+
+    // Delete least-recently-used entries until the cache size is at most
+    // $target bytes. Since all entries are scanned, the return value is
+    // the true size of the cache afterwards, which corrects any drift
+    // in the recorded size.
+    private static function evict($target)
+    {
+        $entries = [];
+        $total = 0;
+        foreach (glob(COMPILE_CACHE_BASE . '/*/*', GLOB_ONLYDIR) as $entry) {
+            $size = 0;
+            foreach (glob("$entry/*") as $path) {
+                $size += @filesize($path);
+            }
+            $entries[] = [@filemtime($entry), $size, $entry];
+            $total += $size;
+        }
+        sort($entries);
+        foreach ($entries as [$mtime, $size, $entry]) {
+            if ($total <= $target) {
+                break;
+            }
+            self::removeEntry($entry);
+            $total -= $size;
+        }
+        return $total;
+    }
+
+
+    // Delete the given entry directory and its contents.
+    private static function removeEntry($dir)
+    {
+        foreach (scandir($dir) ?: [] as $filename) {
+            if ($filename !== '.' && $filename !== '..') {
+                @unlink("$dir/$filename");
+            }
+        }
+        @rmdir($dir);
+    }
+
+
+    // Return the cache directory path for the given key.
+    private static function entryPath($key)
+    {
+        return COMPILE_CACHE_BASE . '/' . substr($key, 0, 2) . '/' . $key;
+    }
+}
@@ -14,6 +14,9 @@ namespace Jobe;
 
 class CppTask extends LanguageTask
 {
+    // Headers to precompile (see PrecompiledHeaders). Only the first header
+    // included by a program can be precompiled.
+    const PRECOMPILED_HEADERS = ['bits/stdc++.h', 'iostream'];
 
     public function __construct($filename, $input, $params)
     {
@@ -35,10 +38,34 @@ class CppTask extends LanguageTask
         $compileargs = $this->getParam('compileargs');
         $linkargs = $this->getParam('linkargs');
         $cmd = "g++ " . implode(' ', $compileargs) . " -o $execFileName $src " . implode(' ', $linkargs);
+
+        // Precompiled headers are built only for the default compileargs. To
+        // guarantee the compiler output is exactly as it would be without
+        // them, a failed compile is repeated without them.
+        if (PrecompiledHeaders::isEnabled() && $compileargs == $this->default_params['compileargs']) {
+            $pchDir = PrecompiledHeaders::includeDir('/usr/bin/g++', $compileargs, self::PRECOMPILED_HEADERS);
+            if ($pchDir !== null) {
+                list($output, $this->cmpinfo) = $this->runInSandbox("g++ -I $pchDir" . substr($cmd, strlen('g++')));
+                if ($this->cmpinfo === '') {
+                    return;
+                }
+            }
+        }
         list($output, $this->cmpinfo) = $this->runInSandbox($cmd);
     }
 
 
+    // Build the precompiled headers used by compile() with the default
+    // compileargs. Called by the jobe:pch command, never on the request path.
+    // Returns the directory of precompiled headers, or null on failure.
+    public static function buildPrecompiledHeaders()
+    {
+        $task = new CppTask('prog.cpp', '', []);
+        return PrecompiledHeaders::build('/usr/bin/g++', 'c++-header',
+            $task->default_params['compileargs'], self::PRECOMPILED_HEADERS);
+    }
+
+
     // A default name for C++ programs
     public function defaultFileName($sourcecode)
     {
@@ -57,4 +84,10 @@ class CppTask extends LanguageTask
     {
         return '';
     }
+
+    // Compilation is slow enough to be worth caching.
+    protected function isCompileCacheable()
+    {
+        return true;
+    }
 }
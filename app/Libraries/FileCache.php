@@ -19,13 +19,36 @@
 /* ==============================================================
  *
  * This file defines the FileCache class, which manages the local file
- * cache. Files are stored in the /home/jobe/files subtree with file names
- * being the fileIDs supplied in the RestAPI 'put' requests. Normally these
- * are the MD5 hashes of the file contents. Files are stored in a 2 level
- * directory hierarchy like the Moodle file cache, with the first two letters of
- * the fileID specifying the top-level directory name and the next two letters
- * the second-level directory name. The rest of the fileID is used as the
- * linux file name.
+ * cache in the /home/jobe/files subtree. Files are PUT with client-supplied
+ * fileIDs, normally the MD5 hashes of the file contents, but the contents
+ * are stored just once, whatever their IDs, as blobs named by the SHA-256
+ * hash of the contents: blobs/<first two chars>/<next two chars>/<hash>.
+ * Each fileID is a symbolic link to its blob, in a 2 level directory
+ * hierarchy like the Moodle file cache. For an MD5 fileID the first two
+ * letters of the fileID give the top-level directory name, the next two
+ * letters the second-level directory name and the rest of the fileID the
+ * link name. Other fileIDs are sharded the same way under the ids directory,
+ * by the MD5 hash of the fileID, with the whole fileID as the link name.
+ * Files PUT before blobs were introduced are plain files at their fileID
+ * paths (or, for non-MD5 fileIDs, at the top level), and are still used.
+ *
+ * Blobs are read-only (mode 0444) and, being named by their contents, never
+ * change, so they can be hard-linked into run workspaces rather than copied. Nothing
+ * the jobe users (or the server) do to a workspace can then alter the cache.
+ * If the workspace is on a different file system, the file is reflinked with
+ * cp --reflink if that file system supports it, and only otherwise copied.
+ *
+ * If the config file sets a size budget (file_cache_mb), the total size of
+ * the cache is kept in the file FILE_CACHE_BASE/.size, updated under an
+ * exclusive lock on each PUT. A blob's mtime is its last
+ * use, as it's touched (at most every FILE_CACHE_TOUCH_SECS) whenever it's
+ * loaded. When the size exceeds the budget, blobs are evicted in LRU order
+ * until it's below FILE_CACHE_LOW_WATER times the budget. The candidates
+ * are taken from the head of the LRU index FILE_CACHE_BASE/.lru, a list of
+ * lines "<mtime> <size> <relative path>" sorted oldest first, skipping any
+ * used or replaced since the index was made. The index is rebuilt by a scan
+ * of the cache, which also corrects the recorded size and deletes links to
+ * evicted blobs, only when it's exhausted.
  *
  * ==============================================================
  *
@@ -37,82 +60,163 @@
 namespace Jobe;
 
 define('FILE_CACHE_BASE', '/home/jobe/files');
-define('MD5_PATTERN', '/[0-9abcdef]{32}/');
+define('MD5_PATTERN', '/^[0-9a-f]{32}$/');  // A fileID that's an MD5 hash
 define('MAX_PERCENT_FULL', 0.95);
 define('TESTING_FILE_CACHE_CLEAR', false);
+define('FILE_CACHE_LOW_WATER', 0.8);
+define('FILE_CACHE_TOUCH_SECS', 60);
+define('FILE_CACHE_CHUNK_SIZE', 65536);
 
 class FileCache
 {
+    // False once cp --reflink has failed in this process, so isn't tried again.
+    private static $reflinkSupported = true;
+
     /**
      * @param string $fileid the externally supplied file id (a.k.a. filename)
      * @return true iff the given file exists in the file cache.
      */
     public static function fileExists($fileid)
     {
-        $path = self::idToPath($fileid);
-        return file_exists($path);
+        return self::resolve($fileid) !== null;
     }
 
 
     /**
-     * Load the specified file into the workspace.
+     * Load the specified file into the workspace, by hard-linking it if
+     * possible, else by reflinking it, else by copying it. Linked and
+     * reflinked files are read-only.
      * @param string $fileid the id of the required file (aka filename)
      * @param string $filename the name to give the file in the workspace
      * @param string workspaceDir the directory in which to create the file
-     * @return true if copy succeeds or false if no such file exists
-     * or the copy fails for some other reason (e.g. workspace not writeable).
+     * @param bool $writable true if the file must be writable by the web
+     * server user, in which case it's always copied.
+     * @param ?string $digest set to the SHA-256 hash of the loaded contents,
+     * if they're a blob, else null (i.e. for files PUT before blobs).
+     * @return true if the load succeeds or false if no such file exists
+     * or the load fails for some other reason (e.g. workspace not writeable).
      */
-    public static function loadFileToWorkspace($fileid, $filename, $workspaceDir)
+    public static function loadFileToWorkspace($fileid, $filename, $workspaceDir, $writable = false, &$digest = null)
     {
-        if (! self::fileExists($fileid)) {
+        $sourcepath = self::resolve($fileid);
+        $digest = null;
+        if ($sourcepath === null) {
+            Metrics::increment('jobe_file_cache_misses_total');
             return false;
         }
-        $sourcepath = self::idToPath($fileid);
         $destpath = $workspaceDir . '/' . $filename;
-        return copy($sourcepath, $destpath);
+        $size = filesize($sourcepath);
+        if ((fileperms($sourcepath) & 0222) != 0) {
+            @chmod($sourcepath, 0444);  // Put before cache files were read-only.
+        }
+        @unlink($destpath);  // In case a file of that name has already been loaded
+        if (!$writable && @link($sourcepath, $destpath)) {
+            $method = 'link';
+        } elseif (!$writable && self::reflink($sourcepath, $destpath)) {
+            $method = 'reflink';
+        } elseif (copy($sourcepath, $destpath)) {
+            $method = 'copy';
+            Metrics::increment('jobe_file_cache_copied_bytes_total', [], $size);
+        } else {
+            return false;
+        }
+        if (time() - @filemtime($sourcepath) > FILE_CACHE_TOUCH_SECS) {
+            // Mark as recently used, through the workspace link if there's
+            // one, as that can't have been evicted.
+            self::markUsed($method === 'link' ? $destpath : $sourcepath, $size);
+        }
+        Metrics::increment('jobe_file_cache_hits_total', ['method' => $method]);
+        Metrics::increment('jobe_file_cache_loaded_bytes_total', [], $size);
+        if (str_starts_with($sourcepath, FILE_CACHE_BASE . '/blobs/')) {
+            $digest = basename($sourcepath);
+        }
+        return true;
     }
 
 
     /**
      * Insert the given file contents into the file cache with the given id
-     * aka filename. This is normally the md5 hash of the file contents. If
-     * it doesn't appear to be, the file is stored just with the given name
-     * at the top level of the cache hierarchy. Otherwise the first and
-     * second pair of characters from the filename are taken as the top and
-     * second level directory names respectively.
+     * aka filename. This is normally the md5 hash of the file contents.
+     * The contents are stored in a blob named by their SHA-256 hash, unless
+     * there's already such a blob, and the id is linked to the blob.
+     * If the cache has a size budget, least-recently-used blobs are evicted
+     * as necessary to keep within it. The id isn't checked against the
+     * contents, as JSON clients have always been able to PUT any contents
+     * under any id.
      * @param string $fileid the external file id (aka filename).
+     * @param string $contents the file contents.
+     * @return int|false the number of bytes stored or false on failure.
      */
     public static function filePutContents($fileid, $contents)
     {
-        $freespace = disk_free_space(FILE_CACHE_BASE);
-        $volumesize = disk_total_space(FILE_CACHE_BASE);
-        if (TESTING_FILE_CACHE_CLEAR || $freespace / $volumesize > MAX_PERCENT_FULL) {
-            self:: cleanCache();
+        $temppath = self::tempPath();
+        $result = @file_put_contents($temppath, $contents);
+        if ($result === false || !self::install($fileid, $temppath, $result, hash('sha256', $contents))) {
+            @unlink($temppath);
+            return false;
         }
-        if (preg_match(MD5_PATTERN, $fileid) !== 1) {
-            $result = @file_put_contents(FILE_CACHE_BASE . '/' . $fileid, $contents);
-        } else {
-            $topdir = FILE_CACHE_BASE . '/' . substr($fileid, 0, 2);
-            $seconddir = $topdir . '/' . substr($fileid, 2, 2);
-            $fullpath = $seconddir . '/' . substr($fileid, 4);
-            if (!is_dir($topdir)) {
-                @mkdir($topdir, 0751);
+        return $result;
+    }
+
+
+    /**
+     * As for filePutContents, except that the contents are read from the
+     * given stream in chunks, so needn't fit in memory. If the id is an MD5
+     * hash, it must match the MD5 hash of the contents, which is computed
+     * as they're written. The contents may be at most file_put_max_mb
+     * megabytes.
+     * @param string $fileid the external file id (aka filename).
+     * @param resource $stream the stream of contents, read to EOF.
+     * @return int|false the number of bytes stored or false on failure.
+     * @throws JobException if the contents don't match an MD5 file id
+     * or are too large.
+     */
+    public static function streamPutContents($fileid, $stream)
+    {
+        $maxMb = config('Jobe')->file_put_max_mb;
+        $temppath = self::tempPath();
+        $handle = @fopen($temppath, 'xb');
+        if ($handle === false) {
+            return false;
+        }
+        $md5 = hash_init('md5');
+        $sha256 = hash_init('sha256');
+        $size = 0;
+        $ok = true;
+        while ($ok && !feof($stream)) {
+            $chunk = fread($stream, FILE_CACHE_CHUNK_SIZE);
+            $ok = $chunk !== false && fwrite($handle, $chunk) === strlen($chunk);
+            if ($ok) {
+                hash_update($md5, $chunk);
+                hash_update($sha256, $chunk);
+                $size += strlen($chunk);
             }
-            if (!is_dir($seconddir)) {
-                @mkdir($seconddir, 0751);
+            if ($size > $maxMb * 1024 * 1024) {
+                fclose($handle);
+                @unlink($temppath);
+                throw new JobException("put: file $fileid is larger than the limit of $maxMb MB", 413);
             }
-            $result = @file_put_contents($fullpath, $contents);
         }
-        return $result;
+        $ok = fclose($handle) && $ok;
+        $actualMd5 = hash_final($md5);
+        if ($ok && self::isMd5($fileid) && $fileid !== $actualMd5) {
+            @unlink($temppath);
+            throw new JobException("put: contents of file $fileid don't match its MD5 id", 400);
+        }
+        if (!$ok || !self::install($fileid, $temppath, $size, hash_final($sha256))) {
+            @unlink($temppath);
+            return false;
+        }
+        return $size;
     }
 
     /**
      * Delete all files in the file cache that were last accessed over two
      * days ago.
 
-     * This method is called by the filePutContents method
-     * if, before adding a file, the volume containing the file cache directory
-     * (/home/jobe/files) is over 95% full.
+     * This method is called by the filePutContents method if the cache has
+     * no size budget and, before adding a file, the volume containing the
+     * file cache directory (/home/jobe/files) is over 95% full.
      *
      * If Jobe is providing services just to a Moodle/CodeRunner instance, this
      * method should rarely if ever be called. Usually (and indeed always, prior
@@ -140,11 +244,282 @@ class FileCache
     }
 
 
-    // Return the cache file path for the given fileID.
+    // Add $delta bytes to the recorded cache size, which is first found by
+    // a scan if it hasn't been recorded. If the result exceeds the configured
+    // budget, evict least-recently-used files.
+    private static function updateSize($delta)
+    {
+        $handle = @fopen(FILE_CACHE_BASE . '/.size', 'c+');
+        if ($handle === false) {
+            log_message('error', 'FileCache: cannot open size file');
+            return;
+        }
+        flock($handle, LOCK_EX);
+        $recorded = stream_get_contents($handle);
+        if ($recorded === '') {
+            [$index, $size] = self::scan();
+            self::writeIndex($index);
+        } else {
+            $size = intval($recorded) + $delta;
+        }
+        $budget = config('Jobe')->file_cache_mb * 1024 * 1024;
+        if ($size > $budget) {
+            log_message('info', '*jobe*: evicting least-recently-used files from file cache');
+            $size = self::evict($size, intval($budget * FILE_CACHE_LOW_WATER));
+        }
+        ftruncate($handle, 0);
+        rewind($handle);
+        fwrite($handle, strval($size));
+        fflush($handle);
+        flock($handle, LOCK_UN);
+        fclose($handle);
+    }
+
+
+    // Delete least-recently-used files, taken from the head of the LRU
+    // index, until the cache size (currently $size) is at most $target
+    // bytes. Files that have been used or replaced since the index was
+    // made are skipped. If the index runs out, it's rebuilt (once) by a scan.
+    // Return the new cache size. Must be called with the size file locked.
+    private static function evict($size, $target)
+    {
+        $index = self::readIndex();
+        $next = 0;
+        $rescanned = false;
+        while ($size > $target) {
+            if ($next >= count($index)) {
+                if ($rescanned) {
+                    break;
+                }
+                [$index, $size] = self::scan();
+                $next = 0;
+                $rescanned = true;
+                continue;
+            }
+            [$mtime, $fileSize, $relpath] = $index[$next++];
+            $path = FILE_CACHE_BASE . '/' . $relpath;
+            clearstatcache(true, $path);
+            if (@filemtime($path) === $mtime && @unlink($path)) {
+                $size -= $fileSize;
+            }
+        }
+        self::writeIndex(array_slice($index, $next));
+        return $size;
+    }
+
+
+    // Return a pair [LRU index, total size] for the blobs (and files put
+    // before blobs were introduced) in the cache, where the index is a list
+    // of triples [mtime, size, path relative to FILE_CACHE_BASE] sorted
+    // oldest first. Links to evicted blobs are deleted.
+    private static function scan()
+    {
+        $index = [];
+        $total = 0;
+        $files = new \RecursiveIteratorIterator(
+            new \RecursiveDirectoryIterator(FILE_CACHE_BASE, \FilesystemIterator::SKIP_DOTS)
+        );
+        foreach ($files as $path => $info) {
+            $relpath = substr($path, strlen(FILE_CACHE_BASE) + 1);
+            if ($info->isLink()) {
+                if (!file_exists($path)) {
+                    @unlink($path);  // Its blob has been evicted
+                }
+                continue;
+            }
+            if ($relpath[0] === '.' || !$info->isFile()) {
+                continue;  // Size, index and temporary files
+            }
+            $index[] = [$info->getMTime(), $info->getSize(), $relpath];
+            $total += $info->getSize();
+        }
+        sort($index);
+        return [$index, $total];
+    }
+
+
+    // Return the LRU index, as a list of triples [mtime, size, relative path].
+    private static function readIndex()
+    {
+        $index = [];
+        foreach (@file(FILE_CACHE_BASE . '/.lru', FILE_IGNORE_NEW_LINES) ?: [] as $line) {
+            $fields = explode(' ', $line, 3);
+            if (count($fields) == 3) {
+                $index[] = [intval($fields[0]), intval($fields[1]), $fields[2]];
+            }
+        }
+        return $index;
+    }
+
+
+    private static function writeIndex($index)
+    {
+        $lines = '';
+        foreach ($index as [$mtime, $size, $relpath]) {
+            $lines .= "$mtime $size $relpath\n";
+        }
+        $path = FILE_CACHE_BASE . '/.lru';
+        if (@file_put_contents("$path.new", $lines) === false || !@rename("$path.new", $path)) {
+            log_message('error', 'FileCache: cannot write LRU index');
+        }
+    }
+
+
+    // Return a new temporary file path in the cache, to which contents can be
+    // written before being renamed into place. The initial '.' hides it from
+    // scans.
+    private static function tempPath()
+    {
+        return FILE_CACHE_BASE . '/.tmp-' . getmypid() . '-' . bin2hex(random_bytes(4));
+    }
+
+
+    // Store the given temporary file of $size bytes, whose contents have the
+    // given SHA-256 hash, as a read-only blob, unless there's already such
+    // a blob, and link the given file id to the blob. Any existing link (or,
+    // from before blobs, file) for the id is replaced rather than
+    // overwritten, as it may be linked into workspaces. Evicts old blobs if
+    // necessary. Return true on success.
+    private static function install($fileid, $temppath, $size, $digest)
+    {
+        $budgeted = config('Jobe')->file_cache_mb > 0;
+        if (!$budgeted) {
+            $freespace = disk_free_space(FILE_CACHE_BASE);
+            $volumesize = disk_total_space(FILE_CACHE_BASE);
+            if (TESTING_FILE_CACHE_CLEAR || 1 - $freespace / $volumesize > MAX_PERCENT_FULL) {
+                self:: cleanCache();
+            }
+        }
+        $blobpath = self::blobPath($digest);
+        $idpath = self::idToPath($fileid);
+        if (!self::makeParentDirs($blobpath) || !self::makeParentDirs($idpath)) {
+            return false;
+        }
+        $delta = 0;
+        if (!@chmod($temppath, 0444)) {
+            return false;
+        } elseif (@link($temppath, $blobpath)) {
+            @unlink($temppath);
+            $delta = $size;
+        } elseif (@rename($temppath, $blobpath)) {
+            // There was already such a blob, which is replaced by the new,
+            // identical, file to mark it as recently used. Unlike touching
+            // it, that's still right if the blob has just been evicted.
+            Metrics::increment('jobe_file_cache_deduplicated_bytes_total', [], $size);
+        } else {
+            return false;
+        }
+
+        $oldpaths = [$idpath];
+        if (!self::isMd5($fileid)) {
+            $oldpaths[] = FILE_CACHE_BASE . '/' . $fileid;  // Put before ids were sharded
+        }
+        foreach ($oldpaths as $oldpath) {
+            if (is_file($oldpath) && !is_link($oldpath)) {
+                $delta -= filesize($oldpath);  // Put before blobs were introduced
+                if ($oldpath !== $idpath) {
+                    @unlink($oldpath);
+                }
+            }
+        }
+        $templink = self::tempPath();
+        if (!@symlink($blobpath, $templink) || !@rename($templink, $idpath)) {
+            @unlink($templink);
+            return false;
+        }
+
+        Metrics::increment('jobe_file_cache_stored_bytes_total', [], $size);
+        if ($budgeted) {
+            self::updateSize($delta);
+        }
+        return true;
+    }
+
+
+    // Make the top and second level directories of the given cache path,
+    // if they don't already exist. Return true on success.
+    private static function makeParentDirs($path)
+    {
+        $seconddir = dirname($path);
+        $topdir = dirname($seconddir);
+        foreach ([dirname($topdir), $topdir, $seconddir] as $dir) {
+            if (!is_dir($dir) && !@mkdir($dir, 0751) && !is_dir($dir)) {
+                return false;  // Unless another process made it first
+            }
+        }
+        return true;
+    }
+
+
+    // Return the path of the file with the given id, i.e. of the blob it's
+    // linked to or of the file PUT before blobs were introduced, or null if
+    // there's no such file (e.g. because the blob has been evicted).
+    private static function resolve($fileid)
+    {
+        $path = self::idToPath($fileid);
+        if (is_link($path)) {
+            $path = readlink($path);  // Not realpath, whose cache could be stale
+        } elseif (!file_exists($path) && !self::isMd5($fileid)) {
+            $path = FILE_CACHE_BASE . '/' . $fileid;  // Put before ids were sharded
+        }
+        return $path !== false && is_file($path) ? $path : null;
+    }
+
+
+    // Return the path of the blob with the given SHA-256 hash.
+    private static function blobPath($digest)
+    {
+        return FILE_CACHE_BASE . '/blobs/' . substr($digest, 0, 2) . '/' .
+            substr($digest, 2, 2) . '/' . $digest;
+    }
+
+
+    // Update the mtime of the given cache file or link to one, of the given
+    // size. touch() creates the file if it has been evicted meanwhile, so
+    // such an empty file is deleted again, rather than left to be served
+    // in place of the evicted contents.
+    private static function markUsed($path, $size)
+    {
+        @touch($path);
+        clearstatcache(true, $path);
+        if ($size > 0 && @filesize($path) === 0) {
+            @unlink($path);
+        }
+    }
+
+
+    // Return true iff the given file id is an MD5 hash.
+    private static function isMd5($fileid)
+    {
+        return preg_match(MD5_PATTERN, $fileid) === 1;
+    }
+
+
+    // Make the given destination file a reflink (copy-on-write clone) of the
+    // given source file. Return false if that isn't possible, e.g. because
+    // the file system doesn't support reflinks.
+    private static function reflink($sourcepath, $destpath)
+    {
+        if (!self::$reflinkSupported) {
+            return false;
+        }
+        $cmd = 'cp --reflink=always -- ' . escapeshellarg($sourcepath) . ' ' .
+            escapeshellarg($destpath) . ' 2>/dev/null';
+        exec($cmd, $output, $status);
+        if ($status != 0) {
+            self::$reflinkSupported = false;
+            return false;
+        }
+        return true;
+    }
+
+
+    // Return the cache path of the link for the given fileID.
     private static function idToPath($fileid)
     {
-        if (preg_match(MD5_PATTERN, $fileid) !== 1) {
-            $relativepath = $fileid;
+        if (!self::isMd5($fileid)) {
+            $hash = md5($fileid);
+            $relativepath = 'ids/' . substr($hash, 0, 2) . '/' . substr($hash, 2, 2) . '/' . $fileid;
         } else {
             $top = substr($fileid, 0, 2);
             $second = substr($fileid, 2, 2);
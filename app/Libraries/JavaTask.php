@@ -15,11 +15,20 @@ namespace Jobe;
 
 class JavaTask extends LanguageTask
 {
+    // JVM options used if java_fast_startup is set in the config file.
+    const FAST_STARTUP_FLAGS = ['-XX:TieredStopAtLevel=1', '-XX:+UseSerialGC'];
+
+    // The user the javac server runs as (see javacserver/JobeJavacServer.java).
+    const JAVAC_SERVER_USER = 'jobejavac';
+
+    // Extra secs to wait for the javac server, beyond the compile time limit,
+    // so that it can report a timeout of its own.
+    const JAVAC_SERVER_GRACE_SECS = 5;
+
     public string $mainClassName;
     
     public function __construct($filename, $input, $params)
     {
-        $params['memorylimit'] = 0;    // Disregard memory limit - let JVM manage memory
         $this->default_params['numprocs'] = 256;     // Java 8 wants lots of processes
         $this->default_params['interpreterargs'] = array(
              "-Xrs",   //  reduces usage signals by java, because that generates debug
@@ -33,12 +42,27 @@ class JavaTask extends LanguageTask
         if (config('Jobe')->java_extraflags != '') {
             array_push($this->default_params['interpreterargs'], config('Jobe')->java_extraflags);
         }
+        if (config('Jobe')->java_fast_startup) {
+            array_push($this->default_params['interpreterargs'], ...self::FAST_STARTUP_FLAGS);
+        }
+
+        parent::__construct($filename, $input, self::adjustParams($params));
+    }
 
+    public function setRunParameters($input, $params)
+    {
+        parent::setRunParameters($input, self::adjustParams($params));
+    }
+
+    // Override the memory and process limits in the given parameters as
+    // required by the JVM.
+    private static function adjustParams($params)
+    {
+        $params['memorylimit'] = 0;    // Disregard memory limit - let JVM manage memory
         if (isset($params['numprocs']) && $params['numprocs'] < 256) {
             $params['numprocs'] = 256;  // Minimum for Java 8 JVM
         }
-
-        parent::__construct($filename, $input, $params);
+        return $params;
     }
 
     public function prepareExecutionEnvironment($sourceCode, $fileList)
@@ -63,13 +87,78 @@ class JavaTask extends LanguageTask
 
         $prog = file_get_contents($this->sourceFileName);
         $compileArgs = $this->getParam('compileargs');
-        $cmd = '/usr/bin/javac ' . $extra_javacflags . ' ' . implode(' ', $compileArgs) . " {$this->sourceFileName}";
-        list($output, $this->cmpinfo) = $this->runInSandbox($cmd);
+        $cmpinfo = empty($compileArgs) ? $this->compileOnServer($extra_javacflags) : null;
+        if ($cmpinfo !== null) {
+            $this->cmpinfo = $cmpinfo;
+        } else {
+            if (config('Jobe')->java_fast_startup) {
+                $extra_javacflags .= ' -J' . implode(' -J', self::FAST_STARTUP_FLAGS);
+            }
+            $cmd = '/usr/bin/javac ' . $extra_javacflags . ' ' . implode(' ', $compileArgs) . " {$this->sourceFileName}";
+            list($output, $this->cmpinfo) = $this->runInSandbox($cmd);
+        }
         if (empty($this->cmpinfo)) {
             $this->executableFileName = $this->sourceFileName;
         }
     }
 
+
+    // Compile the source file with the javac server (see
+    // javacserver/JobeJavacServer.java), if one is configured. Return
+    // the compiler output, or null if the compile must instead be done by
+    // running javac, because the server isn't available, can't handle the
+    // given javac flags or is too busy. The server never closes the
+    // connection while it's still compiling into the workspace, but if it
+    // doesn't respond at all it may be, so running javac in the workspace
+    // isn't safe and a JobException is thrown instead.
+    private function compileOnServer($javacFlags)
+    {
+        $socketPath = config('Jobe')->javac_server_socket;
+        if ($socketPath === '' || str_contains($javacFlags, '-J')) {
+            return null;
+        }
+        $socket = @stream_socket_client("unix://$socketPath", $errno, $errstr, 1);
+        if ($socket === false) {
+            return null;
+        }
+        $aclEntry = 'u:' . self::JAVAC_SERVER_USER;
+        exec("setfacl -m $aclEntry:rwX {$this->workdir}");
+        $timeLimit = $this->getParam('cputime', true);
+        stream_set_timeout($socket, $timeLimit + self::JAVAC_SERVER_GRACE_SECS);
+        $options = preg_split('/\s+/', trim($javacFlags), -1, PREG_SPLIT_NO_EMPTY);
+        $request = array_merge([$this->workdir, $this->sourceFileName, $timeLimit], $options);
+        fwrite($socket, implode("\n", $request) . "\n\n");
+        $response = stream_get_contents($socket);
+        $timedOut = stream_get_meta_data($socket)['timed_out'];
+        fclose($socket);
+        exec("setfacl -x $aclEntry {$this->workdir}");
+        if ($timedOut) {
+            log_message('error', 'JavaTask: javac server timed out');
+            throw new JobException('Java compile server not responding', 500);
+        } elseif ($response === "TIMEOUT\n") {
+            return "Compile time limit exceeded\n";
+        } elseif ($response === false || !preg_match('/^[01]\n/', $response)) {
+            log_message('error', 'JavaTask: javac server failed (' . trim(strval($response)) . ')');
+            return null;
+        }
+        return substr($response, 2);
+    }
+
+    // javac is very slow to start, so compilations are worth caching.
+    protected function isCompileCacheable()
+    {
+        return true;
+    }
+
+
+    // The global extra javac flags also affect compilation.
+    protected function compileCacheKeyData()
+    {
+        $keyData = parent::compileCacheKeyData();
+        $keyData['javac_extraflags'] = config('Jobe')->javac_extraflags;
+        return $keyData;
+    }
+
     // A default name for Java programs. [Called only if API-call does
     // not provide a filename. As a side effect, also set the mainClassName.
     public function defaultFileName($sourcecode)
@@ -13,7 +13,11 @@
 
 namespace Jobe;
 
-define('ACTIVE_USERS', 1);  // The key for the shared memory active users array
+use App\Models\LanguagesModel;
+
+define('WAITER_FIFO_DIR', '/home/jobe/runs');  // Where waiters make their named pipes
+define('PRIVATE_TMP_BASE', '/home/jobe/tmp');  // Parent of the jobe users' private tmp dirs
+define('OUTPUT_FILE_DIR', '/home/jobe/runs');  // Where streamed output and runguard stats are kept
 
 abstract class LanguageTask
 {
@@ -30,6 +34,29 @@ abstract class LanguageTask
     const SEM_KEY_FILE_PATH = APPPATH . '/../public/index.php';
     const PROJECT_KEY = 'j';  // For ftok function. Irrelevant (?)
 
+    // The layout of the shared memory segment (made with ftok project key
+    // SHM_PROJECT_KEY) that records which jobe users are active and which
+    // processes are waiting for one. All integers are unsigned 32-bit
+    // little-endian. checkshmstatus.php and freeallusers.php must agree.
+    //   0: 'JOBE' once initialised
+    //   4: index in the waiters ring buffer of the longest-waiting process
+    //   8: number of entries in the waiters ring buffer
+    //  16: one byte per jobe user, 1 if active, 0 if free
+    //  16 + SHM_MAX_USERS: the waiters ring buffer of process ids, with
+    //      0 marking a process that has given up waiting.
+    const SHM_PROJECT_KEY = 'k';
+    const SHM_MAX_USERS = 256;
+    const SHM_MAX_WAITERS = 1024;
+    const SHM_MAGIC = 'JOBE';
+    const SHM_HEAD_OFFSET = 4;
+    const SHM_COUNT_OFFSET = 8;
+    const SHM_USERS_OFFSET = 16;
+    const SHM_WAITERS_OFFSET = LanguageTask::SHM_USERS_OFFSET + LanguageTask::SHM_MAX_USERS;
+    const SHM_SIZE = LanguageTask::SHM_WAITERS_OFFSET + 4 * LanguageTask::SHM_MAX_WAITERS;
+
+    // Files that the server itself writes in the workspace (see runInSandbox).
+    const SERVER_FILENAMES = ['prog.cmd', 'prog.in', 'prog.out', 'prog.err'];
+
     // Global default parameter values. Can be overridden by subclasses,
     // and then further overridden by the individual run requests.
     public $default_params = [
@@ -73,6 +100,14 @@ abstract class LanguageTask
     public string $stderr = '';
     public int $result = LanguageTask::RESULT_INTERNAL_ERR;  // Should get overwritten
     public ?string $workdir = '';   // The temporary working directory created in constructor
+    public bool $fromPool = false;  // True if the workdir was taken from a WorkspacePool
+    public ?string $stdoutFile = null;  // If set, execution output is moved here, not read
+    public array $supportFileDigests = [];  // Map from support file name to content hash (null if unknown)
+    public bool $collectStats = false;  // If true, runguard records sandboxStats
+    public array $sandboxStats = [];    // Runguard's stats for the last 'compile' and 'run'
+    public ?string $pristineDir = null;  // Private copies of the workspace entries (see freezeWorkspace)
+    public array $frozenEntries = [];  // Map from workspace file or directory name to inode
+    public array $frozenLinks = [];    // Map from workspace symlink name to target
 
 
     // ************************************************
@@ -103,16 +138,29 @@ abstract class LanguageTask
     // any of the jobe<n> users, running programs will be able
     // to hoover up other students' submissions.
 
+    // If workspace pools are enabled (see WorkspacePool), a jobe user is
+    // allocated first and a ready-made directory is taken from that user's
+    // pool, if available.
+
     // HACK ALERT: as a special case for testing, if the source code is the
     // string "!** TESTING OVERLOAD EXCEPTION **!", an OverloadException is
     // thrown. 
     public function prepareExecutionEnvironment($sourceCode, $fileList)
     {
-        // Create the temporary directory that will be used.
-        $this->workdir = tempnam("/home/jobe/runs", "jobe_");
-        if (!unlink($this->workdir) || !mkdir($this->workdir)) {
-            log_message('error', 'LanguageTask constructor: error making temp directory');
-            throw new Exception("LanguageTask: error making temp directory (race error?)");
+        $usePool = WorkspacePool::isEnabled();
+        if ($usePool) {
+            $this->allocateUser($sourceCode);
+            $this->workdir = WorkspacePool::take($this->userId);
+            $this->fromPool = $this->workdir !== null;
+        }
+
+        if (!$this->fromPool) {
+            // Create the temporary directory that will be used.
+            $this->workdir = tempnam("/home/jobe/runs", "jobe_");
+            if (!unlink($this->workdir) || !mkdir($this->workdir)) {
+                log_message('error', 'LanguageTask constructor: error making temp directory');
+                throw new Exception("LanguageTask: error making temp directory (race error?)");
+            }
         }
         chdir($this->workdir);
 
@@ -126,32 +174,54 @@ abstract class LanguageTask
 
         $this->loadFiles($fileList);
 
-        // Allocate one of the Jobe users (unless it's the special overload exception test).
-        if ($sourceCode == "!** TESTING OVERLOAD EXCEPTION **!") {
-            throw new OverloadException();
+        if (!$usePool) {
+            $this->allocateUser($sourceCode);
         }
-        $this->userId = $this->getFreeUser();
-        $this->user = sprintf("jobe%02d", $this->userId);
 
         // Give the user RW access.
-        exec("setfacl -m u:{$this->user}:rwX {$this->workdir}");
+        if (!$this->fromPool) {
+            exec("setfacl -m u:{$this->user}:rwX {$this->workdir}");
+        }
+    }
+
+
+    // Allocate one of the Jobe users (unless it's the special overload exception test).
+    private function allocateUser($sourceCode)
+    {
+        $startTime = microtime(true);
+        try {
+            if ($sourceCode == "!** TESTING OVERLOAD EXCEPTION **!") {
+                throw new OverloadException();
+            }
+            $this->userId = $this->getFreeUser();
+        } catch (OverloadException $e) {
+            Metrics::increment('jobe_overloads_total', ['reason' => 'no_user']);
+            throw $e;
+        } finally {
+            Metrics::observe('jobe_user_wait_seconds', [], microtime(true) - $startTime);
+        }
+        $this->user = sprintf("jobe%02d", $this->userId);
     }
 
 
     // Load the specified files into the working directory.
     // The file list is an array of (fileId, filename) pairs.
-    // Throws an exception if any are not present.
+    // Throws an exception if any are not present. Files with the names of
+    // those the server writes are copied, as the read-only links to the
+    // file cache used otherwise can't be overwritten.
     public function loadFiles($fileList)
     {
         foreach ($fileList as $file) {
             $fileId = $file[0];
             $filename = $file[1];
-            if (FileCache::loadFileToWorkspace($fileId, $filename, $this->workdir) === false) {
+            $writable = in_array($filename, LanguageTask::SERVER_FILENAMES, true);
+            if (FileCache::loadFileToWorkspace($fileId, $filename, $this->workdir, $writable, $digest) === false) {
                 throw new JobException(
                     'One or more of the specified files is missing/unavailable',
                     404
                 );
             }
+            $this->supportFileDigests[$filename] = $digest;
         }
     }
 
@@ -161,6 +231,39 @@ abstract class LanguageTask
     abstract public function compile();
 
 
+    // Compile as for compile() but, if the compile cache is enabled and
+    // this language's compilations are cacheable, first try to restore the
+    // artefacts of an identical earlier compilation instead. The key
+    // covers the compiler version, the compile parameters and the contents
+    // of the source and support files.
+    // Only successful compilations are cached.
+    public function compileWithCache()
+    {
+        if (!$this->isCompileCacheable() || !CompileCache::isEnabled()) {
+            $this->compile();
+            return;
+        }
+        $key = CompileCache::key($this->compileCacheKeyData());
+        $executableFileName = CompileCache::restore($key, $this->workdir);
+        if ($executableFileName !== null) {
+            log_message('debug', "compileWithCache: cache hit for job {$this->id}");
+            $this->executableFileName = $executableFileName;
+            $this->cmpinfo = '';  // As after a successful compile(), e.g. no warnings
+            return;
+        }
+
+        $oldFiles = scandir($this->workdir);
+        $this->compile();
+        if ($this->cmpinfo === '') {
+            $artefacts = array_filter(
+                array_diff(scandir($this->workdir), $oldFiles),
+                fn($filename) => $this->isCompileArtefact($filename)
+            );
+            CompileCache::save($key, $this->workdir, $artefacts, $this->executableFileName ?? null);
+        }
+    }
+
+
     // Execute this task, which must already have been compiled if necessary
     public function execute()
     {
@@ -179,101 +282,433 @@ abstract class LanguageTask
     }
 
 
-    // Called to clean up task when done
-    public function close($deleteFiles = true)
+    // Set the standard input and parameters for the next call to execute()
+    // and clear the results of any previous execution. Used when running a
+    // batch of cases with a single compiled program.
+    public function setRunParameters($input, $params)
     {
+        $this->input = $input;
+        $this->params = $params;
+        $this->stdout = '';
+        $this->stderr = '';
+        $this->signal = 0;
+        $this->time = 0;
+        $this->memory = 0;
+        unset($this->sandboxStats['run']);
+        $this->result = LanguageTask::RESULT_INTERNAL_ERR;
+    }
+
 
-        if ($this->userId !== null) {
-            exec("sudo /usr/bin/pkill -9 -u {$this->user}"); // Kill any remaining processes
-            $this->removeTemporaryFiles($this->user);
-            $this->freeUser($this->userId);
-            $this->userId = null;
-            $this->user = null;
+    // Record the state of the workspace after compilation so that it can be
+    // restored by resetWorkspace between the cases of a batch. Files made by
+    // the jobe user (e.g. compiler output) are replaced by copies it can't
+    // write, so that a file with the same inode also has the same contents.
+    // All files are then hard-linked into a private directory alongside
+    // the workspace, from which they can be restored. Subdirectories (e.g.
+    // __pycache__) are copied into the private directory and replaced by
+    // copies that the jobe user can't write, so can't change. Symbolic links
+    // are recorded by target and any other special files are deleted.
+    public function freezeWorkspace()
+    {
+        $this->pristineDir = $this->workdir . '_pristine';
+        if (!mkdir($this->pristineDir, 0700)) {
+            throw new JobException("Couldn't make directory for batch run", 500);
+        }
+        $myUid = fileowner($this->workdir);
+        $this->frozenEntries = [];
+        $this->frozenLinks = [];
+        foreach (array_diff(scandir($this->workdir), ['.', '..']) as $filename) {
+            $path = "{$this->workdir}/$filename";
+            $pristinePath = "{$this->pristineDir}/$filename";
+            if (is_link($path)) {
+                $this->frozenLinks[$filename] = readlink($path);
+                continue;
+            }
+            if (!is_file($path) && !is_dir($path)) {
+                exec("sudo rm -f " . escapeshellarg($path));
+                continue;
+            }
+            if (is_dir($path)) {
+                $ok = self::copyReadOnlyDir($path, $pristinePath);
+                if ($ok) {
+                    exec("sudo rm -R " . escapeshellarg($path));
+                    $ok = self::copyReadOnlyDir($pristinePath, $path);
+                }
+            } else {
+                $mode = fileperms($path) & 0755;
+                if (fileowner($path) === $myUid) {
+                    $ok = chmod($path, $mode) && link($path, $pristinePath);
+                } else {
+                    $ok = copy($path, $pristinePath) && chmod($pristinePath, $mode) &&
+                        unlink($path) && link($pristinePath, $path);
+                }
+            }
+            if (!$ok) {
+                throw new JobException("Couldn't prepare workspace for batch run", 500);
+            }
+            clearstatcache();
+            $this->frozenEntries[$filename] = fileinode($path);
+        }
+    }
+
+
+    // Restore the workspace to its state when freezeWorkspace was called,
+    // after killing any processes left running by the previous case and
+    // deleting its temporary files. New and replaced workspace entries,
+    // including directories, are deleted and any missing files and
+    // directories are restored from the pristine directory. Missing or
+    // retargeted symbolic links are recreated.
+    public function resetWorkspace()
+    {
+        exec("sudo /usr/bin/pkill -9 -u {$this->user}");
+        $this->removeTemporaryFiles($this->user);
+        clearstatcache();
+        $toDelete = [];
+        foreach (array_diff(scandir($this->workdir), ['.', '..']) as $filename) {
+            $path = "{$this->workdir}/$filename";
+            if (is_link($path)) {
+                $unchanged = ($this->frozenLinks[$filename] ?? null) === readlink($path);
+            } else {
+                $unchanged = ($this->frozenEntries[$filename] ?? null) === @fileinode($path);
+            }
+            if (!$unchanged) {
+                $toDelete[] = escapeshellarg($path);
+            }
+        }
+        if ($toDelete) {
+            exec("sudo rm -R " . implode(' ', $toDelete));
+        }
+        clearstatcache();
+        foreach ($this->frozenEntries as $filename => $inode) {
+            $path = "{$this->workdir}/$filename";
+            $pristinePath = "{$this->pristineDir}/$filename";
+            if (file_exists($path)) {
+                continue;
+            }
+            if (is_dir($pristinePath)) {
+                $ok = self::copyReadOnlyDir($pristinePath, $path);
+                clearstatcache();
+                $this->frozenEntries[$filename] = @fileinode($path);
+            } else {
+                $ok = link($pristinePath, $path);
+            }
+            if (!$ok) {
+                throw new JobException("Couldn't restore workspace for batch run", 500);
+            }
         }
+        foreach ($this->frozenLinks as $filename => $target) {
+            $path = "{$this->workdir}/$filename";
+            if (!is_link($path) && !symlink($target, $path)) {
+                throw new JobException("Couldn't restore workspace for batch run", 500);
+            }
+        }
+    }
 
+
+    // Recursively copy the given directory to the given new path, with
+    // nothing in the copy writable by anyone but the web server user.
+    // Return true on success.
+    private static function copyReadOnlyDir($from, $to)
+    {
+        exec('cp -R ' . escapeshellarg($from) . ' ' . escapeshellarg($to) .
+            ' && chmod -R go-w ' . escapeshellarg($to), $output, $status);
+        return $status == 0;
+    }
+
+
+    // Called to clean up task when done.
+    // If the cleanup queue is active (see CleanupQueue), the cleanup is left
+    // to the reaper, which frees the jobe user only when it's done.
+    public function close($deleteFiles = true)
+    {
+        $dirsToDelete = [];
         if ($deleteFiles && $this->workdir) {
-            $dir = $this->workdir;
-            exec("sudo rm -R $dir");
+            // Leave pooled workspaces for the reaper to delete.
+            if (!$this->fromPool || !WorkspacePool::discard($this->workdir)) {
+                $dirsToDelete[] = $this->workdir;
+            }
             $this->workdir = null;
         }
+        if ($this->pristineDir) {
+            $dirsToDelete[] = $this->pristineDir;
+            $this->pristineDir = null;
+        }
+
+        if ($this->userId !== null && CleanupQueue::isActive() &&
+                CleanupQueue::enqueue($this->userId, $dirsToDelete)) {
+            $dirsToDelete = [];
+        } elseif ($this->userId !== null) {
+            self::cleanUpUser($this->userId);
+            self::freeUser($this->userId);
+        }
+        $this->userId = null;
+        $this->user = null;
+
+        foreach ($dirsToDelete as $dir) {
+            exec("sudo rm -R $dir");
+        }
+    }
+
+
+    // Kill any remaining processes of the given jobe user and delete its
+    // temporary files. Public for use by CleanupQueue.
+    public static function cleanUpUser($userNum)
+    {
+        $user = sprintf("jobe%02d", $userNum);
+        exec("sudo /usr/bin/pkill -9 -u $user");
+        self::removeTemporaryFiles($user);
     }
 
     // ************************************************
     //    METHODS TO ALLOCATE AND FREE ONE JOBE USER
     // ************************************************
 
-    // Find a currently unused jobe user account.
+    // Find a currently unused jobe user account and mark it as in use.
     // Uses a shared memory segment containing one byte (used as a 'busy'
-    // boolean) for each of the possible user accounts.
-    // If no free accounts exist at present, the function sleeps for a
-    // second then retries, up to a maximum of MAX_RETRIES retries.
+    // boolean) for each of the possible user accounts, plus a ring buffer
+    // of the process ids of processes waiting for a free account, in order
+    // of arrival (see the SHM_ constants above). The segment is only ever
+    // accessed a few bytes at a time, with the semaphore held.
+    // If no free accounts exist at present, the process appends itself to
+    // the waiting list and then waits, for up to jobe_wait_timeout seconds,
+    // on its own named pipe for freeUser to hand it an account. Waiters are
+    // thus served in FIFO order, as soon as an account is freed.
     // Throws OverloadException if a free user cannot be found, otherwise
     // returns an integer in the range 0 to jobe_max_users - 1 inclusive.
     private function getFreeUser()
     {
-        $numUsers = config('Jobe')->jobe_max_users;
+        $numUsers = min(config('Jobe')->jobe_max_users, LanguageTask::SHM_MAX_USERS);
         $jobe_wait_timeout = config('Jobe')->jobe_wait_timeout;
-        $key = ftok(LanguageTask::SEM_KEY_FILE_PATH, LanguageTask::PROJECT_KEY);
-        $sem = sem_get($key);
-        $user = -1;
-        $retries = 0;
-        while ($user == -1) {  // Loop until we have a user (or an OverloadException is thrown)
-            $gotIt = sem_acquire($sem);
-            if ($key === -1 || $sem === false || $gotIt === false) {
-                throw new JobException("Semaphore code failed in getFreeUser", 500);
-            }
-            // Change default permission to 600 (read/write only by owner)
-            // 10000 is the default shm size
-            $shm = shm_attach($key, 10000, 0600);
-            if (!shm_has_var($shm, ACTIVE_USERS)) {
-                // First time since boot -- initialise active list
-                $active = array();
-                for ($i = 0; $i < $numUsers; $i++) {
-                    $active[$i] = false;
-                }
-                shm_put_var($shm, ACTIVE_USERS, $active);
-            }
-            $active = shm_get_var($shm, ACTIVE_USERS);
-            for ($user = 0; $user < $numUsers; $user++) {
-                if (!$active[$user]) {
-                    $active[$user] = true;
-                    shm_put_var($shm, ACTIVE_USERS, $active);
-                    break;
-                }
+        [$sem, $shm] = self::lockSharedMemory();
+        self::pruneWaiters($shm);
+        $numWaiters = self::shmReadInt($shm, LanguageTask::SHM_COUNT_OFFSET);
+        $user = false;
+        if ($numWaiters == 0) {
+            $user = strpos(shmop_read($shm, LanguageTask::SHM_USERS_OFFSET, $numUsers), "\0");
+        }
+        if ($user !== false) {
+            shmop_write($shm, "\1", LanguageTask::SHM_USERS_OFFSET + $user);
+            self::unlockSharedMemory($sem);
+            return $user;
+        }
+
+        // No free user. Join the queue of waiters, if there's room.
+        if ($numWaiters >= LanguageTask::SHM_MAX_WAITERS) {
+            self::unlockSharedMemory($sem);
+            throw new OverloadException();
+        }
+        $pid = getmypid();
+        $fifoPath = WAITER_FIFO_DIR . "/.waiter_$pid";
+        $fifo = self::makeFifo($fifoPath);
+        if ($fifo === false) {
+            self::unlockSharedMemory($sem);
+            throw new JobException("Failed to make named pipe in getFreeUser", 500);
+        }
+        $head = self::shmReadInt($shm, LanguageTask::SHM_HEAD_OFFSET);
+        self::shmWriteWaiter($shm, $head + $numWaiters, $pid);
+        self::shmWriteInt($shm, LanguageTask::SHM_COUNT_OFFSET, $numWaiters + 1);
+        self::unlockSharedMemory($sem);
+
+        try {
+            $user = false;
+            $read = [$fifo];
+            $write = $except = null;
+            if (@stream_select($read, $write, $except, $jobe_wait_timeout) > 0) {
+                $user = self::readUserNumber($fifo);
             }
-            shm_detach($shm);
-            sem_release($sem);
-            if ($user == $numUsers) {
-                $user = -1;
-                $retries += 1;
-                if ($retries <= $jobe_wait_timeout) {
-                    sleep(1);
-                } else {
-                    throw new OverloadException();
+            if ($user === false) {
+                // Timed out. Leave the queue, unless freeUser has just
+                // handed us a user (in which case we're no longer in it).
+                [$sem, $shm] = self::lockSharedMemory();
+                $head = self::shmReadInt($shm, LanguageTask::SHM_HEAD_OFFSET);
+                $numWaiters = self::shmReadInt($shm, LanguageTask::SHM_COUNT_OFFSET);
+                for ($i = $head; $i < $head + $numWaiters; $i++) {
+                    if (self::shmReadWaiter($shm, $i) == $pid) {
+                        self::shmWriteWaiter($shm, $i, 0);
+                    }
                 }
+                stream_set_blocking($fifo, false);
+                $user = self::readUserNumber($fifo);
+                self::unlockSharedMemory($sem);
             }
+        } finally {
+            fclose($fifo);
+            @unlink($fifoPath);
+        }
+        if ($user === false) {
+            throw new OverloadException();
         }
         return $user;
     }
 
 
-    // Mark the given user number (0 to jobe_max_users - 1) as free.
-    private function freeUser($userNum)
+    // Mark the given user number (0 to jobe_max_users - 1) as free or,
+    // if any processes are waiting for a user, hand it directly to the one
+    // that has waited longest. Waiters that have died are discarded.
+    // Public for use by CleanupQueue, which frees users only after cleaning up.
+    public static function freeUser($userNum)
+    {
+        [$sem, $shm] = self::lockSharedMemory();
+        $handedOver = false;
+        while (!$handedOver && ($pid = self::popWaiter($shm)) !== null) {
+            $handedOver = $pid != 0 && self::handOverUser($pid, $userNum);
+        }
+        if (!$handedOver) {
+            shmop_write($shm, "\0", LanguageTask::SHM_USERS_OFFSET + $userNum);
+        }
+        self::unlockSharedMemory($sem);
+    }
+
+
+    // Return the pair [number of jobe users in use, number of processes
+    // waiting for one]. The latter may include waiters that have given up.
+    // Public for use by Metrics.
+    public static function userCounts()
+    {
+        $numUsers = min(config('Jobe')->jobe_max_users, LanguageTask::SHM_MAX_USERS);
+        [$sem, $shm] = self::lockSharedMemory();
+        $active = substr_count(shmop_read($shm, LanguageTask::SHM_USERS_OFFSET, $numUsers), "\1");
+        $waiting = self::shmReadInt($shm, LanguageTask::SHM_COUNT_OFFSET);
+        self::unlockSharedMemory($sem);
+        return [$active, $waiting];
+    }
+
+
+    // Acquire the semaphore and open the shared memory segment that
+    // controls access to the jobe users, initialising it if this is the
+    // first use since boot. Return the pair [semaphore, shm].
+    private static function lockSharedMemory()
     {
         $key = ftok(LanguageTask::SEM_KEY_FILE_PATH, LanguageTask::PROJECT_KEY);
         $sem = sem_get($key);
-        $gotIt = sem_acquire($sem);
-        $shm = shm_attach($key);
-        if ($key === -1 || $sem === false || $gotIt === false || $shm === false) {
-            throw new JobException("Semaphore code failed in freeUser", 500);
-        }
-        $active = shm_get_var($shm, ACTIVE_USERS);
-        $active[$userNum] = false;
-        shm_put_var($shm, ACTIVE_USERS, $active);
-        shm_detach($shm);
+        $gotIt = $sem === false ? false : sem_acquire($sem);
+        if ($key === -1 || $sem === false || $gotIt === false) {
+            throw new JobException("Semaphore code failed", 500);
+        }
+        $shmKey = ftok(LanguageTask::SEM_KEY_FILE_PATH, LanguageTask::SHM_PROJECT_KEY);
+        $shm = @shmop_open($shmKey, 'c', 0600, LanguageTask::SHM_SIZE);
+        if ($shm === false) {
+            sem_release($sem);
+            throw new JobException("Shared memory code failed", 500);
+        }
+        if (shmop_read($shm, 0, 4) !== LanguageTask::SHM_MAGIC) {
+            // First time since boot -- initialise active list and waiters
+            shmop_write($shm, str_repeat("\0", LanguageTask::SHM_WAITERS_OFFSET), 0);
+            shmop_write($shm, LanguageTask::SHM_MAGIC, 0);
+        }
+        return [$sem, $shm];
+    }
+
+
+    private static function unlockSharedMemory($sem)
+    {
         sem_release($sem);
     }
 
+
+    // Remove and return the process id at the head of the waiters ring
+    // buffer, or null if it's empty. Must be called with the semaphore held.
+    private static function popWaiter($shm)
+    {
+        $numWaiters = self::shmReadInt($shm, LanguageTask::SHM_COUNT_OFFSET);
+        if ($numWaiters == 0) {
+            return null;
+        }
+        $head = self::shmReadInt($shm, LanguageTask::SHM_HEAD_OFFSET);
+        $pid = self::shmReadWaiter($shm, $head);
+        self::shmWriteInt($shm, LanguageTask::SHM_HEAD_OFFSET, ($head + 1) % LanguageTask::SHM_MAX_WAITERS);
+        self::shmWriteInt($shm, LanguageTask::SHM_COUNT_OFFSET, $numWaiters - 1);
+        return $pid;
+    }
+
+
+    // Remove any waiters that have given up or died from the head of the
+    // waiters ring buffer. Must be called with the semaphore held.
+    private static function pruneWaiters($shm)
+    {
+        while (self::shmReadInt($shm, LanguageTask::SHM_COUNT_OFFSET) > 0) {
+            $pid = self::shmReadWaiter($shm, self::shmReadInt($shm, LanguageTask::SHM_HEAD_OFFSET));
+            if ($pid != 0 && file_exists("/proc/$pid")) {
+                break;
+            }
+            self::popWaiter($shm);
+        }
+    }
+
+
+    private static function shmReadInt($shm, $offset)
+    {
+        return unpack('V', shmop_read($shm, $offset, 4))[1];
+    }
+
+
+    private static function shmWriteInt($shm, $offset, $value)
+    {
+        shmop_write($shm, pack('V', $value), $offset);
+    }
+
+
+    // Read the process id at the given index (modulo the buffer size)
+    // of the waiters ring buffer.
+    private static function shmReadWaiter($shm, $index)
+    {
+        $i = $index % LanguageTask::SHM_MAX_WAITERS;
+        return self::shmReadInt($shm, LanguageTask::SHM_WAITERS_OFFSET + 4 * $i);
+    }
+
+
+    private static function shmWriteWaiter($shm, $index, $pid)
+    {
+        $i = $index % LanguageTask::SHM_MAX_WAITERS;
+        self::shmWriteInt($shm, LanguageTask::SHM_WAITERS_OFFSET + 4 * $i, $pid);
+    }
+
+
+    // Make a named pipe with the given path, replacing any stale one left
+    // by a dead process with the same pid, and open it for reading. Opening
+    // it read-write means the open doesn't block waiting for a writer.
+    // Return the stream or false on failure.
+    private static function makeFifo($path)
+    {
+        @unlink($path);
+        if (function_exists('posix_mkfifo')) {
+            $ok = posix_mkfifo($path, 0600);
+        } else {
+            exec('mkfifo -m 600 ' . escapeshellarg($path), $output, $returnValue);
+            $ok = $returnValue === 0;
+        }
+        return $ok ? @fopen($path, 'r+') : false;
+    }
+
+
+    // Read a user number written by handOverUser from the given pipe.
+    // Return false if there's nothing to read.
+    private static function readUserNumber($fifo)
+    {
+        $line = fgets($fifo);
+        return ($line === false || trim($line) === '') ? false : intval($line);
+    }
+
+
+    // Hand the given user number to the waiting process with the given pid,
+    // by writing it to that process's named pipe. Must be called with the
+    // semaphore held. Return true on success or false if the process
+    // has died.
+    private static function handOverUser($pid, $userNum)
+    {
+        $fifoPath = WAITER_FIFO_DIR . "/.waiter_$pid";
+        if (!file_exists("/proc/$pid") || @filetype($fifoPath) !== 'fifo') {
+            return false;
+        }
+        $fifo = @fopen($fifoPath, 'r+');
+        if ($fifo === false) {
+            return false;
+        }
+        $written = fwrite($fifo, "$userNum\n");
+        fclose($fifo);
+        return $written > 0;
+    }
+
     // ************************************************
     //                  HELPER METHODS
     // ************************************************
@@ -328,6 +763,14 @@ abstract class LanguageTask
         if ($filesize != -1) {  // Runguard's default filesize ulimit is unlimited.
             $sandboxCommandBits[] = "--filesize=$filesize";
         }
+        if (config('Jobe')->private_tmp) {
+            $sandboxCommandBits[] = "--privatetmp=" . PRIVATE_TMP_BASE . "/{$this->user}";
+        }
+        // The stats file is outside the workspace, where the job can't tamper with it.
+        $statsFile = OUTPUT_FILE_DIR . "/.stats_{$this->id}";
+        if ($this->collectStats) {
+            $sandboxCommandBits[] = "--outmeta=$statsFile";
+        }
         $sandboxCmd = implode(' ', $sandboxCommandBits) .
                 ' sh -c ' . escapeshellarg($wrappedCmd) . ' >prog.out 2>prog.err';
 
@@ -346,8 +789,15 @@ abstract class LanguageTask
 
         file_put_contents('prog.cmd', $sandboxCmd);
         exec('bash prog.cmd');
+        if ($this->collectStats) {
+            $this->readSandboxStats($statsFile, $iscompile);
+        }
 
-        $output = file_get_contents("$workdir/prog.out");
+        if (!$iscompile && $this->stdoutFile !== null && rename("$workdir/prog.out", $this->stdoutFile)) {
+            $output = '';  // To be streamed from $this->stdoutFile
+        } else {
+            $output = file_get_contents("$workdir/prog.out");
+        }
         if (file_exists("{$this->workdir}/prog.err")) {
             $stderr = file_get_contents("{$this->workdir}/prog.err");
         } else {
@@ -500,6 +950,35 @@ abstract class LanguageTask
     }
 
 
+    // Read the stats file written by runguard, then delete it. The stats are
+    // recorded in $this->sandboxStats (and the run's cpu time and memory in
+    // $this->time and $this->memory) as floats keyed by the names used in the
+    // file, e.g. 'wall-time'.
+    private function readSandboxStats($statsFile, $iscompile)
+    {
+        $stats = [];
+        foreach (@file($statsFile, FILE_IGNORE_NEW_LINES) ?: [] as $line) {
+            [$name, $value] = array_pad(explode(':', $line, 2), 2, '');
+            $stats[trim($name)] = floatval($value);
+        }
+        @unlink($statsFile);
+        $this->sandboxStats[$iscompile ? 'compile' : 'run'] = $stats;
+        if (!$iscompile) {
+            $this->time = $stats['cpu-time'] ?? 0;
+            $this->memory = intval(ceil(($stats['max-rss-kb'] ?? 0) / 1024));
+        }
+    }
+
+
+    // True if the output of execution can be streamed from a file (see
+    // StreamedResultResponse) rather than read into $this->stdout, which is
+    // so unless a subclass filters the output.
+    public function canStreamStdout()
+    {
+        return (new \ReflectionMethod($this, 'filteredStdout'))->getDeclaringClass()->getName() === LanguageTask::class;
+    }
+
+
     // Return the JobeAPI result object to describe the state of this task
     public function resultObject()
     {
@@ -518,8 +997,13 @@ abstract class LanguageTask
 
     // Remove any temporary files created by the given user on completion
     // of a run
-    protected function removeTemporaryFiles($user)
+    protected static function removeTemporaryFiles($user)
     {
+        if (config('Jobe')->private_tmp) {
+            // All the user's temporary files are in its private tmp dir.
+            exec("sudo /usr/bin/find " . PRIVATE_TMP_BASE . "/$user/ -mindepth 1 -delete");
+            return;
+        }
         $path = config('Jobe')->clean_up_path;
         $dirs = explode(';', $path);
         foreach ($dirs as $dir) {
@@ -527,6 +1011,49 @@ abstract class LanguageTask
         }
     }
 
+    // Return true if successful compilations in this language should be
+    // cached by compileWithCache. Override for languages with an expensive
+    // compile step.
+    protected function isCompileCacheable()
+    {
+        return false;
+    }
+
+
+    // Return an array of all the data that determines the result of
+    // compiling the current workspace. Override to add any language-specific
+    // configuration (e.g. extra compiler flags) that affects compilation.
+    // Support files are identified by the hashes of their blobs in the file
+    // cache, so only the source file (and any support files PUT before
+    // blobs were introduced) need be read.
+    protected function compileCacheKeyData()
+    {
+        $className = substr(strrchr(static::class, '\\'), 1);
+        $language = strtolower(substr($className, 0, -strlen('Task')));
+        $files = [$this->sourceFileName => null] + $this->supportFileDigests;
+        foreach ($files as $filename => $digest) {
+            $files[$filename] = $digest ?? sha1_file("{$this->workdir}/$filename");
+        }
+        ksort($files);
+        return [
+            'language' => $language,
+            'version' => LanguagesModel::supportedLanguages()[$language] ?? null,
+            'sourcefilename' => $this->sourceFileName,
+            'compileargs' => $this->getParam('compileargs'),
+            'linkargs' => $this->getParam('linkargs'),
+            'files' => $files
+        ];
+    }
+
+
+    // Return true if the given new file in the workspace after a
+    // successful compilation should be cached as one of its artefacts.
+    // The sandbox's own files are excluded.
+    protected function isCompileArtefact($filename)
+    {
+        return !in_array($filename, ['prog.cmd', 'prog.in', 'prog.out', 'prog.err']);
+    }
+
     // ************************************************
     //  METHODS FOR DIAGNOSING THE AVAILABLE LANGUAGES
     // ************************************************
@@ -0,0 +1,286 @@
+<?php
+
+/* ==============================================================
+ *
+ * This file defines the Metrics class, which maintains counters and
+ * histograms of server activity (runs by language and outcome, waits for
+ * a free Jobe user, overloads, compile/execute/cleanup times and file cache
+ * usage) and renders them, together with gauges of current user occupancy,
+ * in the Prometheus text exposition format for GET /restapi/metrics.
+ *
+ * The counters and histograms are kept in a System V shared memory segment
+ * of METRICS_SHM_SIZE bytes, in the same sort of fixed binary layout as the
+ * user allocation segment (see LanguageTask): a 4-byte magic number then
+ * MAX_SERIES fixed-size slots, one per series (i.e. metric and label values).
+ * Each slot holds the series key (the metric name and label string,
+ * separated by a newline, NUL-padded to KEY_SIZE bytes) followed by
+ * NUM_VALUES little-endian doubles: the value of a counter, or the per-bucket
+ * counts, sum and count of a histogram. A series' slot is found by hashing its
+ * key, with linear probing, and is claimed on first use. An update, made
+ * under a semaphore, just reads the key and adds to one to three values in
+ * place. A scrape copies the segment under the semaphore and reads the user
+ * allocation segment and counts the pending async runs, so spawns no
+ * processes. The values are lost on reboot, which Prometheus handles as a
+ * counter reset.
+ *
+ * ==============================================================
+ *
+ * @copyright  2026 Richard Lobb, University of Canterbury
+ * @license    http://www.gnu.org/copyleft/gpl.html GNU GPL v3 or later
+ */
+
+namespace Jobe;
+
+define('METRICS_PROJECT_KEY', 'm');
+define('METRICS_SHM_SIZE', 262144);
+
+class Metrics
+{
+    // Upper bounds (secs) of the histogram buckets.
+    const HISTOGRAM_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60];
+
+    // The type and help text of each metric, in the order they're rendered.
+    const METRICS = [
+        'jobe_runs_total' => ['counter', 'Runs completed, by language and outcome code.'],
+        'jobe_overloads_total' => ['counter', 'Failures to get a free Jobe user in time, or to queue an async run, by reason.'],
+        'jobe_user_wait_seconds' => ['histogram', 'Time spent waiting for a free Jobe user.'],
+        'jobe_setup_seconds' => ['histogram', 'Time spent preparing run workspaces, by language.'],
+        'jobe_compile_seconds' => ['histogram', 'Time spent compiling (or restoring from the compile cache), by language.'],
+        'jobe_execute_seconds' => ['histogram', 'Time spent executing programs, by language.'],
+        'jobe_cleanup_seconds' => ['histogram', 'Time spent cleaning up after runs, by language.'],
+        'jobe_file_cache_hits_total' => ['counter', 'Support files loaded from the file cache, by method (link, reflink or copy).'],
+        'jobe_file_cache_misses_total' => ['counter', 'Support files requested but not in the file cache.'],
+        'jobe_file_cache_loaded_bytes_total' => ['counter', 'Bytes of support files loaded from the file cache into workspaces.'],
+        'jobe_file_cache_copied_bytes_total' => ['counter', 'Bytes of support files that had to be copied into workspaces.'],
+        'jobe_file_cache_stored_bytes_total' => ['counter', 'Bytes of files PUT to the file cache.'],
+        'jobe_file_cache_deduplicated_bytes_total' => ['counter', 'Bytes of files PUT whose contents were already in the file cache.'],
+        'jobe_active_users' => ['gauge', 'Jobe users currently allocated to runs.'],
+        'jobe_waiting_processes' => ['gauge', 'Processes waiting for a free Jobe user.'],
+        'jobe_max_users' => ['gauge', 'The configured number of Jobe users.'],
+        'jobe_async_queue_length' => ['gauge', 'Asynchronous runs waiting to be executed.'],
+    ];
+
+    // The layout of the shared memory segment (see above).
+    const SHM_MAGIC = 'JMTR';
+    const SHM_MAGIC_SIZE = 4;
+    const MAX_SERIES = 1024;
+    const KEY_SIZE = 128;
+    const NUM_VALUES = 15;  // count(HISTOGRAM_BUCKETS) + 2, for a histogram's sum and count
+    const SLOT_SIZE = self::KEY_SIZE + 8 * self::NUM_VALUES;
+
+    /**
+     * @return true iff metrics collection is enabled in the config file.
+     */
+    public static function isEnabled()
+    {
+        return config('Jobe')->metrics_enabled;
+    }
+
+
+    /**
+     * Add the given amount to a counter.
+     * @param string $name the metric name, a key of METRICS.
+     * @param array $labels label name => value.
+     * @param int $amount the amount to add.
+     */
+    public static function increment($name, $labels = [], $amount = 1)
+    {
+        self::add($name, $labels, [0 => $amount]);
+    }
+
+
+    /**
+     * Record an observation in a histogram.
+     * @param string $name the metric name, a key of METRICS.
+     * @param array $labels label name => value.
+     * @param float $value the observed value (secs).
+     */
+    public static function observe($name, $labels, $value)
+    {
+        $numBuckets = count(self::HISTOGRAM_BUCKETS);
+        $deltas = [$numBuckets => $value, $numBuckets + 1 => 1];
+        foreach (self::HISTOGRAM_BUCKETS as $i => $bound) {
+            if ($value <= $bound) {
+                $deltas[$i] = 1;
+                break;
+            }
+        }
+        self::add($name, $labels, $deltas);
+    }
+
+
+    /**
+     * @return string all metrics in the Prometheus text exposition format.
+     */
+    public static function render()
+    {
+        $data = [];
+        if (self::isEnabled()) {
+            [$sem, $shm] = self::lock();
+            $contents = shmop_read($shm, 0, self::SHM_MAGIC_SIZE + self::MAX_SERIES * self::SLOT_SIZE);
+            sem_release($sem);
+            $data = self::parse($contents);
+        }
+        [$active, $waiting] = LanguageTask::userCounts();
+        $data['jobe_active_users'][''] = $active;
+        $data['jobe_waiting_processes'][''] = $waiting;
+        $data['jobe_max_users'][''] = config('Jobe')->jobe_max_users;
+        if (RunQueue::isEnabled()) {
+            $data['jobe_async_queue_length'][''] = RunQueue::numPending();
+        }
+
+        $lines = [];
+        foreach (self::METRICS as $name => [$type, $help]) {
+            if (empty($data[$name])) {
+                continue;
+            }
+            $lines[] = "# HELP $name $help";
+            $lines[] = "# TYPE $name $type";
+            foreach ($data[$name] as $series => $value) {
+                if ($type === 'histogram') {
+                    $cumulative = 0;
+                    foreach (self::HISTOGRAM_BUCKETS as $i => $bound) {
+                        $cumulative += $value['buckets'][$i];
+                        $lines[] = "{$name}_bucket" . self::joinLabels($series, "le=\"$bound\"") . " $cumulative";
+                    }
+                    $lines[] = "{$name}_bucket" . self::joinLabels($series, 'le="+Inf"') . " {$value['count']}";
+                    $lines[] = "{$name}_sum" . self::joinLabels($series) . ' ' . round($value['sum'], 6);
+                    $lines[] = "{$name}_count" . self::joinLabels($series) . " {$value['count']}";
+                } else {
+                    $lines[] = $name . self::joinLabels($series) . " $value";
+                }
+            }
+        }
+        return implode("\n", $lines) . "\n";
+    }
+
+
+    // Add the given deltas (value index => amount) to the values of the
+    // given series, under the semaphore. Errors are logged but otherwise
+    // ignored, as metrics must never cause a run to fail.
+    private static function add($name, $labels, $deltas)
+    {
+        if (!self::isEnabled()) {
+            return;
+        }
+        try {
+            [$sem, $shm] = self::lock();
+            try {
+                $valuesOffset = self::findSlot($shm, $name . "\n" . self::labelString($labels)) + self::KEY_SIZE;
+                foreach ($deltas as $i => $delta) {
+                    $offset = $valuesOffset + 8 * $i;
+                    $value = unpack('e', shmop_read($shm, $offset, 8))[1];
+                    shmop_write($shm, pack('e', $value + $delta), $offset);
+                }
+            } finally {
+                sem_release($sem);
+            }
+        } catch (\Throwable $e) {
+            log_message('error', 'Metrics: update failed (' . $e->getMessage() . ')');
+        }
+    }
+
+
+    // Return the offset of the slot of the series with the given key,
+    // claiming a free slot for it if it hasn't got one. Must be called with
+    // the semaphore held.
+    private static function findSlot($shm, $key)
+    {
+        if (strlen($key) > self::KEY_SIZE) {
+            throw new \RuntimeException("series key too long ($key)");
+        }
+        $paddedKey = str_pad($key, self::KEY_SIZE, "\0");
+        $hash = crc32($key);
+        for ($i = 0; $i < self::MAX_SERIES; $i++) {
+            $offset = self::SHM_MAGIC_SIZE + (($hash + $i) % self::MAX_SERIES) * self::SLOT_SIZE;
+            $slotKey = shmop_read($shm, $offset, self::KEY_SIZE);
+            if ($slotKey === $paddedKey) {
+                return $offset;
+            } elseif ($slotKey[0] === "\0") {
+                shmop_write($shm, $paddedKey, $offset);
+                return $offset;
+            }
+        }
+        throw new \RuntimeException('no free series slots');
+    }
+
+
+    // Return the metrics data in the given copy of the shared memory
+    // segment, as an array [metric name => [label string => value]], where
+    // the value of a histogram is an array of its per-bucket counts, sum
+    // and count.
+    private static function parse($contents)
+    {
+        $numBuckets = count(self::HISTOGRAM_BUCKETS);
+        $data = [];
+        for ($offset = self::SHM_MAGIC_SIZE; $offset < strlen($contents); $offset += self::SLOT_SIZE) {
+            $key = rtrim(substr($contents, $offset, self::KEY_SIZE), "\0");
+            if ($key === '') {
+                continue;
+            }
+            [$name, $series] = explode("\n", $key, 2);
+            if (!isset(self::METRICS[$name])) {
+                continue;
+            }
+            $values = array_values(unpack('e*', substr($contents, $offset + self::KEY_SIZE, 8 * self::NUM_VALUES)));
+            if (self::METRICS[$name][0] === 'histogram') {
+                $data[$name][$series] = [
+                    'buckets' => array_slice($values, 0, $numBuckets),
+                    'sum' => $values[$numBuckets],
+                    'count' => $values[$numBuckets + 1],
+                ];
+            } else {
+                $data[$name][$series] = $values[0];
+            }
+        }
+        foreach ($data as &$seriesValues) {
+            ksort($seriesValues);
+        }
+        return $data;
+    }
+
+
+    // Acquire the metrics semaphore and open the shared memory segment,
+    // initialising it if this is the first use since boot.
+    // Return the pair [semaphore, shm].
+    private static function lock()
+    {
+        $key = ftok(LanguageTask::SEM_KEY_FILE_PATH, METRICS_PROJECT_KEY);
+        $sem = $key === -1 ? false : sem_get($key);
+        if ($sem === false || !sem_acquire($sem)) {
+            throw new JobException('Metrics semaphore code failed', 500);
+        }
+        $shm = @shmop_open($key, 'c', 0600, METRICS_SHM_SIZE);
+        if ($shm === false) {
+            sem_release($sem);
+            throw new JobException('Metrics shared memory code failed', 500);
+        }
+        if (shmop_read($shm, 0, self::SHM_MAGIC_SIZE) !== self::SHM_MAGIC) {
+            shmop_write($shm, str_repeat("\0", METRICS_SHM_SIZE), 0);
+            shmop_write($shm, self::SHM_MAGIC, 0);
+        }
+        return [$sem, $shm];
+    }
+
+
+    // Return the given labels in exposition format, without braces,
+    // e.g. 'language="c",outcome="15"'.
+    private static function labelString($labels)
+    {
+        $pairs = [];
+        foreach ($labels as $label => $value) {
+            $escaped = str_replace(['\\', '"', "\n"], ['\\\\', '\\"', '\\n'], strval($value));
+            $pairs[] = "$label=\"$escaped\"";
+        }
+        return implode(',', $pairs);
+    }
+
+
+    // Return the given label strings joined and wrapped in braces, or the
+    // empty string if there are no labels.
+    private static function joinLabels(...$labelStrings)
+    {
+        $labels = implode(',', array_filter($labelStrings, 'strlen'));
+        return $labels === '' ? '' : '{' . $labels . '}';
+    }
+}
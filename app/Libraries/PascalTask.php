@@ -61,4 +61,10 @@ class PascalTask extends LanguageTask
     {
         return '';
     }
+
+    // Compilation is slow enough to be worth caching.
+    protected function isCompileCacheable()
+    {
+        return true;
+    }
 }
@@ -0,0 +1,141 @@
+<?php
+
+/* ==============================================================
+ *
+ * This file defines the PrecompiledHeaders class, which builds and manages
+ * directories of GCC precompiled headers (.gch files) for commonly-included
+ * headers, e.g. <bits/stdc++.h> in C++, whose parsing is most of the time
+ * taken to compile a typical small program. Passing such a directory to the
+ * compiler with -I makes it use a precompiled header in place of the
+ * corresponding header, if the header is the first one included and the
+ * compiler and options match those used to build it. Otherwise GCC
+ * silently ignores the .gch file and continues its search for the header
+ * in the usual way.
+ *
+ * Each directory is PCH_BASE/<compiler name>-<hash of compiler and
+ * options>. Directories are never built on the request path, but by the
+ * jobe:pch spark command, which the installer runs. Until the directory
+ * for the current compiler exists (e.g. after a compiler upgrade, until
+ * jobe:pch is rerun), programs are compiled without precompiled headers.
+ * When a new directory is built, any others for the same compiler (e.g.
+ * for a previous compiler version) are deleted.
+ *
+ * ==============================================================
+ *
+ * @copyright  2026 Richard Lobb, University of Canterbury
+ * @license    http://www.gnu.org/copyleft/gpl.html GNU GPL v3 or later
+ */
+
+namespace Jobe;
+
+define('PCH_BASE', '/home/jobe/pch');
+
+class PrecompiledHeaders
+{
+    /**
+     * @return true iff precompiled headers are enabled in the config file and
+     * the directory for them (made by the installer) exists.
+     */
+    public static function isEnabled()
+    {
+        return config('Jobe')->precompiled_headers && is_dir(PCH_BASE);
+    }
+
+
+    /**
+     * Return the directory of precompiled versions of the given headers,
+     * built for the given compiler and options, if it has been built.
+     * @param string $compiler the full path to the compiler, e.g. /usr/bin/g++.
+     * @param array $compileArgs the compiler options.
+     * @param array $headers the names of the headers as used in #include <...>.
+     * @return ?string the directory, or null if it hasn't been built.
+     */
+    public static function includeDir($compiler, $compileArgs, $headers)
+    {
+        $dir = self::dirName($compiler, $compileArgs, $headers);
+        return $dir !== null && is_dir($dir) ? $dir : null;
+    }
+
+
+    /**
+     * Build the directory of precompiled versions of the given headers for
+     * the given compiler and options, unless it already exists, and delete
+     * any directories for other versions of the compiler. Headers that fail
+     * to precompile are left out.
+     * @param string $compiler the full path to the compiler, e.g. /usr/bin/g++.
+     * @param string $headerLanguage the compiler's -x option for headers.
+     * @param array $compileArgs the compiler options.
+     * @param array $headers the names of the headers as used in #include <...>.
+     * @return ?string the directory, or null if it can't be built.
+     */
+    public static function build($compiler, $headerLanguage, $compileArgs, $headers)
+    {
+        $dir = self::dirName($compiler, $compileArgs, $headers);
+        if ($dir === null) {
+            return null;
+        }
+        $lock = @fopen("$dir.lock", 'c');
+        if ($lock === false || !flock($lock, LOCK_EX)) {
+            return null;
+        }
+        try {
+            if (!is_dir($dir)) {
+                log_message('info', "*jobe*: building precompiled headers for $compiler");
+                self::buildDir($dir, $compiler, $headerLanguage, $compileArgs, $headers);
+            }
+            $prefix = PCH_BASE . '/' . basename($compiler) . '-';
+            foreach (glob("$prefix*", GLOB_ONLYDIR) as $oldDir) {
+                if ($oldDir !== $dir && !str_ends_with($oldDir, '.tmp')) {
+                    exec('rm -rf ' . escapeshellarg($oldDir));
+                    @unlink("$oldDir.lock");
+                }
+            }
+        } finally {
+            flock($lock, LOCK_UN);
+            fclose($lock);
+        }
+        return is_dir($dir) ? $dir : null;
+    }
+
+
+    // Return the name of the directory of precompiled headers for the given
+    // compiler, options and headers, or null if there's no such compiler.
+    private static function dirName($compiler, $compileArgs, $headers)
+    {
+        $compilerPath = realpath($compiler);
+        if ($compilerPath === false) {
+            return null;
+        }
+        $hash = sha1(json_encode([$compilerPath, filemtime($compilerPath), $compileArgs, $headers]));
+        return PCH_BASE . '/' . basename($compiler) . "-$hash";
+    }
+
+
+    // Build the directory $dir of precompiled headers. Each header is
+    // compiled from a one-line wrapper file that includes it. The wrappers
+    // are kept out of $dir, otherwise a wrapper would be found by the
+    // compiler in place of its header whenever the .gch file is unusable.
+    private static function buildDir($dir, $compiler, $headerLanguage, $compileArgs, $headers)
+    {
+        $tempDir = "$dir.tmp";
+        exec('rm -rf ' . escapeshellarg($tempDir));
+        $args = implode(' ', array_map('escapeshellarg', $compileArgs));
+        foreach ($headers as $header) {
+            $wrapper = "$tempDir/src/$header";
+            $gch = "$tempDir/pch/$header.gch";
+            @mkdir(dirname($wrapper), 0755, true);
+            @mkdir(dirname($gch), 0755, true);
+            file_put_contents($wrapper, "#include <$header>\n");
+            exec(escapeshellarg($compiler) . " $args -x $headerLanguage " . escapeshellarg($wrapper) .
+                ' -o ' . escapeshellarg($gch) . ' >/dev/null 2>&1', $output, $status);
+            if ($status != 0) {
+                log_message('error', "PrecompiledHeaders: failed to precompile <$header> with $compiler");
+                @unlink($gch);
+            }
+        }
+        @mkdir("$tempDir/pch", 0755, true);
+        chmod("$tempDir/pch", 0755);
+        rename("$tempDir/pch", $dir);
+        exec('rm -rf ' . escapeshellarg($tempDir));
+    }
+}
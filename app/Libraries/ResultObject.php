@@ -13,7 +13,10 @@
 
  namespace Jobe;
 
-class ResultObject
+define('RESULT_JSON_FLAGS', JSON_UNESCAPED_UNICODE | JSON_UNESCAPED_SLASHES);  // As in Config\Format
+define('STREAM_CHUNK_SIZE', 65536);
+
+class ResultObject implements \JsonSerializable
 {
 
     public ?string $run_id;
@@ -22,6 +25,15 @@ class ResultObject
     public string $stdout;
     public string $stderr;
 
+    // Optional resource usage fields, included in the JSON only if set
+    // (when the run_spec has a true 'metrics' attribute). Times are in secs.
+    const OPTIONAL_FIELDS = ['compile_time', 'run_cpu_time', 'wall_time', 'max_rss_kb', 'overhead'];
+    public ?float $compile_time = null;  // Wall time of compilation in the sandbox
+    public ?float $run_cpu_time = null;  // CPU time of execution
+    public ?float $wall_time = null;     // Wall time of execution in the sandbox
+    public ?int $max_rss_kb = null;      // Peak resident memory of execution
+    public ?array $overhead = null;      // Server wall time of setup, compile, run and cleanup
+
     public function __construct(
         $run_id,
         $outcome,
@@ -37,6 +49,18 @@ class ResultObject
     }
 
 
+    public function jsonSerialize(): mixed
+    {
+        $fields = get_object_vars($this);
+        foreach (self::OPTIONAL_FIELDS as $name) {
+            if ($fields[$name] === null) {
+                unset($fields[$name]);
+            }
+        }
+        return $fields;
+    }
+
+
     protected static function clean(&$s)
     {
         // If the given parameter string is valid utf-8, it is returned
@@ -47,17 +71,94 @@ class ResultObject
         if (mb_check_encoding($s, 'UTF-8')) {
             return $s;
         } else {
-            $new_s = '';  // Output string
-            $n = strlen($s);
-            for ($i = 0; $i < $n; $i++) {
-                $c = $s[$i];
+            return self::sanitise($s);
+        }
+    }
+
+
+    // Return a copy of $s with all control chars except newlines, tabs and
+    // returns, and all non-ASCII chars, replaced with hex equivalents.
+    // Done with a single strtr over the whole string, using a map from each
+    // such byte to its replacement, built on first use. See benchmarkclean.php.
+    protected static function sanitise($s)
+    {
+        static $hexMap = null;
+        if ($hexMap === null) {
+            $hexMap = [];
+            for ($i = 0; $i < 256; $i++) {
+                $c = chr($i);
                 if (($c != "\n" && $c != "\r" && $c != "\t" && $c < " ") || $c > "\x7E") {
-                    $c = '\\x' . sprintf("%02x", ord($c));
+                    $hexMap[$c] = sprintf('\\x%02x', $i);
                 }
-                $new_s .= $c;
             }
+        }
+        return strtr($s, $hexMap);
+    }
+
+
+    /**
+     * Pass the contents of the given file, cleaned as by clean() and encoded
+     * as the body of a JSON string (i.e. without the quotes), to the given
+     * function, one chunk at a time. Memory use is independent of the size
+     * of the file. The file is read twice: first to check that it's valid
+     * UTF-8 and then to output it. Chunks are split only at UTF-8 character
+     * boundaries, so each can be JSON-encoded separately.
+     * @param string $path the file to read.
+     * @param callable $output the function to call with each chunk.
+     */
+    public static function streamCleanedFile($path, $output)
+    {
+        $isValid = true;
+        self::readChunks($path, function ($chunk) use (&$isValid) {
+            $isValid = $isValid && mb_check_encoding($chunk, 'UTF-8');
+        });
+        self::readChunks($path, function ($chunk) use ($isValid, $output) {
+            $chunk = $isValid ? $chunk : self::sanitise($chunk);
+            $output(substr(json_encode($chunk, RESULT_JSON_FLAGS), 1, -1));
+        });
+    }
+
+
+    // Read the given file in chunks of about STREAM_CHUNK_SIZE bytes, passing
+    // each to the given function. Chunks end at UTF-8 character boundaries
+    // (assuming valid UTF-8), except for the last.
+    private static function readChunks($path, $process)
+    {
+        $handle = fopen($path, 'rb');
+        if ($handle === false) {
+            throw new JobException("Can't read output file", 500);
+        }
+        $carry = '';  // An incomplete character from the end of the previous chunk
+        try {
+            while (($data = fread($handle, STREAM_CHUNK_SIZE)) !== false && $data !== '') {
+                $data = $carry . $data;
+                $length = self::completeCharsLength($data);
+                $carry = substr($data, $length);
+                $process(substr($data, 0, $length));
+            }
+            if ($carry !== '') {
+                $process($carry);
+            }
+        } finally {
+            fclose($handle);
+        }
+    }
 
-            return $new_s;
+
+    // Return the length of the longest prefix of the UTF-8 string $s that
+    // doesn't end with an incomplete multibyte character.
+    private static function completeCharsLength($s)
+    {
+        $n = strlen($s);
+        for ($i = $n - 1; $i >= max(0, $n - 4); $i--) {
+            $byte = ord($s[$i]);
+            if ($byte < 0x80) {
+                return $n;
+            } elseif ($byte >= 0xC0) {  // Lead byte of a multibyte char
+                $charLength = $byte >= 0xF0 ? 4 : ($byte >= 0xE0 ? 3 : 2);
+                return $i + $charLength <= $n ? $n : $i;
+            }
         }
+        return $n;  // Not valid UTF-8
     }
 }
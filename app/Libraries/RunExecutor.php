@@ -0,0 +1,113 @@
+<?php
+
+/* ==============================================================
+ *
+ * This file defines the RunExecutor class, which runs a single job
+ * specified by a RunSpecifier, i.e. creates the language task, prepares
+ * its execution environment, compiles and executes it, and cleans up.
+ * Used both for synchronous runs (by the Runs controller) and for
+ * queued asynchronous runs (by the jobe:worker command).
+ *
+ * ==============================================================
+ *
+ * @copyright  2026 Richard Lobb, University of Canterbury
+ * @license    http://www.gnu.org/copyleft/gpl.html GNU GPL v3 or later
+ */
+
+namespace Jobe;
+
+class RunExecutor
+{
+    public ?LanguageTask $task = null;
+    public float $setupTime = 0.0;    // Wall-clock time to prepare the workspace (secs)
+    public float $compileTime = 0.0;  // Wall-clock time to compile (secs)
+    public float $runTime = 0.0;      // Wall-clock time to execute (secs)
+    public float $cleanupTime = 0.0;  // Wall-clock time to clean up (secs)
+
+    /**
+     * Compile and execute the given run.
+     * @param RunSpecifier $run the run to execute.
+     * @return ResultObject the result of the run.
+     * @throws JobException if the run is invalid (e.g. a file is missing).
+     * @throws OverloadException if no Jobe user became free in time.
+     */
+    public function run($run)
+    {
+        $reqdTaskClass = "\\Jobe\\" . ucwords($run->language_id) . 'Task';
+        $this->task = new $reqdTaskClass($run->sourcefilename, $run->input, $run->parameters);
+        $this->task->collectStats = $run->metrics;
+        if ($run->stream && $this->task->canStreamStdout()) {
+            $this->task->stdoutFile = OUTPUT_FILE_DIR . '/.stdout_' . bin2hex(random_bytes(8));
+        }
+
+        // The nested tries here are a bit ugly, but the point is that we want to
+        // to clean up the task with close() before handling the exception, and
+        // to delete any output file that won't now be streamed.
+        $done = false;
+        try {
+            try {
+                $startTime = microtime(true);
+                $this->task->prepareExecutionEnvironment($run->sourcecode, $run->files);
+                $this->setupTime = microtime(true) - $startTime;
+                log_message('debug', "RunExecutor: compiling job {$this->task->id}");
+                $startTime = microtime(true);
+                $this->task->compileWithCache();
+                $this->compileTime = microtime(true) - $startTime;
+                if (empty($this->task->cmpinfo)) {
+                    log_message('debug', "RunExecutor: executing job {$this->task->id}");
+                    $startTime = microtime(true);
+                    $this->task->execute();
+                    $this->runTime = microtime(true) - $startTime;
+                }
+            } finally {
+                // Free user and delete task run directory unless it's a debug run.
+                $startTime = microtime(true);
+                $this->task->close(!$run->debug);
+                $this->cleanupTime = microtime(true) - $startTime;
+            }
+            $result = $this->task->resultObject();
+            if ($run->metrics) {
+                $this->addMetrics($result);
+            }
+            $this->recordMetrics($run, $result);
+            $done = true;
+        } finally {
+            if (!$done && $this->task->stdoutFile !== null) {
+                @unlink($this->task->stdoutFile);
+            }
+        }
+        return $result;
+    }
+
+
+    // Record the outcome and timings of the completed run in the server's
+    // metrics (see Metrics).
+    private function recordMetrics($run, $result)
+    {
+        $labels = ['language' => $run->language_id];
+        Metrics::increment('jobe_runs_total', $labels + ['outcome' => $result->outcome]);
+        Metrics::observe('jobe_setup_seconds', $labels, $this->setupTime);
+        Metrics::observe('jobe_compile_seconds', $labels, $this->compileTime);
+        if (empty($this->task->cmpinfo)) {
+            Metrics::observe('jobe_execute_seconds', $labels, $this->runTime);
+        }
+        Metrics::observe('jobe_cleanup_seconds', $labels, $this->cleanupTime);
+    }
+
+
+    // Set the optional resource usage fields of the given result.
+    private function addMetrics($result)
+    {
+        $stats = $this->task->sandboxStats;
+        $result->compile_time = round($stats['compile']['wall-time'] ?? 0.0, 3);  // 0 if cached
+        $result->run_cpu_time = round($stats['run']['cpu-time'] ?? 0.0, 3);
+        $result->wall_time = round($stats['run']['wall-time'] ?? 0.0, 3);
+        $result->max_rss_kb = intval($stats['run']['max-rss-kb'] ?? 0);
+        $result->overhead = [
+            'setup' => round($this->setupTime, 3),
+            'compile' => round($this->compileTime, 3),
+            'run' => round($this->runTime, 3),
+            'cleanup' => round($this->cleanupTime, 3),
+        ];
+    }
+}
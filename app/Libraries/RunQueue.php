@@ -0,0 +1,201 @@
+<?php
+
+/* ==============================================================
+ *
+ * This file defines the RunQueue class, which manages the queue of
+ * asynchronous runs, i.e. runs whose run_spec has a true 'async'
+ * attribute. Such runs are given a random run id and queued for execution
+ * by the jobe:worker command (see app/Commands/Worker.php), and their
+ * results are later retrieved by a GET of /restapi/runs/<run_id>.
+ *
+ * The queue is a set of files in the RUN_QUEUE_BASE directory tree:
+ *   pending/<seq>_<id>.json        Post data of runs waiting to be executed.
+ *   running/<pid>_<seq>_<id>.json  Runs being executed by worker process <pid>.
+ *   results/<id>.json              Results, kept for async_result_ttl secs.
+ * where <seq> is the submission time, so that sorting the pending file
+ * names gives FIFO order. Files are written under a temporary name and then
+ * renamed, and a worker claims a run by renaming it into the running
+ * directory, so no locking is required.
+ *
+ * ==============================================================
+ *
+ * @copyright  2026 Richard Lobb, University of Canterbury
+ * @license    http://www.gnu.org/copyleft/gpl.html GNU GPL v3 or later
+ */
+
+namespace Jobe;
+
+define('RUN_QUEUE_BASE', '/home/jobe/queue');
+
+class RunQueue
+{
+    /**
+     * @return true iff asynchronous runs are enabled in the config file.
+     */
+    public static function isEnabled()
+    {
+        return config('Jobe')->async_queue_size > 0;
+    }
+
+
+    /**
+     * @param mixed $runId a purported run id.
+     * @return true iff the given run id is syntactically valid.
+     */
+    public static function isValidId($runId)
+    {
+        return is_string($runId) && strlen($runId) == 32 && ctype_xdigit($runId);
+    }
+
+
+    /**
+     * Add the given run to the queue.
+     * @param object $postData the decoded JSON post data of the run.
+     * @return string the run id.
+     * @throws OverloadException if the queue is full.
+     */
+    public static function enqueue($postData)
+    {
+        $pendingDir = RUN_QUEUE_BASE . '/pending';
+        if (self::numPending() >= config('Jobe')->async_queue_size) {
+            Metrics::increment('jobe_overloads_total', ['reason' => 'queue_full']);
+            throw new OverloadException();
+        }
+        $runId = bin2hex(random_bytes(16));
+        $seq = sprintf('%017.6f', microtime(true));
+        unset($postData->run_spec->async);
+        if (!self::writeFile("$pendingDir/{$seq}_$runId.json", json_encode($postData))) {
+            throw new JobException('Failed to queue run', 500);
+        }
+        return $runId;
+    }
+
+
+    /**
+     * @return int the number of runs waiting to be executed.
+     */
+    public static function numPending()
+    {
+        // Excluding '.', '..' and the temporary files of runs being queued.
+        return count(array_filter(scandir(RUN_QUEUE_BASE . '/pending'), fn($filename) => $filename[0] !== '.'));
+    }
+
+
+    /**
+     * Claim the oldest pending run for execution by this process.
+     * @return ?array a triple (run id, submission time, decoded post data)
+     * or null if there are no pending runs.
+     */
+    public static function claim()
+    {
+        $pendingDir = RUN_QUEUE_BASE . '/pending';
+        $pid = getmypid();
+        foreach (scandir($pendingDir) as $filename) {
+            if ($filename[0] === '.') {
+                continue;
+            }
+            $runningPath = RUN_QUEUE_BASE . "/running/{$pid}_$filename";
+            if (@rename("$pendingDir/$filename", $runningPath)) {
+                [$seq, $runId] = explode('_', basename($filename, '.json'));
+                return [$runId, floatval($seq), json_decode(file_get_contents($runningPath))];
+            }
+            // Otherwise another worker got it first.
+        }
+        return null;
+    }
+
+
+    /**
+     * Return a run claimed by this process to the queue, in its original
+     * position, e.g. because no Jobe user is available.
+     * @param string $runId the run id.
+     */
+    public static function requeue($runId)
+    {
+        foreach (glob(RUN_QUEUE_BASE . '/running/' . getmypid() . "_*_$runId.json") as $path) {
+            $filename = substr(basename($path), strpos(basename($path), '_') + 1);
+            rename($path, RUN_QUEUE_BASE . "/pending/$filename");
+        }
+    }
+
+
+    /**
+     * Record the result of a run claimed by this process.
+     * @param string $runId the run id.
+     * @param int $httpStatus the HTTP status with which to return the result.
+     * @param mixed $result the result: a ResultObject or an error message.
+     */
+    public static function complete($runId, $httpStatus, $result)
+    {
+        $data = json_encode(['http_status' => $httpStatus, 'result' => $result]);
+        if (!self::writeFile(RUN_QUEUE_BASE . "/results/$runId.json", $data)) {
+            log_message('error', "RunQueue: failed to write result of run $runId");
+        }
+        foreach (glob(RUN_QUEUE_BASE . '/running/' . getmypid() . "_*_$runId.json") as $path) {
+            unlink($path);
+        }
+    }
+
+
+    /**
+     * @param string $runId the run id.
+     * @return ?array the result of the given run, as an associative array
+     * with keys 'http_status' and 'result', or null if it's not finished.
+     */
+    public static function result($runId)
+    {
+        $json = @file_get_contents(RUN_QUEUE_BASE . "/results/$runId.json");
+        return $json === false ? null : json_decode($json, true);
+    }
+
+
+    /**
+     * @param string $runId the run id of an unfinished run.
+     * @return ?string 'queued' or 'running', or null if there's no such
+     * unfinished run.
+     */
+    public static function status($runId)
+    {
+        if (glob(RUN_QUEUE_BASE . "/pending/*_$runId.json")) {
+            return 'queued';
+        } elseif (glob(RUN_QUEUE_BASE . "/running/*_$runId.json")) {
+            return 'running';
+        } else {
+            return null;
+        }
+    }
+
+
+    /**
+     * Tidy the queue: delete results older than the configured time to live
+     * and requeue any runs claimed by worker processes that have died.
+     */
+    public static function tidy()
+    {
+        $expiryTime = time() - config('Jobe')->async_result_ttl;
+        foreach (glob(RUN_QUEUE_BASE . '/results/*.json') as $path) {
+            if (@filemtime($path) < $expiryTime) {
+                @unlink($path);
+            }
+        }
+        foreach (glob(RUN_QUEUE_BASE . '/running/*.json') as $path) {
+            [$pid, $filename] = explode('_', basename($path), 2);
+            if (!file_exists("/proc/$pid")) {
+                log_message('info', "*jobe*: requeueing run abandoned by worker $pid");
+                @rename($path, RUN_QUEUE_BASE . "/pending/$filename");
+            }
+        }
+    }
+
+
+    // Write the given data to the given path via a temporary file, so that
+    // the file never appears partially written. Return true on success.
+    private static function writeFile($path, $data)
+    {
+        $tempPath = dirname($path) . '/.' . basename($path);
+        if (@file_put_contents($tempPath, $data) === false) {
+            return false;
+        }
+        return rename($tempPath, $path);
+    }
+}
@@ -26,6 +26,9 @@ class RunSpecifier
     public array $parameters = [];
     public array $files = [];
     public bool $debug = false;
+    public bool $async = false;
+    public bool $stream = false;
+    public bool $metrics = false;
 
     public function __construct($postDataJson)
     {
@@ -57,14 +60,21 @@ class RunSpecifier
         // Get debug flag.
         $this->debug = $run->debug ?? config('Jobe')->debugging;
 
+        // Get async flag. Asynchronous runs are queued (see RunQueue).
+        $this->async = !empty($run->async);
+        if ($this->async && !RunQueue::isEnabled()) {
+            throw new JobException('Asynchronous runs are not enabled on this Jobe server', 400);
+        }
+
+        // Get stream flag. Synchronous runs only (see StreamedResultResponse).
+        $this->stream = !empty($run->stream) && !$this->async;
+
+        // Get metrics flag, which adds resource usage fields to the result.
+        $this->metrics = !empty($run->metrics);
+
         // Get the parameters, and validate.
         $this->parameters = (array) ($run->parameters ?? []);
-        $config = config('Jobe');
-        $max_cpu_time = $config->cputime_upper_limit_secs;
-
-        if (intval($this->parameters['cputime'] ?? 0) > $max_cpu_time) {
-            throw new JobException("cputime exceeds maximum allowed on this Jobe server ($max_cpu_time secs)", 400);
-        }
+        self::validateParameters($this->parameters);
 
         if (isset($run->sourcefilename)) {
             if (!self:: isValidSourceFilename($run->sourcefilename)) {
@@ -86,6 +96,15 @@ class RunSpecifier
         }
     }
 
+    // Throw a JobException if the given run parameters aren't acceptable.
+    protected static function validateParameters($parameters)
+    {
+        $max_cpu_time = config('Jobe')->cputime_upper_limit_secs;
+        if (intval($parameters['cputime'] ?? 0) > $max_cpu_time) {
+            throw new JobException("cputime exceeds maximum allowed on this Jobe server ($max_cpu_time secs)", 400);
+        }
+    }
+
     // Return true unless the given filename looks dangerous, e.g. has '/' or '..'
     // substrings. Uses code from https://stackoverflow.com/questions/2021624/string-sanitizer-for-filename
     private static function isValidSourceFilename($filename)
@@ -0,0 +1,62 @@
+<?php
+
+/* ==============================================================
+ *
+ * This file defines the StreamedResultResponse class, the response to a
+ * run with a true 'stream' attribute in its run_spec. The response body is
+ * the JSON-encoded ResultObject, as usual, except that the stdout attribute
+ * is read from the file to which the run's output was moved and sent in
+ * chunks as it's read, with no Content-Length header (so the web server
+ * uses chunked transfer encoding). The memory used is thus independent
+ * of the size of the output.
+ *
+ * ==============================================================
+ *
+ * @copyright  2026 Richard Lobb, University of Canterbury
+ * @license    http://www.gnu.org/copyleft/gpl.html GNU GPL v3 or later
+ */
+
+namespace Jobe;
+
+use CodeIgniter\HTTP\Response;
+
+class StreamedResultResponse extends Response
+{
+    private ResultObject $resultObject;
+    private string $stdoutFile;
+
+    /**
+     * @param ResultObject $resultObject the result, with empty stdout.
+     * @param string $stdoutFile the file containing the run's output, which
+     * is deleted once sent.
+     */
+    public function __construct($resultObject, $stdoutFile)
+    {
+        parent::__construct(config('App'));
+        $this->resultObject = $resultObject;
+        $this->stdoutFile = $stdoutFile;
+        $this->setStatusCode(200);
+        $this->setContentType('application/json');
+    }
+
+
+    public function sendBody()
+    {
+        try {
+            // Split the JSON encoding of the result around a placeholder for stdout.
+            $placeholder = 'STDOUT-' . bin2hex(random_bytes(8));
+            $this->resultObject->stdout = $placeholder;
+            $json = json_encode($this->resultObject, RESULT_JSON_FLAGS);
+            [$head, $tail] = explode($placeholder, $json, 2);
+            echo $head;
+            ResultObject::streamCleanedFile($this->stdoutFile, function ($chunk) {
+                echo $chunk;
+                flush();
+            });
+            echo $tail;
+        } finally {
+            @unlink($this->stdoutFile);
+        }
+        return $this;
+    }
+}
@@ -0,0 +1,124 @@
+<?php
+
+/* ==============================================================
+ *
+ * This file defines the TraceCapture class, which optionally records
+ * every run submitted to the server in a workload trace file, for use
+ * in capacity planning and for regression benchmarks with
+ * loadtester.py --replay.
+ *
+ * The trace is a gzipped JSONL file, with one line per run of the form
+ *   {"time": <arrival time, secs since epoch>,
+ *    "run_spec": {<language_id, sourcefilename, file_list, parameters and,
+ *                 if so configured, sourcecode and input>},
+ *    "sourcecode_size": <bytes>, "input_size": <bytes>,
+ *    "result": {"outcome": <outcome code or null>, "http_status": <status>,
+ *               "compile_time": <secs>, "run_time": <secs>}}
+ * Each line is appended as a separate gzip member, which is still a valid
+ * gzip file, so that concurrent requests can append without coordination
+ * beyond an exclusive lock on the write. When the file grows beyond the
+ * configured size it is renamed with a timestamp suffix and a new file
+ * is started.
+ *
+ * ==============================================================
+ *
+ * @copyright  2026 Richard Lobb, University of Canterbury
+ * @license    http://www.gnu.org/copyleft/gpl.html GNU GPL v3 or later
+ */
+
+namespace Jobe;
+
+class TraceCapture
+{
+    /**
+     * @return true iff trace capture is enabled in the config file.
+     */
+    public static function isEnabled()
+    {
+        return config('Jobe')->trace_capture_file !== '';
+    }
+
+    /**
+     * Append a record of the given run to the trace file, if capture is
+     * enabled. Errors are logged but otherwise ignored, as capture must
+     * never cause a run to fail.
+     * @param float $arrivalTime the time the request arrived (microtime(true)).
+     * @param RunSpecifier $run the run specification.
+     * @param ?int $outcome the outcome of the run, or null if it failed with
+     * a JobException.
+     * @param int $httpStatus the HTTP status code of the response.
+     * @param float $compileTime the wall-clock time taken to compile (secs).
+     * @param float $runTime the wall-clock time taken to execute (secs).
+     */
+    public static function record($arrivalTime, $run, $outcome, $httpStatus, $compileTime, $runTime)
+    {
+        if (!self::isEnabled()) {
+            return;
+        }
+        $config = config('Jobe');
+        $runSpec = [
+            'language_id' => $run->language_id,
+            'sourcefilename' => $run->sourcefilename,
+            'file_list' => $run->files,
+            'parameters' => (object) $run->parameters,
+        ];
+        if ($config->trace_capture_sourcecode) {
+            $runSpec['sourcecode'] = $run->sourcecode;
+            $runSpec['input'] = $run->input;
+        }
+        $record = [
+            'time' => round($arrivalTime, 3),
+            'run_spec' => $runSpec,
+            'sourcecode_size' => strlen($run->sourcecode),
+            'input_size' => strlen($run->input),
+            'result' => [
+                'outcome' => $outcome,
+                'http_status' => $httpStatus,
+                'compile_time' => round($compileTime, 3),
+                'run_time' => round($runTime, 3),
+            ],
+        ];
+
+        try {
+            $line = json_encode($record, JSON_UNESCAPED_SLASHES | JSON_INVALID_UTF8_SUBSTITUTE);
+            if ($line === false) {
+                throw new \RuntimeException(json_last_error_msg());
+            }
+            self::append($config->trace_capture_file, gzencode($line . "\n"), $config->trace_capture_max_mb);
+        } catch (\Throwable $e) {
+            log_message('error', 'TraceCapture: failed to record run (' . $e->getMessage() . ')');
+        }
+    }
+
+
+    // Append the given data to the given file, rotating the file first if it
+    // has grown beyond $maxMb megabytes.
+    private static function append($path, $data, $maxMb)
+    {
+        $handle = @fopen($path, 'ab');
+        if ($handle === false) {
+            throw new \RuntimeException("can't open $path");
+        }
+        try {
+            flock($handle, LOCK_EX);
+            fwrite($handle, $data);
+            fflush($handle);
+            $stat = fstat($handle);
+            clearstatcache(true, $path);
+            $pathStat = @stat($path);
+            if ($stat['size'] > $maxMb * 1024 * 1024 && $pathStat !== false &&
+                    $pathStat['ino'] == $stat['ino'] && $pathStat['dev'] == $stat['dev']) {
+                // Rename while holding the lock. Any other process waiting
+                // for the lock will append its record to the rotated file.
+                // If $path no longer refers to the file we opened, another
+                // process has already rotated it, so the new file is left alone.
+                $suffix = date('Ymd-His') . '-' . getmypid();
+                $rotatedPath = preg_replace('/(\.jsonl)?(\.gz)?$/', "-$suffix$0", $path, 1);
+                rename($path, $rotatedPath);
+            }
+        } finally {
+            flock($handle, LOCK_UN);
+            fclose($handle);
+        }
+    }
+}
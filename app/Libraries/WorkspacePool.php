@@ -0,0 +1,110 @@
+<?php
+
+/* ==============================================================
+ *
+ * This file defines the WorkspacePool class, which manages pools of
+ * ready-made workspace (run) directories, one pool per jobe user, so
+ * that a run doesn't have to make its workspace and set its ACL at the
+ * start and delete it at the end.
+ *
+ * Pooled workspaces are directories WORKSPACE_RUNS_DIR/pool_<NN>_<random>, where
+ * NN is the jobe user number, already with an ACL giving jobe<NN> access.
+ * A run takes one by renaming it to the usual jobe_<random> form. Since a
+ * run holds its jobe user exclusively, there is no contention for a
+ * user's pool. When finished with, a workspace is renamed to
+ * dirty_<random>. The jobe:reaper command (see app/Commands/Reaper.php)
+ * deletes dirty workspaces and tops up the pools. If the reaper isn't
+ * running, the pools empty and runs revert to making their own
+ * workspaces.
+ *
+ * ==============================================================
+ *
+ * @copyright  2026 Richard Lobb, University of Canterbury
+ * @license    http://www.gnu.org/copyleft/gpl.html GNU GPL v3 or later
+ */
+
+namespace Jobe;
+
+define('WORKSPACE_RUNS_DIR', '/home/jobe/runs');
+
+class WorkspacePool
+{
+    /**
+     * @return true iff workspace pools are enabled in the config file.
+     */
+    public static function isEnabled()
+    {
+        return config('Jobe')->workspace_pool_size > 0;
+    }
+
+
+    /**
+     * Take a workspace from the given user's pool.
+     * @param int $userNum the jobe user number.
+     * @return ?string the path of the workspace or null if the pool is empty.
+     */
+    public static function take($userNum)
+    {
+        $prefix = sprintf('pool_%02d_', $userNum);
+        foreach (glob(WORKSPACE_RUNS_DIR . "/$prefix*", GLOB_ONLYDIR) as $pooldir) {
+            $workdir = WORKSPACE_RUNS_DIR . '/jobe_' . substr(basename($pooldir), strlen($prefix));
+            if (@rename($pooldir, $workdir)) {
+                return $workdir;
+            }
+        }
+        return null;
+    }
+
+
+    /**
+     * Hand the given workspace over to the reaper for deletion.
+     * @param string $workdir the workspace directory.
+     * @return true on success, false if the workspace should be deleted
+     * by the caller instead.
+     */
+    public static function discard($workdir)
+    {
+        $dirtyName = 'dirty_' . substr(basename($workdir), strlen('jobe_'));
+        return @rename($workdir, WORKSPACE_RUNS_DIR . "/$dirtyName");
+    }
+
+
+    /**
+     * Delete all dirty workspaces and top up each user's pool to the
+     * configured size. Called by the reaper.
+     * @return int the number of workspaces deleted plus the number made.
+     */
+    public static function reap()
+    {
+        $numChanged = 0;
+        $dirtyDirs = glob(WORKSPACE_RUNS_DIR . '/dirty_*', GLOB_ONLYDIR);
+        if ($dirtyDirs) {
+            exec('sudo rm -R ' . implode(' ', array_map('escapeshellarg', $dirtyDirs)));
+            $numChanged += count($dirtyDirs);
+        }
+
+        $config = config('Jobe');
+        for ($userNum = 0; $userNum < $config->jobe_max_users; $userNum++) {
+            $prefix = sprintf('pool_%02d_', $userNum);
+            $numNeeded = $config->workspace_pool_size - count(glob(WORKSPACE_RUNS_DIR . "/$prefix*", GLOB_ONLYDIR));
+            $newDirs = [];
+            for ($i = 0; $i < $numNeeded; $i++) {
+                $newDir = WORKSPACE_RUNS_DIR . '/.new_' . bin2hex(random_bytes(6));
+                if (@mkdir($newDir)) {
+                    $newDirs[] = $newDir;
+                }
+            }
+            if (!$newDirs) {
+                continue;
+            }
+            $user = sprintf('jobe%02d', $userNum);
+            exec("setfacl -m u:$user:rwX " . implode(' ', array_map('escapeshellarg', $newDirs)));
+            foreach ($newDirs as $newDir) {
+                // Only now, with its ACL set, does the workspace appear in the pool.
+                rename($newDir, WORKSPACE_RUNS_DIR . "/$prefix" . substr(basename($newDir), strlen('.new_')));
+            }
+            $numChanged += count($newDirs);
+        }
+        return $numChanged;
+    }
+}
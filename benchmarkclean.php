@@ -0,0 +1,61 @@
+<?php
+// Micro-benchmark of ResultObject::clean, which sanitises run output that
+// isn't valid UTF-8, comparing it with the original byte-by-byte loop
+// on valid UTF-8, mostly-valid and binary-heavy inputs. Also checks that
+// the two give identical results.
+// For CLI use only, from the Jobe directory: php benchmarkclean.php [size_in_MB]
+
+namespace Jobe;
+
+require __DIR__ . '/app/Libraries/ResultObject.php';
+
+class BenchmarkResultObject extends ResultObject
+{
+    public static function doClean($s)
+    {
+        return self::clean($s);
+    }
+}
+
+// The original implementation of the sanitisation, for comparison.
+function loopClean($s)
+{
+    if (mb_check_encoding($s, 'UTF-8')) {
+        return $s;
+    }
+    $new_s = '';
+    $n = strlen($s);
+    for ($i = 0; $i < $n; $i++) {
+        $c = $s[$i];
+        if (($c != "\n" && $c != "\r" && $c != "\t" && $c < " ") || $c > "\x7E") {
+            $c = '\\x' . sprintf("%02x", ord($c));
+        }
+        $new_s .= $c;
+    }
+    return $new_s;
+}
+
+// Return the time in msecs taken by $func($s), and its result.
+function timeIt($func, $s)
+{
+    $start = hrtime(true);
+    $result = $func($s);
+    return [(hrtime(true) - $start) / 1e6, $result];
+}
+
+$size = intval(1024 * 1024 * floatval($argv[1] ?? 2));
+$text = "Hello wörld, ça va? 1 + 1 = 2\ttab\r\n";
+$valid = substr(str_repeat($text, intdiv($size, strlen($text)) + 1), 0, $size);
+$valid = mb_strcut($valid, 0, $size, 'UTF-8');  // Don't end mid-character
+$mostlyValid = $valid;
+for ($i = 999; $i < $size; $i += 1000) {
+    $mostlyValid[$i] = "\xFF";
+}
+$binary = random_bytes($size);
+
+printf("%-14s %12s %12s %10s\n", 'Input', 'loop (ms)', 'clean (ms)', 'Same?');
+foreach (['valid' => $valid, 'mostly valid' => $mostlyValid, 'binary' => $binary] as $name => $input) {
+    [$loopTime, $loopResult] = timeIt('Jobe\loopClean', $input);
+    [$cleanTime, $cleanResult] = timeIt([BenchmarkResultObject::class, 'doClean'], $input);
+    printf("%-14s %12.1f %12.1f %10s\n", $name, $loopTime, $cleanTime, $loopResult === $cleanResult ? 'yes' : 'NO');
+}
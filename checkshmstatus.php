@@ -1,20 +1,40 @@
 <?php
-// Scripts to report status of the Shared Memory variable that
-// controls access to Jobe tasks.
+// Scripts to report status of the Shared Memory segment that
+// controls access to Jobe tasks, i.e. which Jobe users are active and
+// which processes are waiting for a free user.
 // For CLI use only. 
-// You may need to change the value of $key if your Jobe installation
+// You may need to change the value of $keyFile if your Jobe installation
 // is in a different directory.
+// The layout must agree with the SHM_ constants in app/Libraries/LanguageTask.php.
+$keyFile = '/var/www/html/jobe/public/index.php';
+$NUM_USERS = 8; // Adjust as required.
+$MAX_USERS = 256;
+$MAX_WAITERS = 1024;
+$USERS_OFFSET = 16;
+$WAITERS_OFFSET = $USERS_OFFSET + $MAX_USERS;
 try {
-	$key = ftok('/var/www/html/jobe/public/index.php', 'j');
+	$key = ftok($keyFile, 'j');
 	$sem = sem_get($key);
 	$gotIt = sem_acquire($sem);
 	$semisfalse = $sem === false;
 	echo("semisfalse = $semisfalse, key = $key, gotIt = $gotIt\n");
-	$shm = shm_attach($key, 10000, 0600);
-	$active = shm_get_var($shm, 1);
-	print_r($active);
+	$shm = shmop_open(ftok($keyFile, 'k'), 'a', 0, 0);
+	if ($shm === false || shmop_read($shm, 0, 4) !== 'JOBE') {
+		echo("Shared memory not yet initialised (no jobs run since boot?)\n");
+	} else {
+		$active = shmop_read($shm, $USERS_OFFSET, $NUM_USERS);
+		for ($i = 0; $i < $NUM_USERS; $i++) {
+			printf("jobe%02d: %s\n", $i, ord($active[$i]) ? 'active' : 'free');
+		}
+		$head = unpack('V', shmop_read($shm, 4, 4))[1];
+		$numWaiters = unpack('V', shmop_read($shm, 8, 4))[1];
+		echo("Waiting processes (oldest first, 0 = given up):\n");
+		for ($i = $head; $i < $head + $numWaiters; $i++) {
+			$offset = $WAITERS_OFFSET + 4 * ($i % $MAX_WAITERS);
+			echo("    " . unpack('V', shmop_read($shm, $offset, 4))[1] . "\n");
+		}
+	}
 } catch (Exception $e) {
     echo("Exception: $e\n");
 }
-shm_detach($shm);
 sem_release($sem);
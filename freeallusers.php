@@ -1,26 +1,28 @@
 <?php
-// Program to reset the Memory variable that
+// Program to reset the shared memory segment that
 // controls access to Jobe tasks, essentially
-// freeing all users. For CLI use only and
+// freeing all users and emptying the list of processes waiting
+// for a user (any such processes will just time out). For CLI use only and
 // then only in emergencies!
-$NUM_USERS = 8; // Adjust as required.
-$ACTIVE_USERS = 1;  // ID for active-users variable.
+// The layout must agree with the SHM_ constants in app/Libraries/LanguageTask.php.
+$keyFile = '/var/www/html/jobe/public/index.php';
+$MAX_USERS = 256;
+$USERS_OFFSET = 16;
 try {
-	$key = ftok('/var/www/html/jobe/public/index.php', 'j');
+	$key = ftok($keyFile, 'j');
 	$sem = sem_get($key);
 	$gotIt = sem_acquire($sem);
 	$semisfalse = $sem === false;
 	echo("semisfalse = $semisfalse, key = $key, gotIt = $gotIt\n");
-	$shm = shm_attach($key, 10000, 0600);
-	$active = shm_get_var($shm, $ACTIVE_USERS);
-	print_r($active);
-	for ($i=0; $i < $NUM_USERS; $i++) {
-	   $active[$i] = 0;
+	$shm = shmop_open(ftok($keyFile, 'k'), 'w', 0, 0);
+	if ($shm === false) {
+		echo("Shared memory not yet initialised (no jobs run since boot?)\n");
+	} else {
+		// Zero the waiters ring buffer head and count, and the active flags.
+		shmop_write($shm, str_repeat("\0", $USERS_OFFSET + $MAX_USERS - 4), 4);
+		echo("All users freed\n");
 	}
-	shm_put_var($shm, $ACTIVE_USERS, $active);
 } catch (Exception $e) {
     echo("Exception: $e\n");
 }
-shm_detach($shm);
 sem_release($sem);
-
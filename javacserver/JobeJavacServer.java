@@ -0,0 +1,196 @@
+/* ==============================================================
+ *
+ * A Java compile server for Jobe. Keeps a warm JVM running javac via the
+ * javax.tools API, so that JavaTask::compile doesn't pay for starting a JVM
+ * and a cold javac on every submission. Requires Java 16 or later (for
+ * Unix domain sockets).
+ *
+ * Run it as the unprivileged user jobejavac, made by the installer, with
+ * resource limits, e.g. by the systemd service given in README.md, which runs
+ *     java -Xmx1g -cp /var/www/html/jobe/javacserver JobeJavacServer /home/jobe/javac/javac.sock
+ * and set $javac_server_socket in app/Config/Jobe.php to the same path.
+ * Jobe gives the jobejavac user access to each workspace only while it's
+ * being compiled.
+ *
+ * Protocol: the client sends the run's workspace directory, the source
+ * file name, the compile time limit (secs) and any extra javac options, one
+ * per line, followed by an empty line. The server compiles the file into the
+ * workspace and responds with a line containing 0 (success) or 1 (failure)
+ * followed by javac's output, exactly as the javac command would have printed
+ * it when run in the workspace, then closes the connection. If the request is
+ * invalid or the server is too busy to start the compile within the time
+ * limit, the response is a line starting with ERROR, nothing has been written
+ * to the workspace, and the client should compile by running javac in the
+ * usual way. If the compile itself exceeds the time limit, the response is
+ * the line TIMEOUT and the server exits, as javac ignores interrupts and
+ * exiting is the only sure way to stop it writing to the workspace. It
+ * should then be restarted (systemd's Restart=always). The connection is
+ * never closed while a compile into the workspace is still running.
+ *
+ * Annotation processing is disabled (-proc:none) and options that would load
+ * or run other code are refused, so compiling never executes submitted code.
+ *
+ * ==============================================================
+ *
+ * @copyright  2026 Richard Lobb, University of Canterbury
+ * @license    http://www.gnu.org/copyleft/gpl.html GNU GPL v3 or later
+ */
+
+import java.io.BufferedReader;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.io.OutputStreamWriter;
+import java.io.StringWriter;
+import java.io.Writer;
+import java.net.StandardProtocolFamily;
+import java.net.UnixDomainSocketAddress;
+import java.nio.channels.Channels;
+import java.nio.channels.ServerSocketChannel;
+import java.nio.channels.SocketChannel;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.nio.file.attribute.PosixFilePermissions;
+import java.util.ArrayList;
+import java.util.List;
+import java.util.Set;
+import java.util.concurrent.ExecutionException;
+import java.util.concurrent.ExecutorService;
+import java.util.concurrent.Executors;
+import java.util.concurrent.Future;
+import java.util.concurrent.TimeUnit;
+import java.util.concurrent.TimeoutException;
+import javax.tools.JavaCompiler;
+import javax.tools.JavaFileObject;
+import javax.tools.StandardJavaFileManager;
+import javax.tools.ToolProvider;
+
+public class JobeJavacServer {
+    static final Path RUNS_DIR = Path.of("/home/jobe/runs");
+    // Options that set output or search paths, or load code into the compiler.
+    static final Set<String> FORBIDDEN_OPTIONS = Set.of(
+        "-d", "-s", "-h", "-cp", "-classpath", "--class-path", "-sourcepath", "--source-path",
+        "-p", "--module-path", "--module-source-path", "--upgrade-module-path", "--system",
+        "-processor", "-processorpath", "--processor-path", "--processor-module-path"
+    );
+    static final String[] FORBIDDEN_OPTION_PREFIXES = {"-J", "-Xplugin", "--plugin", "-proc:", "@"};
+    static final int MAX_TIME_LIMIT = 600;  // Secs
+    static final JavaCompiler COMPILER = ToolProvider.getSystemJavaCompiler();
+    // Compiles run here, at most one per processor. Connections are handled
+    // by threads of their own, so a request waiting for a free processor is
+    // still subject to its time limit.
+    static final ExecutorService COMPILES = Executors.newFixedThreadPool(
+            Runtime.getRuntime().availableProcessors());
+
+    public static void main(String[] args) throws IOException {
+        if (args.length != 1) {
+            System.err.println("Usage: java JobeJavacServer SOCKET_PATH");
+            System.exit(1);
+        }
+        if (COMPILER == null) {
+            System.err.println("No Java compiler available. Is this a JDK?");
+            System.exit(1);
+        }
+        Path socketPath = Path.of(args[0]);
+        Files.deleteIfExists(socketPath);
+        ServerSocketChannel server = ServerSocketChannel.open(StandardProtocolFamily.UNIX);
+        server.bind(UnixDomainSocketAddress.of(socketPath));
+        // The socket's directory is setgid, with the web server's group.
+        Files.setPosixFilePermissions(socketPath, PosixFilePermissions.fromString("rw-rw----"));
+
+        ExecutorService handlers = Executors.newCachedThreadPool();
+        while (true) {
+            SocketChannel client = server.accept();
+            handlers.submit(() -> handle(client));
+        }
+    }
+
+    // Read one compile request from the given client, do the compile
+    // and send the response.
+    static void handle(SocketChannel client) {
+        try (client;
+             BufferedReader in = new BufferedReader(new InputStreamReader(
+                     Channels.newInputStream(client), StandardCharsets.UTF_8));
+             Writer out = new OutputStreamWriter(Channels.newOutputStream(client), StandardCharsets.UTF_8)) {
+            String workdir = in.readLine();
+            String sourceFileName = in.readLine();
+            String timeLimit = in.readLine();
+            List<String> options = new ArrayList<>();
+            String line;
+            while ((line = in.readLine()) != null && !line.isEmpty()) {
+                options.add(line);
+            }
+            String error = checkRequest(workdir, sourceFileName, timeLimit, options);
+            if (error != null) {
+                out.write("ERROR " + error + "\n");
+                return;
+            }
+            Future<String> result = COMPILES.submit(() -> compile(Path.of(workdir), sourceFileName, options));
+            try {
+                out.write(result.get(Integer.parseInt(timeLimit), TimeUnit.SECONDS));
+            } catch (ExecutionException e) {
+                out.write("ERROR " + e.getCause() + "\n");
+            } catch (TimeoutException e) {
+                if (result.cancel(false)) {
+                    out.write("ERROR server busy\n");  // The compile never started
+                } else if (result.isDone()) {
+                    out.write(result.get());
+                } else {
+                    out.write("TIMEOUT\n");
+                    out.flush();
+                    System.err.println("JobeJavacServer: compile in " + workdir + " timed out, exiting");
+                    Runtime.getRuntime().halt(2);
+                }
+            }
+        } catch (Exception e) {
+            System.err.println("JobeJavacServer: " + e);
+        }
+    }
+
+    // Return an error message if the request is invalid, otherwise null.
+    static String checkRequest(String workdir, String sourceFileName, String timeLimit, List<String> options) {
+        if (workdir == null || sourceFileName == null || timeLimit == null) {
+            return "incomplete request";
+        }
+        if (!timeLimit.matches("[1-9][0-9]{0,2}") || Integer.parseInt(timeLimit) > MAX_TIME_LIMIT) {
+            return "invalid time limit";
+        }
+        Path dir = Path.of(workdir).normalize();
+        if (!dir.isAbsolute() || !RUNS_DIR.equals(dir.getParent()) || !Files.isDirectory(dir)) {
+            return "invalid workspace directory";
+        }
+        if (!sourceFileName.endsWith(".java") || sourceFileName.contains("/")) {
+            return "invalid source file name";
+        }
+        for (String option : options) {
+            boolean forbidden = FORBIDDEN_OPTIONS.contains(option.split("=", 2)[0]);
+            for (String prefix : FORBIDDEN_OPTION_PREFIXES) {
+                forbidden = forbidden || option.startsWith(prefix);
+            }
+            if (forbidden) {
+                return "option " + option + " not allowed";
+            }
+        }
+        return null;
+    }
+
+    // Compile the given source file in the given workspace and return the
+    // response: the status line plus the compiler output, with the workspace
+    // path removed from file names in diagnostics, as javac run within
+    // the workspace wouldn't print it.
+    static String compile(Path dir, String sourceFileName, List<String> extraOptions) throws IOException {
+        List<String> options = new ArrayList<>(List.of(
+                "-proc:none", "-d", dir.toString(), "-cp", dir.toString()));
+        options.addAll(extraOptions);
+        StringWriter output = new StringWriter();
+        boolean ok;
+        try (StandardJavaFileManager fileManager = COMPILER.getStandardFileManager(
+                null, null, StandardCharsets.UTF_8)) {
+            Iterable<? extends JavaFileObject> units = fileManager.getJavaFileObjects(dir.resolve(sourceFileName));
+            ok = COMPILER.getTask(output, fileManager, null, options, null, units).call();
+        } catch (IllegalArgumentException e) {
+            return "ERROR " + e.getMessage() + "\n";
+        }
+        return (ok ? "0\n" : "1\n") + output.toString().replace(dir + "/", "");
+    }
+}
@@ -0,0 +1,379 @@
+#! /usr/bin/env python3
+# coding=utf-8
+''' An asyncio-based Jobe client, shared by testsubmit.py and loadtester.py.
+
+    A single JobeClient object keeps a pool of keep-alive HTTP/1.1
+    connections to the Jobe server and limits the number of requests in
+    flight at once, so one client process can drive thousands of concurrent
+    runs without needing a thread (or a new TCP connection) per job.
+    Only the standard library is used.
+
+    do_http and run_test have the same semantics as the synchronous
+    functions of the same name in testsubmit.py and loadtester.py, e.g.
+
+        async def main():
+            client = JobeClient('localhost', 80)
+            status, result = await client.run_test(test)
+            await client.close()
+
+        asyncio.run(main())
+'''
+
+import asyncio
+import contextvars
+import json
+import ssl
+import uuid
+from base64 import b64encode
+from time import perf_counter
+
+RESOURCE_BASE = '/jobe/index.php/restapi'
+RUNS_RESOURCE = RESOURCE_BASE + '/runs/'
+FILES_RESOURCE = RESOURCE_BASE + '/files/'
+BULK_FILES_RESOURCE = RESOURCE_BASE + '/files'
+MISSING_FILES_RESOURCE = RESOURCE_BASE + '/files/missing'
+
+GOOD_TEST = 0
+FAIL_TEST = 1
+EXCEPTION = 2
+
+# The default maximum number of requests in flight (hence also connections).
+# Keep this below the client's open-file limit (ulimit -n).
+DEFAULT_MAX_CONNECTIONS = 500
+
+
+# The perf_counter() time at which the current asyncio task first got a
+# connection slot since the task last set this to None, so that callers can
+# separate client-side queueing for a slot from the time the server takes.
+slot_acquired_time = contextvars.ContextVar('slot_acquired_time', default=None)
+
+
+class HttpError(Exception):
+    '''Raised when an HTTP response can't be read or parsed'''
+
+
+class Connection:
+    '''A single keep-alive HTTP/1.1 connection to the Jobe server (or proxy)'''
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    def is_usable(self):
+        '''True unless the server has closed the connection'''
+        return not self.reader.at_eof() and not self.writer.is_closing()
+
+    async def request(self, method, target, host, body, headers):
+        '''Send the request and return a tuple (status, reason, body, keep_alive)
+           where body is a bytes object and keep_alive is true if the
+           connection can be reused.'''
+        lines = [f"{method} {target} HTTP/1.1", f"Host: {host}"]
+        for key, value in headers.items():
+            lines.append(f"{key}: {value}")
+        lines.append(f"Content-Length: {len(body)}")
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionResetError('Connection closed by server')
+        try:
+            version, status, reason = (status_line.decode('latin-1').rstrip('\r\n').split(' ', 2) + [''])[:3]
+            status = int(status)
+        except ValueError:
+            raise HttpError(f"Bad HTTP status line {status_line!r}")
+
+        response_headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            response_headers[key.strip().lower()] = value.strip()
+
+        connection_hdr = response_headers.get('connection', '').lower()
+        keep_alive = connection_hdr != 'close' and (version != 'HTTP/1.0' or connection_hdr == 'keep-alive')
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            body = b''
+        elif response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = await self.read_chunked()
+        elif 'content-length' in response_headers:
+            body = await self.reader.readexactly(int(response_headers['content-length']))
+        else:
+            body = await self.reader.read()  # Until the server closes the connection
+            keep_alive = False
+        return status, reason, body, keep_alive
+
+    async def read_chunked(self):
+        '''Read and return a body sent with chunked transfer encoding'''
+        chunks = []
+        while True:
+            size_line = await self.reader.readline()
+            size = int(size_line.split(b';')[0].strip() or b'0', 16)
+            if size == 0:
+                while (await self.reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass  # Skip any trailers
+                return b''.join(chunks)
+            chunks.append(await self.reader.readexactly(size))
+            await self.reader.readline()  # The CRLF after the chunk
+
+    def close(self):
+        self.writer.close()
+
+
+class JobeClient:
+    '''A Jobe client with a pool of keep-alive connections and a limit on the
+       number of concurrent requests. Must be used from within a single
+       asyncio event loop.'''
+
+    def __init__(self, host='localhost', port=80, use_ssl=False, proxy='',
+                 api_key=None, max_connections=DEFAULT_MAX_CONNECTIONS,
+                 verbose=False, debugging=False, bulk_files=False):
+        '''host, port: the Jobe server.
+           use_ssl: true to use https.
+           proxy: an optional HTTP proxy, as 'host:port'.
+           api_key: if given, the value of the X-API-KEY header sent with
+           every request.
+           max_connections: the maximum number of requests in flight at once.
+           Further requests wait for a free connection.
+           verbose: print details of HTTP errors.
+           debugging: set the debug flag in all run_specs, so that runs are
+           saved on the Jobe server.
+           bulk_files: put and check each test's files with the bulk
+           endpoints (POST /files and POST /files/missing), which older
+           servers lack, instead of a PUT and HEAD per file.
+        '''
+        self.host = host
+        self.port = int(port)
+        self.use_ssl = use_ssl
+        self.proxy = proxy
+        self.api_key = api_key
+        self.verbose = verbose
+        self.debugging = debugging
+        self.bulk_files = bulk_files
+        self.idle = []  # Idle connections, most recently used last
+        self.slots = asyncio.Semaphore(max_connections)
+        self.num_connects = 0  # Number of TCP connections opened
+
+    async def open_connection(self):
+        '''Open and return a new Connection to the server or proxy'''
+        if self.proxy:
+            proxy_host, proxy_port = self.proxy.split(':')
+            reader, writer = await asyncio.open_connection(proxy_host, int(proxy_port))
+        else:
+            ssl_context = ssl.create_default_context() if self.use_ssl else None
+            reader, writer = await asyncio.open_connection(self.host, self.port, ssl=ssl_context)
+        self.num_connects += 1
+        return Connection(reader, writer)
+
+    async def request(self, method, resource, body=b'', headers=None):
+        '''Send the given request to the server. Return a triple
+           (status, reason, body) where body is a bytes object.
+           A request on a reused keep-alive connection that the server has
+           since closed is retried once on a new connection.
+           Raises OSError or HttpError if the request fails.'''
+        headers = dict(headers or {})
+        if self.api_key:
+            headers['X-API-KEY'] = self.api_key
+        if isinstance(body, str):
+            body = body.encode('utf8')
+        body = body or b''
+        if self.proxy:
+            # Proxy connections are always HTTP regardless of target SSL
+            protocol = 'https' if self.use_ssl else 'http'
+            target = f"{protocol}://{self.host}:{self.port}{resource}"
+        else:
+            target = resource
+        host = f"{self.host}:{self.port}"
+
+        async with self.slots:
+            if slot_acquired_time.get() is None:
+                slot_acquired_time.set(perf_counter())
+            for attempt in range(2):
+                reused = bool(self.idle)
+                connection = self.idle.pop() if reused else await self.open_connection()
+                if reused and not connection.is_usable():
+                    connection.close()
+                    connection = await self.open_connection()
+                    reused = False
+                try:
+                    status, reason, response_body, keep_alive = await connection.request(
+                        method, target, host, body, headers)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    connection.close()
+                    if reused and attempt == 0:
+                        continue  # Stale keep-alive connection. Retry.
+                    raise
+                except BaseException:
+                    connection.close()
+                    raise
+                if keep_alive:
+                    self.idle.append(connection)
+                else:
+                    connection.close()
+                return status, reason, response_body
+
+    async def do_http(self, method, resource, data=None):
+        """Send the given HTTP request to Jobe, return a pair (ok result) where
+           ok is true if no exception was thrown, false otherwise and
+           result is a dictionary of the JSON decoded response (or an empty
+           dictionary in the case of a 204 response.
+           As a special-case hack for testing 400 error conditions, if the
+           decoded JSON response is a string (which should only occur when an
+           error has occurred), the returned result string is prefixed by the
+           response code.
+        """
+        result = {}
+        ok = True
+        headers = {"Content-type": "application/json; charset=utf-8",
+                   "Accept": "application/json"}
+        try:
+            status, reason, content = await self.request(method, resource, data, headers)
+            if status != 204:
+                content = content.decode('utf8')
+                if content:
+                    result = json.loads(content)
+            if isinstance(result, str):
+                result = str(status) + ': ' + result
+
+        except (OSError, HttpError, asyncio.IncompleteReadError, ValueError) as e:
+            result = str(e)
+            if self.verbose:
+                print("\n***************** HTTP ERROR ******************\n")
+                print(e)
+            ok = False
+        return (ok, result)
+
+    async def check_file(self, file_id):
+        '''Checks if the given fileid exists on the server.
+           Returns status: 204 denotes file exists, 404 denotes file not found,
+           -1 denotes an exception.
+        '''
+        try:
+            status, reason, content = await self.request(
+                'HEAD', FILES_RESOURCE + file_id, b'', {"Accept": "text/plain"})
+        except (OSError, HttpError, asyncio.IncompleteReadError):
+            return -1
+        return status
+
+    async def put_file(self, file_desc):
+        '''Put the given (file_id, contents) to the server. Return the HTTP status.
+           Raises an exception if the request fails.
+        '''
+        file_id, contents = file_desc
+        contentsb64 = b64encode(contents.encode('utf8')).decode(encoding='UTF-8')
+        data = json.dumps({'file_contents': contentsb64})
+        headers = {"Content-type": "application/json",
+                   "Accept": "text/plain"}
+        status, reason, content = await self.request('PUT', FILES_RESOURCE + file_id, data, headers)
+        if self.verbose and status != 204:
+            print(f"Response to putting {file_id}: {status} {reason} {content[:4096]}")
+        return status
+
+    async def check_files(self, file_ids):
+        '''Checks which of the given fileids exist on the server, with a
+           single request. Returns the list of those that are missing, or
+           None if the request fails.
+        '''
+        ok, result = await self.do_http('POST', MISSING_FILES_RESOURCE,
+                                        json.dumps({'file_ids': list(file_ids)}))
+        if not ok or not isinstance(result, dict):
+            return None
+        return result.get('missing')
+
+    async def put_files(self, file_descs):
+        '''Put all the given (file_id, contents) pairs to the server with a
+           single multipart/form-data request. Return the HTTP status.
+           Raises an exception if the request fails.
+        '''
+        data, content_type = multipart_body(file_descs)
+        headers = {"Content-type": content_type,
+                   "Accept": "text/plain"}
+        status, reason, content = await self.request('POST', BULK_FILES_RESOURCE, data, headers)
+        if self.verbose and status != 204:
+            print(f"Response to putting {len(file_descs)} files: {status} {reason} {content[:4096]}")
+        return status
+
+    async def run_test(self, test):
+        '''Execute the given test, checking the output. Any files listed in the
+           test's 'files' attribute are first put to the server.
+           Return a pair (status, result) where status is GOOD_TEST, FAIL_TEST
+           or EXCEPTION and result is the value returned by do_http (or
+           an error message if a file upload failed).
+        '''
+        file_descs = test.get('files', [])
+        if file_descs and self.bulk_files:
+            await self.put_files(file_descs)
+            missing = await self.check_files(file_id for file_id, contents in file_descs)
+            if missing != []:
+                return EXCEPTION, f"Put files/check files failed (missing: {missing}). File not found."
+        else:
+            for file_desc in file_descs:
+                await self.put_file(file_desc)
+                response_code = await self.check_file(file_desc[0])
+                if response_code != 204:
+                    return EXCEPTION, f"Put file/check file failed ({response_code}). File not found."
+
+        data = json.dumps({'run_spec': runspec_from_test(test, self.debugging)})
+        ok, result = await self.do_http('POST', RUNS_RESOURCE, data)
+        if not ok:
+            return EXCEPTION, result
+        elif is_correct_result(test['expect'], result):
+            return GOOD_TEST, result
+        else:
+            return FAIL_TEST, result
+
+    async def close(self):
+        '''Close all idle connections'''
+        while self.idle:
+            self.idle.pop().close()
+
+
+def multipart_body(file_descs):
+    '''Return a pair (body, content_type) for a multipart/form-data request
+       with one file part per (file_id, contents) pair, named by its file_id.
+    '''
+    boundary = uuid.uuid4().hex
+    parts = []
+    for file_id, contents in file_descs:
+        if isinstance(contents, str):
+            contents = contents.encode('utf8')
+        header = (f"--{boundary}\r\n"
+                  f'Content-Disposition: form-data; name="{file_id}"; filename="{file_id}"\r\n'
+                  "Content-Type: application/octet-stream\r\n\r\n")
+        parts.append(header.encode('latin-1') + contents + b'\r\n')
+    parts.append(f"--{boundary}--\r\n".encode('latin-1'))
+    return b''.join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def runspec_from_test(test, debugging=False):
+    """Return a runspec corresponding to the given test"""
+    runspec = {}
+    for key in test:
+        if key not in ['comment', 'expect', 'files']:
+            runspec[key] = test[key]
+    if debugging:
+        runspec['debug'] = True
+    return runspec
+
+
+def is_correct_result(expected, got):
+    '''If got is a dictionary (the usual case), return true iff every key
+       in the expected outcome exists in the
+       actual outcome and the associated values are equal, too.
+       However, if got is a string, the run must have failed (i.e.
+       not a 200 return code). In that case, expected should have a
+       'response' key which should match the first token in the got
+       string. The rest of the got string should match the expected
+       stdout.)
+    '''
+    if isinstance(got, str):
+        if 'response' not in expected:
+            return False
+        return (got.startswith(str(expected['response']) + ':') and
+                got[4:].strip() == expected['stdout'].strip())
+    else:
+        for key in expected:
+            if key not in got or expected[key] != got[key]:
+                return False
+        return True
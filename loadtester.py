@@ -10,17 +10,44 @@
     
     Richard Lobb
     12/12/2020
+
+    Added an open-loop mode, e.g. 'python3 loadtester.py --rate 20 [c]'.
+    Jobs are then submitted on a fixed schedule at the given mean rate
+    (jobs/sec), with Poisson or constant arrivals, for --duration seconds,
+    regardless of whether earlier jobs have completed. Latencies are measured
+    from each job's scheduled start time, so they include any queueing delay,
+    as seen by students at the start of an exam.
+
+    Added a trace-replay mode, e.g.
+    'python3 loadtester.py --replay trace.jsonl.gz --speed 2 [python3]'.
+    A trace is a JSONL file (optionally gzipped) with one record per run,
+    in order of arrival, of the form
+        {"time": <arrival time in secs>, "run_spec": {<a Jobe run_spec>}}
+    Other fields are ignored. The run_specs are submitted with the same
+    relative timing as in the trace, scaled by --speed (default 1), or as
+    fast as the --connections limit allows with '--speed max'. With a
+    speed, runs that arrive when --connections runs are already in flight
+    are dropped (and counted) so that later runs stay on schedule. Any files in
+    a run_spec's file_list must already be on the server; runs that
+    reference missing files are reported with outcome 404.
+    Traces captured by a Jobe server (see trace_capture_file in
+    app/Config/Jobe.php) normally omit the source code. Such runs are
+    replayed with the TEST_SET program for their language (if any) in
+    place of the original program.
+    For information type 'python3 loadtester.py --help'
 '''
 
-from urllib.request import urlopen
-from urllib.parse import urlencode
-from urllib.error import HTTPError
-import json
 import sys
-import http.client
-from threading import Thread, Lock
-from time import perf_counter, sleep
-import copy
+import argparse
+import asyncio
+import random
+import math
+import json
+import gzip
+from collections import Counter
+from time import perf_counter
+from jobeclient import (JobeClient, DEFAULT_MAX_CONNECTIONS, RUNS_RESOURCE, runspec_from_test,
+                        slot_acquired_time)
 
 
 # Get more output 
@@ -33,7 +60,6 @@ API_KEY = '2AAA7A5415B4A9B394B54BF1D2E9D'  # A working (100/hr) key on Jobe2
 
 USE_API_KEY = True
 JOBE_SERVER = 'localhost'
-RUNS_RESOURCE = '/jobe/index.php/restapi/runs/'
 
 #JOBE_SERVER = 'csse-jobe5.canterbury.ac.nz'
 
@@ -41,6 +67,9 @@ GOOD_TEST = 0
 FAIL_TEST = 1
 EXCEPTION = 2
 
+# The latency percentiles reported in open-loop mode
+PERCENTILES = [50, 90, 99, 99.9]
+
 
 # ===============================================
 #
@@ -95,149 +124,216 @@ int main() {
 successes = 0
 fails = 0
 
-def check_parallel_submissions(job, num_parallel_submits):
+def make_client(max_connections):
+    '''Return a JobeClient for the configured Jobe server'''
+    host, _, port = JOBE_SERVER.partition(':')
+    api_key = API_KEY if USE_API_KEY else None
+    return JobeClient(host, port or 80, api_key=api_key, max_connections=max_connections,
+                      verbose=DEBUGGING, debugging=DEBUGGING)
+
+
+async def run_job(client, job):
+    '''Run the given job, updating the global success and fail counts'''
+    global successes, fails
+    status, result = await client.run_test(job)
+    if status == GOOD_TEST:
+        successes += 1
+    else:
+        fails += 1
+        print(string_result(result))
+    return status
+
+
+async def check_parallel_submissions(client, job, num_parallel_submits):
     '''Check that we can submit several jobs at once to Jobe with
        the process limit set to 1 and still have no conflicts.
     '''
-    threads = []
-
-    lock = Lock()
     t0 = perf_counter()
-    for child_num in range(num_parallel_submits):
-        if DEBUGGING:
-            print("Doing child", child_num)
-        def run_job():
-            global successes, fails
-            this_job = copy.deepcopy(job)
-            this_job['comment'] += '. Child' + str(child_num)
-            status, result = run_test(job)
-            lock.acquire()
-            if status == GOOD_TEST:
-                successes += 1
-            else:
-                fails += 1
-                print(result)
-            lock.release()
-
-        t = Thread(target=run_job)
-        threads.append(t)
-        t.start()
-
-    for t in threads:
-        t.join()
+    await asyncio.gather(*[run_job(client, job) for child_num in range(num_parallel_submits)])
     t1 = perf_counter()
     print(f"{num_parallel_submits} done in {t1 - t0:.2f} secs, {successes} successes, {fails} fails")
 
 
+def arrival_times(rate, duration, arrivals):
+    '''Return a list of the scheduled start times (secs, relative to the start
+       of the run) of all jobs in an open-loop run at the given mean rate
+       (jobs/sec) over the given duration (secs). arrivals is either
+       'constant' (evenly spaced jobs) or 'poisson' (exponentially distributed
+       gaps, as from a large population of independent users).
+    '''
+    times = []
+    t = 0.0
+    while True:
+        if arrivals == 'poisson':
+            t += random.expovariate(rate)
+        else:
+            t += 1 / rate
+        if t >= duration:
+            return times
+        times.append(t)
+
+
+def percentile(sorted_values, pc):
+    '''Return the pc-th percentile of the given non-empty sorted list,
+       using the nearest-rank method.'''
+    rank = max(1, math.ceil(pc / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+async def check_open_loop(client, job, rate, duration, arrivals):
+    '''Submit the given job to Jobe at the given mean rate (jobs/sec) for the
+       given duration (secs) without waiting for earlier jobs to complete,
+       i.e. an open-loop load. For each job, record its scheduled start time,
+       the time it was submitted to the client, the time the client got a
+       connection slot for it (i.e. actually sent it) and the time the
+       response was received, then report the latencies measured from the
+       scheduled times.
+    '''
+    schedule = arrival_times(rate, duration, arrivals)
+    records = [None] * len(schedule)  # (scheduled, submitted, started, finished, status)
+
+    async def timed_job(job_num, scheduled):
+        submitted = perf_counter() - t0
+        slot_acquired_time.set(None)
+        status = await run_job(client, job)
+        finished = perf_counter() - t0
+        started = (slot_acquired_time.get() or t0 + finished) - t0
+        records[job_num] = (scheduled, submitted, started, finished, status)
+
+    tasks = []
+    t0 = perf_counter()
+    for job_num, scheduled in enumerate(schedule):
+        delay = scheduled - (perf_counter() - t0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(timed_job(job_num, scheduled)))
 
-def is_correct_result(expected, got):
-    '''True iff every key in the expected outcome exists in the
-       actual outcome and the associated values are equal, too'''
-    for key in expected:
-        if key not in got or expected[key] != got[key]:
-            return False
-    return True
-
-# =============================================================
-
-def http_request(method, resource, data, headers):
-    '''Send a request to Jobe with given HTTP method to given resource on
-       the currently configured Jobe server and given data and headers.
-       Return the connection object. '''
-    if USE_API_KEY:
-            headers["X-API-KEY"] = API_KEY
-    connect = http.client.HTTPConnection(JOBE_SERVER)
-    connect.request(method, resource, data, headers)
-    return connect
-
-
-
-def runspec_from_test(test):
-    """Return a runspec corresponding to the given test"""
-    runspec = {}
-    for key in test:
-        if key not in ['comment', 'expect', 'files']:
-            runspec[key] = test[key]
-    if DEBUGGING:
-        runspec['debug'] = True
-    return runspec
-
-
-def run_test(test):
-    '''Execute the given test, checking the output'''
-
-    runspec = runspec_from_test(test)
-    # First put any files to the server
-    for file_desc in test.get('files', []):
-        put_file(file_desc)
-        response_code = check_file(file_desc[0])
-        if response_code != 204:
-            error_message = f"******** Put file/check file failed ({response_code}). File not found.****"
+    await asyncio.gather(*tasks)
+    t1 = perf_counter()
+    print(f"{len(schedule)} jobs scheduled at {rate} jobs/sec over {duration} secs "
+          f"done in {t1 - t0:.2f} secs, {successes} successes, {fails} fails")
+    report_latencies(records)
+
+
+def report_latencies(records, indent=''):
+    '''Print the client send lag, the client queueing time (waiting for a
+       connection slot) and the latency percentiles for the given list of
+       (scheduled, submitted, started, finished, status) job records.'''
+    if not records:
+        return
+    send_lags = sorted(submitted - scheduled for scheduled, submitted, _, _, _ in records)
+    queueing = sorted(started - submitted for _, submitted, started, _, _ in records)
+    latencies = sorted(finished - scheduled for scheduled, _, _, finished, _ in records)
+    print(f"{indent}Client send lag (secs): p50 {percentile(send_lags, 50):.3f}, max {send_lags[-1]:.3f}")
+    print(f"{indent}Client queueing for a connection (secs): p50 {percentile(queueing, 50):.3f}, "
+          f"max {queueing[-1]:.3f}")
+    summary = ', '.join(f"p{pc:g} {percentile(latencies, pc):.3f}" for pc in PERCENTILES)
+    print(f"{indent}Latency from scheduled start (secs): {summary}, max {latencies[-1]:.3f}")
+
+
+def read_trace(filename):
+    '''Generate the (time, run_spec) pairs from the records of the given
+       JSONL trace file, which is gunzipped if its name ends in .gz.
+       Bad records are reported and skipped.'''
+    opener = gzip.open if filename.endswith('.gz') else open
+    with opener(filename, 'rt', encoding='utf8') as trace:
+        for line_num, line in enumerate(trace, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                yield float(record['time']), dict(record['run_spec'])
+            except (ValueError, KeyError, TypeError) as e:
+                print(f"Skipping bad record at line {line_num} of {filename}: {e!r}")
+
+
+def substitute_program(run_spec):
+    '''Return a copy of the given run_spec, which has no sourcecode, with
+       the program, sourcefilename and parameters of the first TEST_SET job
+       in the same language substituted. Other parameters and the file_list
+       are retained. Return None if there is no such job.'''
+    for test in TEST_SET:
+        if test['language_id'] == run_spec.get('language_id'):
+            new_spec = dict(run_spec)
+            new_spec.update(runspec_from_test(test))
+            new_spec['parameters'] = {**run_spec.get('parameters', {}), **test.get('parameters', {})}
+            return new_spec
+    return None
+
+
+async def replay_traces(client, trace_files, speed, max_in_flight, lang=None):
+    '''Replay the runs in the given trace files, in order, against Jobe.
+       Each run is scheduled at its time in the trace, relative to the first
+       run, divided by speed. If speed is 0 runs are sent as fast as possible.
+       At most max_in_flight runs are outstanding at any time, so the traces
+       are streamed rather than loaded into memory. A run that arrives when
+       max_in_flight runs are outstanding is dropped, so that the schedule
+       of later runs isn't delayed, unless speed is 0, when it waits for
+       one to finish. If lang is given, only runs in that language are
+       replayed. Report the outcomes and latencies for each language.'''
+    records = []  # (language, outcome, scheduled, submitted, started, finished)
+    skipped = Counter()  # Maps language to number of runs with no substitute program
+    dropped = Counter()  # Maps language to number of runs dropped at max_in_flight
+
+    async def timed_run(run_spec, scheduled):
+        submitted = perf_counter() - t0
+        slot_acquired_time.set(None)
+        data = json.dumps({'run_spec': run_spec})
+        ok, result = await client.do_http('POST', RUNS_RESOURCE, data)
+        finished = perf_counter() - t0
+        started = (slot_acquired_time.get() or t0 + finished) - t0
+        if not ok:
+            outcome = 'exception'
+        elif isinstance(result, str):
+            outcome = result.split(':')[0]  # The HTTP status code
+        else:
+            outcome = result.get('outcome')
+        records.append((run_spec.get('language_id'), outcome, scheduled, submitted, started, finished))
+
+    pending = set()
+    first_time = None
+    t0 = perf_counter()
+    for trace_file in trace_files:
+        for time, run_spec in read_trace(trace_file):
+            if lang is not None and run_spec.get('language_id') != lang:
+                continue
+            if 'sourcecode' not in run_spec:
+                substitute = substitute_program(run_spec)
+                if substitute is None:
+                    skipped[run_spec.get('language_id')] += 1
+                    continue
+                run_spec = substitute
+            if first_time is None:
+                first_time = time
+            scheduled = (time - first_time) / speed if speed else 0
+            delay = scheduled - (perf_counter() - t0)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if len(pending) >= max_in_flight:
+                if speed:
+                    dropped[run_spec.get('language_id')] += 1
+                    continue
+                await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
             if DEBUGGING:
-                print(error_message)
-            return EXCEPTION, error_message
-
-    # Prepare the request
+                run_spec['debug'] = True
+            task = asyncio.create_task(timed_run(run_spec, scheduled))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
 
-    data = json.dumps({ 'run_spec' : runspec })
-    response = None
-    content = ''
-
-    # Do the request, returning EXCEPTION if it broke
-    ok, result = do_http('POST', RUNS_RESOURCE, data)
-    if not ok:
-        return EXCEPTION, string_result(result)
-
-   # If not an exception, check the response is as specified
-
-    if is_correct_result(test['expect'], result):
-        if DEBUGGING:
-            print(test['comment'], string_result(result))
-        return GOOD_TEST, ''
-    else:
-        if DEBUGGING:
-            print("\n***************** FAILED TEST ******************\n")
-            print(result)
-            display_result(test['comment'], result)
-            print("\n************************************************\n")
-        return FAIL_TEST, string_result(result)
-
-
-def do_http(method, resource, data=None):
-    """Send the given HTTP request to Jobe, return a pair (ok result) where
-       ok is true if no exception was thrown, false otherwise and
-       result is a dictionary of the JSON decoded response (or an empty
-       dictionary in the case of a 204 response.
-       As a special-case hack for testing 400 error conditions, if the
-       decoded JSON response is a string (which should only occur when an
-       error has occurred), the returned result string is prefixed by the
-       response code.
-    """
-    result = {}
-    ok = True
-    headers = {"Content-type": "application/json; charset=utf-8",
-               "Accept": "application/json"}
-    try:
-        connect = http_request(method, resource, data, headers)
-        response = connect.getresponse()
-        if response.status != 204:
-            content = response.read().decode('utf8')
-            if content:
-                result = json.loads(content)
-        if isinstance(result, str):
-            result = str(response.status) + ': ' + result
-        connect.close()
-
-    except (HTTPError, ValueError) as e:
-        result = str(e)
-        if DEBUGGING:
-            print("\n***************** HTTP ERROR ******************\n")
-            if response:
-                print(' Response:', response.status, response.reason, content)
-            else:
-                print(e)
-        ok = False
-    return (ok, result)
+    if pending:
+        await asyncio.wait(set(pending))
+    t1 = perf_counter()
+    print(f"{len(records)} runs replayed in {t1 - t0:.2f} secs")
+    for language, count in sorted(skipped.items(), key=str):
+        print(f"{count} {language} runs skipped (no source code and no TEST_SET program)")
+    for language, count in sorted(dropped.items(), key=str):
+        print(f"{count} {language} runs dropped ({max_in_flight} runs already in flight)")
+    for language in sorted(set(record[0] for record in records), key=str):
+        lang_records = [record for record in records if record[0] == language]
+        outcomes = Counter(str(record[1]) for record in lang_records)
+        outcome_list = ', '.join(f"{outcome}: {count}" for outcome, count in sorted(outcomes.items()))
+        print(f"{language}: {len(lang_records)} runs, outcomes {{{outcome_list}}}")
+        report_latencies([record[2:] + (record[1],) for record in lang_records], '    ')
 
 
 def trim(s):
@@ -278,11 +374,11 @@ def string_result(ro):
     return string
 
 
-def do_get_languages():
+async def do_get_languages(client):
     """List all languages available on the jobe server"""
     print("Supported languages:")
     resource = '/jobe/index.php/restapi/languages'
-    ok, lang_versions = do_http('GET', resource)
+    ok, lang_versions = await client.do_http('GET', resource)
     if not ok:
         print("**** An exception occurred when getting languages ****")
     else:
@@ -294,27 +390,96 @@ def do_get_languages():
 
 def main():
     '''Run with optional argument specifying language to test. If omitted, test all.'''
-    lang = None
-    if len(sys.argv) < 2:
-        print('Usage: loadtester initial_num_runs [language]')
-        sys.exit(0)
-    initial_num_submits = int(sys.argv[1])
-    if len(sys.argv) > 2:
-        lang = sys.argv[2].lower()
-    do_get_languages()
+    def replay_speed(s):
+        if s == 'max':
+            return 0
+        speed = float(s)
+        if speed <= 0:
+            raise argparse.ArgumentTypeError("speed must be positive or 'max'")
+        return speed
+
+    parser = argparse.ArgumentParser(
+        prog='python3 loadtester.py',
+        description='Load-test a Jobe server',
+        usage=('%(prog)s initial_num_runs [language]\n'
+               '       %(prog)s --rate RATE [options] [language]\n'
+               '       %(prog)s --replay TRACE [--replay TRACE ...] [options] [language]'),
+        epilog="""Without --rate or --replay, submit bursts of initial_num_runs parallel jobs,
+doubling the burst size until a failure occurs. With --rate, submit jobs on a fixed
+schedule (open loop) at the given mean rate for --duration seconds. With --replay,
+submit the run_specs from the given JSONL trace files with their recorded timing."""
+    )
+    parser.add_argument('-r', '--rate', type=float,
+        help='Open-loop mode: submit jobs at this mean rate (jobs/sec)')
+    parser.add_argument('-d', '--duration', type=float, default=30,
+        help='Open-loop mode: the time in secs over which to submit jobs (default 30)')
+    parser.add_argument('-a', '--arrivals', choices=['poisson', 'constant'], default='poisson',
+        help='Open-loop mode: the distribution of job arrival times (default poisson)')
+    parser.add_argument('--replay', action='append', metavar='TRACE',
+        help='Replay mode: replay the runs in this JSONL trace file (.gz for gzipped). '
+             'Repeat to replay several files in turn.')
+    parser.add_argument('-s', '--speed', type=replay_speed, default=1,
+        help="Replay mode: the speed-up factor relative to the trace times, or 'max' "
+             "to submit as fast as possible (default 1)")
+    parser.add_argument('-c', '--connections', type=int, default=DEFAULT_MAX_CONNECTIONS,
+        help=f'The maximum number of requests in flight at once (default {DEFAULT_MAX_CONNECTIONS})')
+    parser.add_argument('positionals', nargs='*', metavar='initial_num_runs [language]',
+        help='The initial burst size (omitted with --rate) and the language to test (default all)')
+    args = parser.parse_args()
+    positionals = args.positionals
+    if args.replay:
+        if args.rate is not None:
+            parser.error('--rate and --replay are mutually exclusive')
+        if len(positionals) > 1:
+            parser.error('too many arguments')
+        lang = positionals[0].lower() if positionals else None
+        asyncio.run(replay(args, lang))
+        return
+    if args.rate is None:
+        if not positionals or not positionals[0].isdigit():
+            parser.print_usage()
+            sys.exit(0)
+        initial_num_submits = int(positionals.pop(0))
+    elif args.rate <= 0:
+        parser.error('the rate must be positive')
+    if len(positionals) > 1:
+        parser.error('too many arguments')
+    lang = positionals[0].lower() if positionals else None
+    asyncio.run(load_test(args, lang, initial_num_submits if args.rate is None else None))
+
+
+async def replay(args, lang):
+    '''Replay the trace files given by args.replay, restricted to the given
+       language if not None.'''
+    client = make_client(args.connections)
+    await replay_traces(client, args.replay, args.speed, args.connections, lang)
+    await client.close()
+
+
+async def load_test(args, lang, initial_num_submits):
+    '''Load-test with each of the test programs in the given language (or
+       all languages if lang is None), in open-loop mode if args.rate is set,
+       otherwise with doubling bursts starting at initial_num_submits jobs.'''
+    global successes, fails
+    client = make_client(args.connections)
+    await do_get_languages(client)
 
     for test in TEST_SET:
-        global successes, fails
         if lang is not None and test['language_id'] != lang:
             continue
-        fails = 0
+        successes = fails = 0
         print(f"Load-testing with task {test['comment']}")
-    
+
+        if args.rate is not None:
+            await check_open_loop(client, test, args.rate, args.duration, args.arrivals)
+            continue
+
         num_submits = initial_num_submits
-        while fails == 0: 
+        while fails == 0:
             successes = 0
-            check_parallel_submissions(test, num_submits)
+            await check_parallel_submissions(client, test, num_submits)
             num_submits *= 2
-            sleep(5)
+            await asyncio.sleep(5)
+    await client.close()
 
 sys.exit(main())
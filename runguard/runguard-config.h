@@ -15,4 +15,10 @@
 
 #define CHROOT_PREFIX "/var/www/jobe/chrootjail"
 
+/* The --privatetmp directory must be within PRIVATE_TMP_PREFIX. It is
+ * mounted over each of the (comma-separated) PRIVATE_TMP_MOUNTS that exist.
+ */
+#define PRIVATE_TMP_PREFIX "/home/jobe/tmp/"
+#define PRIVATE_TMP_MOUNTS "/tmp,/var/tmp,/var/crash,/run/lock"
+
 #endif /* _RUNGUARD_CONFIG_ */
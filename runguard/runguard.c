@@ -45,10 +45,8 @@
 
 /* For chroot(), which is not POSIX. */
 #define _DEFAULT_SOURCE
-/* For unshare(), only used when cgroups are enabled */
-#if ( USE_CGROUPS == 1 )
+/* For unshare(), used when cgroups are enabled and for private tmp dirs */
 #define _GNU_SOURCE
-#endif
 
 #include <sys/types.h>
 #include <sys/wait.h>
@@ -58,6 +56,7 @@
 #include <sys/time.h>
 #include <sys/times.h>
 #include <sys/resource.h>
+#include <sys/mount.h>
 #include <errno.h>
 #include <fcntl.h>
 #include <signal.h>
@@ -72,10 +71,10 @@
 #include <time.h>
 #include <math.h>
 #include <limits.h>
+#include <sched.h>
 #if ( USE_CGROUPS == 1 )
 #include <inttypes.h>
 #include <libcgroup.h>
-#include <sched.h>
 #else
 #undef USE_CGROUPS
 #endif
@@ -107,10 +106,12 @@ char  *progname;
 char  *cmdname;
 char **cmdargs;
 char  *rootdir;
+char  *privatetmpdir;
 char  *stdoutfilename;
 char  *stderrfilename;
 char  *exitfilename;
 char  *timefilename;
+char  *metafilename;
 #ifdef USE_CGROUPS
 char  *cgroupname;
 const char *cpuset;
@@ -119,6 +120,7 @@ const char *cpuset;
 int runuid;
 int rungid;
 int use_root;
+int use_privatetmp;
 int use_time;
 int use_cputime;
 int use_user;
@@ -128,6 +130,7 @@ int redir_stderr;
 int limit_streamsize;
 int outputexit;
 int outputtime;
+int outputmeta;
 int no_coredump;
 int be_verbose;
 int be_quiet;
@@ -158,6 +161,7 @@ struct tms startticks, endticks;
 
 struct option const long_opts[] = {
 	{"root",       required_argument, NULL,         'r'},
+	{"privatetmp", required_argument, NULL,         'M'},
 	{"user",       required_argument, NULL,         'u'},
 	{"group",      required_argument, NULL,         'g'},
 	{"time",       required_argument, NULL,         't'},
@@ -172,6 +176,7 @@ struct option const long_opts[] = {
 	{"streamsize", required_argument, NULL,         's'},
 	{"outexit",    required_argument, NULL,         'E'},
 	{"outtime",    required_argument, NULL,         'T'},
+	{"outmeta",    required_argument, NULL,         'U'},
 	{"verbose",    no_argument,       NULL,         'v'},
 	{"quiet",      no_argument,       NULL,         'q'},
 	{"help",       no_argument,       &show_help,    1 },
@@ -254,6 +259,7 @@ Run COMMAND with restrictions.\n\
 \n", progname);
 	printf("\
   -r, --root=ROOT        run COMMAND with root directory set to ROOT\n\
+  -M, --privatetmp=DIR   mount DIR over /tmp etc. (see PRIVATE_TMP_MOUNTS)\n\
   -u, --user=USER        run COMMAND as user with username or ID USER\n\
   -g, --group=GROUP      run COMMAND under group with name or ID GROUP\n\
   -t, --time=TIME        kill COMMAND after TIME seconds (float)\n\
@@ -268,7 +274,9 @@ Run COMMAND with restrictions.\n\
   -e, --stderr=FILE      redirect COMMAND stderr output to FILE\n\
   -s, --streamsize=SIZE  truncate COMMAND stdout/stderr streams at SIZE kB\n\
   -E, --outexit=FILE     write COMMAND exitcode to FILE\n\
-  -T, --outtime=FILE     write COMMAND runtime to FILE\n");
+  -T, --outtime=FILE     write COMMAND runtime to FILE\n\
+  -U, --outmeta=FILE     write COMMAND wall time, CPU time, max RSS and\n\
+                           exitcode to FILE, which mustn't be a symlink\n");
 	printf("\
   -v, --verbose          display some extra warnings and information\n\
   -q, --quiet            suppress all warnings and verbose output\n\
@@ -282,6 +290,29 @@ real user ID.\n");
 	exit(0);
 }
 
+/* Write the resource usage of the command, one "name: value" per line.
+   The file is opened with O_NOFOLLOW, as we may still be running as root. */
+void output_meta(int exitcode, double timediff, double cpudiff)
+{
+	FILE  *outputfile;
+	struct rusage usage;
+	int fd;
+
+	if ( getrusage(RUSAGE_CHILDREN,&usage)!=0 ) error(errno,"getting resource usage");
+
+	fd = open(metafilename, O_WRONLY|O_CREAT|O_TRUNC|O_NOFOLLOW, S_IRUSR|S_IWUSR|S_IRGRP|S_IROTH);
+	if ( fd<0 || (outputfile = fdopen(fd,"w"))==NULL ) {
+		error(errno,"cannot open `%s'",metafilename);
+	}
+	if ( fprintf(outputfile,"wall-time: %.3f\ncpu-time: %.3f\nmax-rss-kb: %ld\nexitcode: %d\n",
+	             timediff, cpudiff, usage.ru_maxrss, exitcode)<0 ) {
+		error(0,"cannot write to file `%s'",metafilename);
+	}
+	if ( fclose(outputfile) ) {
+		error(errno,"closing file `%s'",metafilename);
+	}
+}
+
 void output_exit_time(int exitcode, double timediff)
 {
 	FILE  *outputfile;
@@ -314,6 +345,11 @@ void output_exit_time(int exitcode, double timediff)
 		warning("timelimit exceeded (cpu time)");
 	}
 
+	if ( outputmeta ) {
+		verbose("writing metadata to file `%s'",metafilename);
+		output_meta(exitcode, timediff, userdiff+sysdiff);
+	}
+
 	if ( outputtime ) {
 		verbose("writing runtime to file `%s'",timefilename);
 
@@ -520,6 +556,44 @@ long readoptarg(const char *desc, long minval, long maxval)
 	return arg;
 }
 
+/* Make the temporary directories listed in PRIVATE_TMP_MOUNTS private to
+   the command, by bind-mounting privatetmpdir over each of them in a new
+   mount namespace. Temporary files created by the command can then be
+   cleaned up by just emptying privatetmpdir. */
+void setprivatetmp()
+{
+	char *path, *mounts, *target;
+	struct stat st;
+
+	if ( (path = (char *) malloc(PATH_MAX+1))==NULL ) {
+		error(errno,"allocating memory");
+	}
+	if ( realpath(privatetmpdir,path)==NULL ) {
+		error(errno,"cannot canonicalize path '%s'",privatetmpdir);
+	}
+	if ( strncmp(path,PRIVATE_TMP_PREFIX,strlen(PRIVATE_TMP_PREFIX))!=0 ) {
+		error(0,"invalid private tmp dir: must be within `%s'",PRIVATE_TMP_PREFIX);
+	}
+
+	if ( unshare(CLONE_NEWNS)!=0 ) error(errno,"cannot make mount namespace");
+	/* Don't let our mounts propagate back to the parent namespace. */
+	if ( mount(NULL,"/",NULL,MS_REC|MS_PRIVATE,NULL)!=0 ) {
+		error(errno,"cannot make mounts private");
+	}
+
+	mounts = strdup(PRIVATE_TMP_MOUNTS);
+	for(target=strtok(mounts,","); target!=NULL; target=strtok(NULL,",")) {
+		if ( stat(target,&st)!=0 || !S_ISDIR(st.st_mode) ) continue;
+		if ( mount(path,target,NULL,MS_BIND,NULL)!=0 ||
+		     mount(NULL,target,NULL,MS_REMOUNT|MS_BIND|MS_NOSUID|MS_NODEV,NULL)!=0 ) {
+			error(errno,"cannot mount `%s' on `%s'",path,target);
+		}
+		verbose("mounted private tmp dir `%s' on `%s'",path,target);
+	}
+	free(mounts);
+	free(path);
+}
+
 void setrestrictions()
 {
         char* savedEnvironmentVariables[] = {"PATH", "LANG", "LC_ALL", "LC_COLLATE",
@@ -608,6 +682,9 @@ void setrestrictions()
 		if ( setrlimit(RLIMIT_CORE,&lim)!=0 ) error(errno,"disabling core dumps");
 	}
 
+	/* Must be done before chroot, as the mount targets are outside it. */
+	if ( use_privatetmp ) setprivatetmp();
+
 	/* Set root-directory and change directory to there. */
 	if ( use_root ) {
 		/* Small security issue: when running setuid-root, people can find
@@ -687,12 +764,13 @@ int main(int argc, char **argv)
 
 	/* Parse command-line options */
 	use_root = use_time = use_cputime = use_user = outputexit = outputtime = no_coredump = 0;
+	use_privatetmp = outputmeta = 0;
 	memsize = filesize = nproc = RLIM_INFINITY;
 	redir_stdout = redir_stderr = limit_streamsize = 0;
 	be_verbose = be_quiet = 0;
 	show_help = show_version = 0;
 	opterr = 0;
-	while ( (opt = getopt_long(argc,argv,"+r:u:g:t:C:m:f:p:P:c:o:e:s:E:T:v:q",long_opts,(int *) 0))!=-1 ) {
+	while ( (opt = getopt_long(argc,argv,"+r:M:u:g:t:C:m:f:p:P:c:o:e:s:E:T:U:v:q",long_opts,(int *) 0))!=-1 ) {
 		switch ( opt ) {
 		case 0:   /* long-only option */
 			break;
@@ -701,6 +779,10 @@ int main(int argc, char **argv)
 			rootdir = (char *) malloc(strlen(optarg)+2);
 			strcpy(rootdir,optarg);
 			break;
+		case 'M': /* privatetmp option */
+			use_privatetmp = 1;
+			privatetmpdir = strdup(optarg);
+			break;
 		case 'u': /* user option: uid or string */
 			use_user = 1;
 			runuid = strtol(optarg,&ptr,10);
@@ -784,6 +866,10 @@ int main(int argc, char **argv)
 			outputtime = 1;
 			timefilename = strdup(optarg);
 			break;
+		case 'U': /* outputmeta option */
+			outputmeta = 1;
+			metafilename = strdup(optarg);
+			break;
 		case 'v': /* verbose option */
 			be_verbose = 1;
 			break;
@@ -29,25 +29,41 @@
     Modified 20/1/2025 to fix bug in reporting of overload errors and to
     include tests for serious errors conditions in testsubmit.py
 
+    In --perf mode, every run is now timed. Latencies are collected in
+    histograms per language and per outcome code and reported as percentiles
+    (p50, p90, p99, p99.9, max) together with the throughput over time, since
+    tuning parameters like jobe_max_users should be judged by tail latency.
+
+    Parallel submissions now use the asyncio-based JobeClient in
+    jobeclient.py, which must be in the same directory as this program,
+    rather than one thread and one new HTTP connection per job.
+
     For information type 'python3 testsubmit.py --help'
 
 '''
 import json
 import sys
+import re
+import math
 import argparse
 import http.client
 from urllib.request import urlopen
 from urllib.parse import urlencode
 from urllib.error import HTTPError
-from time import perf_counter, sleep
-from threading import Thread
+import asyncio
+from time import perf_counter
+from threading import Lock
 from hashlib import md5
-import copy
 from base64 import b64encode
+from jobeclient import (JobeClient, DEFAULT_MAX_CONNECTIONS, runspec_from_test,
+                        is_correct_result, multipart_body)
 
 API_KEY = '2AAA7A5415B4A9B394B54BF1D2E9D'  # A working (100/hr) key on Jobe2
 DEBUGGING = False  # If true, all runs are saved on the Jobe server. Not recommended (there are lots!)
 RUNS_RESOURCE = '/jobe/index.php/restapi/runs/'
+BATCHES_RESOURCE = '/jobe/index.php/restapi/batches'
+METRICS_RESOURCE = '/jobe/index.php/restapi/metrics'
+FILE_PUT_MAX_MB = 100  # The server's file_put_max_mb (see app/Config/Jobe.php)
 
 # The next constant controls the maximum number of parallel submissions to
 # throw at Jobe at once. Numbers less than or equal to the number of Jobe
@@ -55,10 +71,14 @@ RUNS_RESOURCE = '/jobe/index.php/restapi/runs/'
 # Overload responses.
 NUM_PARALLEL_SUBMITS = 10
 
+ASYNC_RESULT_TIMEOUT = 60  # Max secs to wait for the result of an asynchronous run
 GOOD_TEST = 0
 FAIL_TEST = 1
 EXCEPTION = 2
 
+# The latency percentiles reported in --perf mode
+PERCENTILES = [50, 90, 99, 99.9]
+
 JAVA_PROGRAM = """public class Thing {
     private String message;
     public Thing(String message) {
@@ -187,6 +207,21 @@ Second file
 '''}
 },
 
+{
+    'comment': 'Python3 program with support files named like the server\'s own files',
+    'language_id': 'python3',
+    'files': [
+        ('randomid0129799', 'Not the output'),
+        ('randomid0980129', 'Not the input')],
+    'sourcecode': r'''print(input())
+''',
+    'input': 'The input\n',
+    'file_list': [('randomid0129799', 'prog.out'),('randomid0980129', 'prog.in')],
+    'sourcefilename': 'test.py',
+    'expect': { 'outcome': 15, 'stdout': '''The input
+'''}
+},
+
 {
     'comment': 'Valid Python3/pylint program',
     'language_id': 'python3',
@@ -623,6 +658,34 @@ public class Blah {
 '''}
 },
 
+{
+    'comment': 'Java program with no public main class (compiled or restored from the compile cache)',
+    'language_id': 'java',
+    'sourcecode': r'''
+class prog {
+    public static void main(String[] args) {
+        System.out.println("No public class here");
+    }
+}
+''',
+    'parameters': {'cputime':10},
+    'expect': { 'outcome': 15, 'stdout': "No public class here\n"}
+},
+
+{
+    'comment': 'Java program with no public main class (same again, so a compile cache hit)',
+    'language_id': 'java',
+    'sourcecode': r'''
+class prog {
+    public static void main(String[] args) {
+        System.out.println("No public class here");
+    }
+}
+''',
+    'parameters': {'cputime':10},
+    'expect': { 'outcome': 15, 'stdout': "No public class here\n"}
+},
+
 {
     'comment': 'Java program with Unicode output (will fail unless Jobe set up for UTF-8) ',
     'language_id': 'java',
@@ -744,58 +807,128 @@ def output(*args, **keywords):
         print(*args, **keywords)
 
 
-def check_multiple_submissions(job, num_submits, sleep_time=0):
+class LatencyHistogram:
+    """A histogram of latencies in the style of HdrHistogram: bucket boundaries
+       grow geometrically so that every recorded value is known to within
+       RELATIVE_ERROR, whatever its magnitude, using little memory.
+       Histograms can be merged, e.g. to combine the results of several runs.
+    """
+    RELATIVE_ERROR = 0.01
+
+    def __init__(self):
+        self.counts = {}  # Map from bucket number to count
+        self.total = 0
+        self.max = 0.0
+
+    def bucket(self, value):
+        """The number of the bucket containing the given value (secs)"""
+        return math.ceil(math.log(max(value, 1e-6) / 1e-6, 1 + self.RELATIVE_ERROR))
+
+    def record(self, value):
+        """Add the given latency (secs) to the histogram"""
+        b = self.bucket(value)
+        self.counts[b] = self.counts.get(b, 0) + 1
+        self.total += 1
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        """Add all the values in the other histogram to this one"""
+        for b, count in other.counts.items():
+            self.counts[b] = self.counts.get(b, 0) + count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, pc):
+        """Return (an upper bound on) the pc-th percentile latency (secs)"""
+        rank = max(1, math.ceil(pc / 100 * self.total))
+        seen = 0
+        for b in sorted(self.counts):
+            seen += self.counts[b]
+            if seen >= rank:
+                return min(self.max, 1e-6 * (1 + self.RELATIVE_ERROR) ** b)
+        return self.max
+
+    def summary(self):
+        """A one-line summary of the latency distribution, in msecs"""
+        pcs = ', '.join(f"p{pc:g} {1000 * self.percentile(pc):.0f}" for pc in PERCENTILES)
+        return f"{self.total} runs, {pcs}, max {1000 * self.max:.0f} ms"
+
+
+class PerfStats:
+    """The timing of all runs in a performance test: a latency histogram for
+       each (language, outcome) pair, where outcome is the Jobe outcome code
+       or the HTTP status/'exception' if no result object was returned, plus
+       the completion times of all runs for a throughput-over-time series.
+    """
+    def __init__(self):
+        self.histograms = {}
+        self.completions = []  # Secs since t0
+        self.t0 = perf_counter()
+        self.lock = Lock()
+
+    def record(self, lang, outcome, t_start, t_end):
+        """Record a run in the given language with the given outcome that
+           started at time t_start and ended at t_end (from perf_counter)."""
+        with self.lock:
+            histogram = self.histograms.setdefault((lang, str(outcome)), LatencyHistogram())
+            histogram.record(t_end - t_start)
+            self.completions.append(t_end - self.t0)
+
+    def merge(self, other):
+        """Add the histograms of the other PerfStats into this one"""
+        for key, histogram in other.histograms.items():
+            self.histograms.setdefault(key, LatencyHistogram()).merge(histogram)
+
+    def throughput_series(self, interval=1):
+        """Return a list of the number of runs completed per second in each
+           of the consecutive time intervals (secs) since t0"""
+        if not self.completions:
+            return []
+        series = [0] * (int(max(self.completions) // interval) + 1)
+        for t in self.completions:
+            series[int(t // interval)] += 1
+        return [count / interval for count in series]
+
+    def report(self, show_throughput=False):
+        """Print the latency summary for each (language, outcome) pair, plus
+           the throughput series if show_throughput is true"""
+        for (lang, outcome), histogram in sorted(self.histograms.items()):
+            print(f"    {lang}, outcome {outcome}: {histogram.summary()}")
+        if show_throughput and self.completions:
+            series = ' '.join(f"{rate:g}" for rate in self.throughput_series())
+            print(f"    Throughput (jobs/sec in each 1 sec interval): {series}")
+
+
+def check_multiple_submissions(job, num_submits, sleep_time=0, stats=None):
     '''Check that we can submit the specified job to the jobe server 'num_submits'
        times, pausing 'sleep_time' secs after each, and have all jobs run
-       correctly.
+       correctly. If a PerfStats object is given, record the time of
+       every run in it.
        Return GOOD_TEST if all run or or FAIL_TEST otherwise.
 
     '''
 
-    threads = []
-    overall_outcome = GOOD_TEST
+    return asyncio.run(submit_multiple(job, num_submits, sleep_time, stats))
+
+
+async def submit_multiple(job, num_submits, sleep_time, stats):
+    '''The asynchronous implementation of check_multiple_submissions.
+       All submissions share one JobeClient, so the number of jobs in flight
+       is limited only by the --connections option, not by client threads.'''
+    client = JobeClient(ARGS.host, ARGS.port, ARGS.ssl, ARGS.proxy, API_KEY,
+                        ARGS.connections, ARGS.verbose, DEBUGGING)
+    tasks = []
     for child_num in range(num_submits):
         if ARGS.verbose:
             output(f"Doing child {child_num}")
-        def run_job():
-            nonlocal overall_outcome
-            this_job = copy.deepcopy(job)
-            this_job['comment'] += '. Child' + str(child_num)
-            if run_test(job) != GOOD_TEST:
-                overall_outcome = FAIL_TEST
-
-        t = Thread(target=run_job)
-        threads.append(t)
-        t.start()
+        tasks.append(asyncio.create_task(run_test_async(client, job, stats)))
         if sleep_time:
-            sleep(sleep_time)
+            await asyncio.sleep(sleep_time)
 
-    for t in threads:
-        t.join()
+    outcomes = await asyncio.gather(*tasks)
+    await client.close()
     output("All done")
-    return overall_outcome
-
-
-def is_correct_result(expected, got):
-    '''If got is a dictionary (the usual case), return true iff every key
-       in the expected outcome exists in the
-       actual outcome and the associated values are equal, too.
-       However, if got is a string, the run must have failed (i.e.
-       not a 200 return code). In that case, expected should have a 
-       'response' key which should match the first token in the got
-       string. The rest of the got string should match the expected 
-       stdout.)
-    '''
-    if isinstance(got, str):
-        if 'response' not in expected:
-            return False
-        return (got.startswith(str(expected['response']) + ':') and 
-                got[4:].strip() == expected['stdout'].strip())
-    else:
-        for key in expected:
-            if key not in got or expected[key] != got[key]:
-                return False
-        return True
+    return GOOD_TEST if all(outcome == GOOD_TEST for outcome in outcomes) else FAIL_TEST
 
 
 # ============================================================
@@ -873,21 +1006,45 @@ def put_file(file_desc):
     connect.close()
 
 
-def runspec_from_test(test):
-    """Return a runspec corresponding to the given test"""
-    runspec = {}
-    for key in test:
-        if key not in ['comment', 'expect', 'files']:
-            runspec[key] = test[key]
-    if DEBUGGING:
-        runspec['debug'] = True
-    return runspec
+def check_files(file_ids):
+    '''Checks which of the given fileids exist on the server, with a single
+       request. Returns the list of missing file ids, or None if the
+       request fails.
+    '''
+    data = json.dumps({'file_ids': list(file_ids)})
+    ok, result = do_http('POST', '/jobe/index.php/restapi/files/missing', data)
+    if ARGS.verbose:
+        output(f"Response to checking files: {result}")
+    if not ok or not isinstance(result, dict):
+        return None
+    return result.get('missing')
+
+
+def put_files(file_descs):
+    '''Put all the given (file_id, contents) pairs to the server with a
+       single multipart/form-data request. Throws an exception to be caught
+       by caller if anything fails.
+    '''
+    data, content_type = multipart_body(file_descs)
+    resource = '/jobe/index.php/restapi/files'
+    headers = {"Content-type": content_type,
+               "Accept": "text/plain"}
+    connect = http_request('POST', resource, data, headers)
+    response = connect.getresponse()
+    if ARGS.verbose or response.status != 204:
+        output(f"Response to putting {len(file_descs)} files:")
+        content = ''
+        if response.status != 204:
+            content =  response.read(4096)
+        output(f"{response.status} {response.reason} {content}")
+    connect.close()
 
 
-def run_test(test):
-    '''Execute the given test, checking the output'''
+def run_test(test, stats=None):
+    '''Execute the given test, checking the output. If a PerfStats object
+       is given, record the time of the run in it.'''
 
-    runspec = runspec_from_test(test)
+    runspec = runspec_from_test(test, DEBUGGING)
 
     # First put any files to the server
     for file_desc in test.get('files', []):
@@ -904,13 +1061,45 @@ def run_test(test):
     content = ''
 
     # Do the request, returning EXCEPTION if it broke
+    t_start = perf_counter()
     ok, result = do_http('POST', RUNS_RESOURCE, data)
+    if stats is not None:
+        stats.record(test['language_id'], run_outcome(ok, result), t_start, perf_counter())
     if not ok:
         print(f"Exception: {result}")
         return EXCEPTION
+    return check_result(test, result)
+
+
+async def run_test_async(client, test, stats=None):
+    '''As for run_test but using the given JobeClient, so that many tests
+       can be run concurrently.'''
+    t_start = perf_counter()
+    status, result = await client.run_test(test)
+    if stats is not None:
+        stats.record(test['language_id'], run_outcome(status != EXCEPTION, result),
+                     t_start, perf_counter())
+    if status == EXCEPTION:
+        print(f"Exception: {result}")
+        return EXCEPTION
+    return check_result(test, result)
+
+
+def run_outcome(ok, result):
+    '''The outcome of a run, for performance statistics: the Jobe outcome
+       code if a result object was returned, else the HTTP status code, or
+       'exception' if the request failed altogether.'''
+    if not ok:
+        return 'exception'
+    elif isinstance(result, str):
+        return result.split(':')[0]  # The HTTP status code
+    else:
+        return result.get('outcome')
 
-   # If not an exception, check the response is as specified
 
+def check_result(test, result):
+    '''Check the result of running the given test is as expected, displaying
+       it as appropriate. Return GOOD_TEST or FAIL_TEST.'''
     if is_correct_result(test['expect'], result):
         if ARGS.verbose:
             display_result(test['comment'], result)
@@ -923,7 +1112,6 @@ def run_test(test):
         display_result(test['comment'], result)
         output("\n************************************************\n")
         return FAIL_TEST
-    print("Shouldn't get here!")
 
 
 def do_http(method, resource, data=None):
@@ -1037,7 +1225,7 @@ int main() {
     'sourcefilename': 'test.c',
     'parameters': {'cputime': 151}
 }
-    runspec = runspec_from_test(test)
+    runspec = runspec_from_test(test, DEBUGGING)
     data = json.dumps({ 'run_spec' : runspec })
     output("\nTesting a submission with an excessive cputime parameter")
     ok, result = do_http('POST', RUNS_RESOURCE, data)
@@ -1048,6 +1236,246 @@ int main() {
         output(f"Return value from do_http was {(ok, result)}")
 
 
+def run_test_asynchronously(test):
+    """Submit the given test as an asynchronous run and poll for its result,
+       which is checked as for run_test. Return GOOD_TEST, FAIL_TEST or
+       EXCEPTION, or None if the server doesn't accept asynchronous runs.
+    """
+    runspec = runspec_from_test(test, DEBUGGING)
+    runspec['async'] = True
+    ok, result = do_http('POST', RUNS_RESOURCE, json.dumps({'run_spec': runspec}))
+    if isinstance(result, str) and result.startswith('400: Asynchronous runs are not enabled'):
+        return None
+    if not ok or not isinstance(result, dict) or 'run_id' not in result:
+        output(f"Async POST of '{test['comment']}' failed: {result}")
+        return EXCEPTION
+    run_id = result['run_id']
+    deadline = perf_counter() + ASYNC_RESULT_TIMEOUT
+    while perf_counter() < deadline:
+        ok, result = do_http('GET', f'{RUNS_RESOURCE}{run_id}?wait=2')
+        if not ok:
+            return EXCEPTION
+        if not (isinstance(result, dict) and result.get('status') in ['queued', 'running']):
+            return check_result(test, result)
+    output(f"Async run of '{test['comment']}' didn't finish within {ASYNC_RESULT_TIMEOUT} secs")
+    return FAIL_TEST
+
+
+def check_async_runs():
+    """Check that asynchronous runs of a good and a non-compiling C program
+       give the same results as synchronous runs, and that a GET of an
+       unknown run id gets a 404 response. Skipped (with a message) if the
+       server doesn't accept asynchronous runs, as by default.
+    """
+    output("\nTesting asynchronous runs")
+    c_tests = [test for test in TEST_SET if test['language_id'] == 'c']
+    tests = [next(test for test in c_tests if test['expect'].get('outcome') == outcome)
+             for outcome in [15, 11]]  # Success and compile error
+    for test in tests:
+        status = run_test_asynchronously(test)
+        if status is None:
+            output("Skipped: asynchronous runs are not enabled on this server")
+            return
+        if status != GOOD_TEST:
+            output("********** TEST FAILED **************")
+    unknown_id = md5(b'No such run').hexdigest()
+    ok, result = do_http('GET', RUNS_RESOURCE + unknown_id)
+    if isinstance(result, str) and result.startswith('404: get: no such run'):
+        output("Unknown run id OK")
+    else:
+        output("********** TEST FAILED **************")
+        output(f"Return value from GET of unknown run was {(ok, result)}")
+
+
+def put_file_stream(file_id, contents):
+    """Put the given bytes to the server as the file with the given id,
+       using an application/octet-stream body. Return the response status.
+    """
+    resource = '/jobe/index.php/restapi/files/' + file_id
+    headers = {"Content-type": "application/octet-stream",
+               "Accept": "text/plain"}
+    connect = http_request('PUT', resource, contents, headers)
+    response = connect.getresponse()
+    response.read()
+    connect.close()
+    return response.status
+
+
+def check_octet_stream_puts():
+    """Check that an application/octet-stream PUT of a file stores it,
+       that one with an MD5 id that doesn't match the contents gets a 400
+       response and one larger than the server's size limit gets a 413.
+       Also check that a JSON PUT with a mismatched MD5 id is still accepted.
+    """
+    output("\nTesting octet-stream file PUTs")
+    contents = 'Octet-stream file\n'.encode('utf8') + bytes(range(256))
+    good_id = md5(contents).hexdigest()
+    bad_id = md5(b'Something else').hexdigest()
+    json_bad_id = md5(b'Something else again').hexdigest()
+    try:
+        statuses = [put_file_stream(good_id, contents), check_file(good_id),
+                    put_file_stream(bad_id, contents), check_file(bad_id),
+                    put_file_stream('oversize', bytes((FILE_PUT_MAX_MB + 1) * 1024 * 1024))]
+    except OSError as e:
+        statuses = [str(e)]
+    put_file((json_bad_id, 'Not what the id says\n'))
+    statuses.append(check_file(json_bad_id))
+    if statuses == [204, 204, 400, 404, 413, 204]:
+        output("OK")
+    else:
+        output("********** TEST FAILED **************")
+        output(f"Statuses (PUT, HEAD, bad MD5 PUT, HEAD, oversize PUT, JSON bad MD5 HEAD): {statuses}")
+
+
+def check_bulk_files():
+    """Check that files put with a single multipart POST are then reported
+       present by both the bulk missing-files check and a HEAD of each,
+       and that the bulk check reports a file that was never put.
+    """
+    output("\nTesting a bulk file upload and bulk file check")
+    file_descs = [('bulkfile' + str(i), f'Bulk file {i}\n' * (i + 1)) for i in range(3)]
+    never_put = md5(b'A file that was never put').hexdigest()
+    put_files(file_descs)
+    missing = check_files([file_id for file_id, contents in file_descs] + [never_put])
+    statuses = [check_file(file_id) for file_id, contents in file_descs]
+    if missing == [never_put] and statuses == [204, 204, 204]:
+        output("OK")
+    else:
+        output("********** TEST FAILED **************")
+        output(f"Missing files: {missing}, HEAD statuses: {statuses}")
+
+
+def check_batches():
+    """Check that each case of a batch run of a Python3 program gives the
+       same outcome, stdout and stderr as the equivalent individual run,
+       including a case that fails, that a file written by one case isn't
+       seen by the next, and that a streamed batch is rejected.
+    """
+    output("\nTesting a batch run")
+    sourcecode = '\n'.join([
+        'import os, sys',
+        'print(os.path.exists("state.txt"), sys.argv[1:], input())',
+        'open("state.txt", "w").write("Left by a previous case")',
+        'if sys.argv[1:] == ["fail"]:',
+        '    sys.exit("Failed")',
+    ])
+    run_spec = {'language_id': 'python3', 'sourcecode': sourcecode,
+                'sourcefilename': 'batch.py', 'parameters': {'cputime': 5}}
+    cases = [{'input': 'First\n'},
+             {'input': 'Second\n', 'parameters': {'runargs': ['arg']}},
+             {'input': 'Third\n', 'parameters': {'runargs': ['fail']}},
+             {'input': 'Fourth\n'}]
+    ok, batch_results = do_http('POST', BATCHES_RESOURCE,
+                                json.dumps({'run_spec': run_spec, 'cases': cases}))
+    if not ok or not isinstance(batch_results, list) or len(batch_results) != len(cases):
+        output("********** TEST FAILED **************")
+        output(f"Return value from batch POST was {(ok, batch_results)}")
+        return
+    failed = False
+    for case, batch_result in zip(cases, batch_results):
+        case_run_spec = dict(run_spec, input=case['input'],
+                             parameters=dict(run_spec['parameters'], **case.get('parameters', {})))
+        ok, run_result = do_http('POST', RUNS_RESOURCE, json.dumps({'run_spec': case_run_spec}))
+        fields = ['outcome', 'stdout', 'stderr']
+        if not ok or [batch_result.get(f) for f in fields] != [run_result.get(f) for f in fields]:
+            output(f"Batch result {batch_result} differs from individual run result {run_result}")
+            failed = True
+    ok, result = do_http('POST', BATCHES_RESOURCE,
+                         json.dumps({'run_spec': dict(run_spec, stream=True), 'cases': cases}))
+    if not (isinstance(result, str) and result.startswith('400:')):
+        output(f"Return value from streamed batch POST was {(ok, result)}")
+        failed = True
+    output("********** TEST FAILED **************" if failed else "OK")
+
+
+def get_metrics():
+    """GET the server metrics and parse them as Prometheus text exposition
+       format. Return a dictionary mapping each sample, as 'name{labels}',
+       to its value, or raise ValueError if the text can't be parsed.
+    """
+    connect = http_request('GET', METRICS_RESOURCE, None, {})
+    response = connect.getresponse()
+    text = response.read().decode('utf8')
+    connect.close()
+    if response.status != 200:
+        raise ValueError(f'GET of metrics gave status {response.status}')
+    name_re = r'[a-zA-Z_:][a-zA-Z0-9_:]*'
+    label_re = r'[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\\n]|\\.)*"'
+    sample_re = rf'({name_re})(\{{(?:{label_re}(?:,{label_re})*)?\}})? (\S+)'
+    types = {}
+    samples = {}
+    for line in text.splitlines():
+        if match := re.fullmatch(rf'# TYPE ({name_re}) (counter|gauge|histogram|summary|untyped)', line):
+            types[match.group(1)] = match.group(2)
+        elif re.fullmatch(rf'# HELP {name_re} .*', line) or line == '':
+            continue
+        elif match := re.fullmatch(sample_re, line):
+            name = match.group(1)
+            family = re.sub('_(bucket|sum|count)$', '', name) if name not in types else name
+            if family not in types:
+                raise ValueError(f'Metric sample without a TYPE: {line}')
+            samples[name + (match.group(2) or '')] = float(match.group(3))
+        else:
+            raise ValueError(f'Bad line in metrics: {line}')
+    return samples
+
+
+def check_metrics(test):
+    """Check that the server metrics parse as Prometheus text exposition
+       format, and that a run of the given test, which should succeed,
+       increments the count of successful runs in its language. The second
+       check is skipped if metrics are disabled, as by default.
+    """
+    output("\nTesting server metrics")
+    key = f'jobe_runs_total{{language="{test["language_id"]}",outcome="15"}}'
+    try:
+        before = get_metrics()
+        run_test(test)
+        after = get_metrics()
+    except (ValueError, OSError) as e:
+        output("********** TEST FAILED **************")
+        output(f"Metrics error: {e}")
+        return
+    if 'jobe_max_users' not in after:
+        output("********** TEST FAILED **************")
+        output("Metrics are missing jobe_max_users")
+    elif not any(sample.startswith('jobe_runs_total') for sample in after):
+        output("Metrics parse OK. Skipped counter check: metrics are not enabled on this server")
+    elif after.get(key, 0) < before.get(key, 0) + 1:
+        output("********** TEST FAILED **************")
+        output(f"{key} went from {before.get(key, 0)} to {after.get(key, 0)} after a successful run")
+    else:
+        output("OK")
+
+
+def check_streamed_output():
+    """Check that the stdout of a streamed run is the same as that of the
+       equivalent buffered run, for output that has multibyte UTF-8
+       characters split across the server's 64 kB chunk boundaries and
+       control characters, and for output with invalid UTF-8, which is
+       sanitised.
+    """
+    output("\nTesting streamed output")
+    chunk_size = 65536
+    valid = "('a' * {0} + '\u20ac\U0001F600\x01\x1b') * 3".format(chunk_size - 1)
+    cases = [f'sys.stdout.buffer.write(({valid}).encode("utf-8"))',
+             f'sys.stdout.buffer.write(({valid}).encode("utf-8") + b"\\xff\\xfe" + b"\\xe2\\x82")']
+    failed = False
+    for code in cases:
+        run_spec = {'language_id': 'python3', 'sourcecode': 'import sys\n' + code,
+                    'sourcefilename': 'stream.py'}
+        results = []
+        for stream in [False, True]:
+            ok, result = do_http('POST', RUNS_RESOURCE,
+                                 json.dumps({'run_spec': dict(run_spec, stream=stream)}))
+            results.append(result if ok and isinstance(result, dict) else {})
+        buffered, streamed = results
+        if buffered.get('outcome') != 15 or buffered != streamed:
+            output(f"Streamed result differs from buffered result for program {code}")
+            failed = True
+    output("********** TEST FAILED **************" if failed else "OK")
+
+
 def normal_testing(langs_to_run):
     '''Do the normal tests of functionality over the given languages.'''
     do_get_languages()
@@ -1077,21 +1505,34 @@ def normal_testing(langs_to_run):
     output("{} tests, {} passed, {} failed, {} exceptions".format(
         tests_run, counters[0], counters[1], counters[2]))
 
+    check_bulk_files()
+    check_octet_stream_puts()
+    good_tests = [test for test in TEST_SET if test['language_id'] in langs_to_run and
+                  test['expect'].get('outcome') == 15]
+    if good_tests:
+        check_metrics(good_tests[0])
+    if 'python3' in langs_to_run:
+        check_batches()
+        check_streamed_output()
+
     if 'c' in langs_to_run:
         job = [job for job in TEST_SET if job['language_id'] == 'c'][0]
         output(f"\nChecking parallel submissions in C")
         check_multiple_submissions(job, NUM_PARALLEL_SUBMITS, 0)
         check_bad_cputime()
+        check_async_runs()
 
     return counters[1] + counters[2]
 
 
-def check_sustained_load(lang, starting_rate):
+def check_sustained_load(lang, starting_rate, overall_stats):
     """Check the achievable sustained load in the given language.
        Starting at half of the given rate, send jobs at a steady rate
        over a 30 second time window, making sure all are successful.
        Increase the rate until a single failure occurs.
-       Report the maximum achieved sustained rate.
+       Report the maximum achieved sustained rate, plus the latency
+       percentiles and throughput series at each rate. The latencies of
+       all runs are also merged into the given overall_stats.
     """
     rate = max(1, int(starting_rate * 0.5))  # Jobs per sec
     best_rate = None
@@ -1103,7 +1544,8 @@ def check_sustained_load(lang, starting_rate):
         print(f"Testing with rate of {rate} jobs/sec", end=': ')
         sys.stdout.flush()
         num_submits = int(int(ARGS.window) * rate)
-        if check_multiple_submissions(job, num_submits, 1 / rate) != GOOD_TEST:
+        stats = PerfStats()
+        if check_multiple_submissions(job, num_submits, 1 / rate, stats) != GOOD_TEST:
             failed = True
             print("Failed")
         else:
@@ -1113,6 +1555,8 @@ def check_sustained_load(lang, starting_rate):
             else:
                 rate = int(rate * 1.2)
             print("OK")
+        stats.report(show_throughput=True)
+        overall_stats.merge(stats)
     print(f"Sustained throughout rate: {best_rate} jobs/sec")
 
 
@@ -1126,15 +1570,19 @@ def check_performance(lang):
        Using the maximum throughput across all bursts as a starting point, then
        try finding the maximum sustainable rate over a 20 second window by
        sending jobs at that rate less 10%, increasing in steps of 20%,
-       until failure occurs."""
+       until failure occurs.
+       The latency percentiles of each burst are reported and finally the
+       latency percentiles over all runs of the whole performance check."""
     global ARGS
     num_submits = 1
     best_rate = 0
     job = [job for job in TEST_SET if job['language_id'] == lang][0]
+    overall_stats = PerfStats()
 
     while True:
         t0 = perf_counter()
-        outcome = check_multiple_submissions(job, num_submits, 0)
+        stats = PerfStats()
+        outcome = check_multiple_submissions(job, num_submits, 0, stats)
         t1 = perf_counter()
         print(f"{num_submits} parallel submits: ", end='')
         if outcome == GOOD_TEST:
@@ -1144,6 +1592,9 @@ def check_performance(lang):
             num_submits *= 2
         else:
             print("FAIL.")
+        stats.report()
+        overall_stats.merge(stats)
+        if outcome != GOOD_TEST:
             break
 
     lower_limit = num_submits // 2
@@ -1155,7 +1606,8 @@ def check_performance(lang):
         while lower_limit < upper_limit - 1:
             num_submits = (lower_limit + upper_limit) // 2
             t0 = perf_counter()
-            outcome = check_multiple_submissions(job, num_submits, 0)
+            stats = PerfStats()
+            outcome = check_multiple_submissions(job, num_submits, 0, stats)
             t1 = perf_counter()
             print(f"{num_submits} parallel submits: ", end='')
 
@@ -1167,12 +1619,16 @@ def check_performance(lang):
             else:
                 print("FAIL.")
                 upper_limit = num_submits
+            stats.report()
+            overall_stats.merge(stats)
 
 
     print()
     print(f"Maximum burst handled with no errors = {lower_limit} jobs")
     print(f"\nChecking maximum sustained throughput over {ARGS.window} sec window")
-    check_sustained_load(lang, best_rate)
+    check_sustained_load(lang, best_rate, overall_stats)
+    print(f"\nLatencies over all {lang} runs:")
+    overall_stats.report()
 
 
 def main():
@@ -1199,6 +1655,8 @@ other users' submissions to fail."""
         help='Measure performance instead of correctness')
     parser.add_argument('-b', '--binarysearch', action='store_true',
         help='Use binary search to refine throughoutput estimate')
+    parser.add_argument('-c', '--connections', type=int, default=DEFAULT_MAX_CONNECTIONS,
+        help=f'The maximum number of requests in flight at once with --perf (default {DEFAULT_MAX_CONNECTIONS})')
     parser.add_argument('-v', '--verbose', action='store_true',
         help='Print extra info during tests')
     parser.add_argument('langs', nargs='*',